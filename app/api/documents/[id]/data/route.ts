@@ -73,8 +73,10 @@ export async function GET(
       );
     }
 
-    // Get processed data from document processor
-    const dataResponse = await fetch(`${API_URL}/get-document-data/${batchId}`, {
+    // Get processed data from document processor, passing through the file,
+    // page range, field and format selection of the viewer
+    const query = request.nextUrl.search;
+    const dataResponse = await fetch(`${API_URL}/get-document-data/${batchId}${query}`, {
       method: "GET",
       headers: {
         "Content-Type": "application/json"
@@ -89,6 +91,16 @@ export async function GET(
       );
     }
 
+    // Stream NDJSON pages straight through instead of buffering the whole document
+    if (request.nextUrl.searchParams.get("format") === "ndjson") {
+      return new NextResponse(dataResponse.body, {
+        headers: {
+          "Content-Type": "application/x-ndjson",
+          "X-Document-Url": document.file_url
+        }
+      });
+    }
+
     // Return the response from the document processor with the document's URL
     const responseData = await dataResponse.json();
 
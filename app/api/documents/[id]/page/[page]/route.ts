@@ -0,0 +1,106 @@
+import { NextRequest, NextResponse } from "next/server";
+import { createRouteHandlerClient } from "@supabase/auth-helpers-nextjs";
+import { cookies } from "next/headers";
+
+const API_URL = process.env.DOCUMENT_PROCESSOR_API_URL || "http://localhost:5001";
+
+export async function GET(
+  request: NextRequest,
+  { params }: { params: { id: string; page: string } }
+) {
+  try {
+    // Verify authentication
+    const supabase = createRouteHandlerClient({ cookies });
+    const { data: { session } } = await supabase.auth.getSession();
+
+    if (!session) {
+      return NextResponse.json(
+        { success: false, message: "Unauthorized" },
+        { status: 401 }
+      );
+    }
+
+    const documentId = params.id;
+    const page = parseInt(params.page, 10);
+    if (isNaN(page) || page < 0) {
+      return NextResponse.json(
+        { success: false, message: "Invalid page number" },
+        { status: 400 }
+      );
+    }
+
+    // Get the document details from database
+    const { data: document, error: docError } = await supabase
+      .from("documents")
+      .select("organization_id, metadata")
+      .eq("id", documentId)
+      .single();
+
+    if (docError || !document) {
+      return NextResponse.json(
+        { success: false, message: "Document not found" },
+        { status: 404 }
+      );
+    }
+
+    // Check if user is an administrator from user metadata
+    const { data: userData } = await supabase.auth.getUser();
+    const isAdmin = userData?.user?.user_metadata?.role_id === 'admin';
+
+    // If not admin, verify user has access to this organization
+    if (!isAdmin) {
+      const { data: memberData, error: memberError } = await supabase
+        .from("user_organizations")
+        .select("role_id")
+        .eq("user_id", session.user.id)
+        .eq("organization_id", document.organization_id)
+        .single();
+
+      if (memberError || !memberData) {
+        return NextResponse.json(
+          { success: false, message: "You don't have access to this document" },
+          { status: 403 }
+        );
+      }
+    }
+
+    // Get batch ID from metadata
+    const batchId = document.metadata?.batch_id;
+    if (!batchId) {
+      return NextResponse.json(
+        { success: false, message: "Document has not been processed yet" },
+        { status: 400 }
+      );
+    }
+
+    // Each document is processed as its own batch, so it is always file 0.
+    // The dpi, highlight and format parameters of the viewer are passed through.
+    const query = request.nextUrl.search;
+    const imageResponse = await fetch(`${API_URL}/render-page/${batchId}/0/${page}${query}`);
+
+    if (!imageResponse.ok) {
+      const errorData = await imageResponse.json();
+      return NextResponse.json(
+        { success: false, message: `Failed to render page: ${errorData.error}` },
+        { status: imageResponse.status === 404 || imageResponse.status === 400 ? imageResponse.status : 500 }
+      );
+    }
+
+    // Stream the image straight through
+    return new NextResponse(imageResponse.body, {
+      headers: {
+        "Content-Type": imageResponse.headers.get("Content-Type") || "image/png",
+        "Cache-Control": "private, max-age=3600"
+      }
+    });
+  } catch (error) {
+    console.error("Page render error:", error);
+    return NextResponse.json(
+      { 
+        success: false, 
+        message: error instanceof Error ? error.message : "An unknown error occurred" 
+      },
+      { status: 500 }
+    );
+  }
+}
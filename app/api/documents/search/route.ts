@@ -0,0 +1,116 @@
+import { NextRequest, NextResponse } from "next/server";
+import { createRouteHandlerClient } from "@supabase/auth-helpers-nextjs";
+import { cookies } from "next/headers";
+
+const API_URL = process.env.DOCUMENT_PROCESSOR_API_URL || "http://localhost:5001";
+
+export async function POST(request: NextRequest) {
+  try {
+    // Verify authentication
+    const supabase = createRouteHandlerClient({ cookies });
+    const { data: { session } } = await supabase.auth.getSession();
+
+    if (!session) {
+      return NextResponse.json(
+        { success: false, message: "Unauthorized" },
+        { status: 401 }
+      );
+    }
+
+    // Parse request body
+    const body = await request.json();
+    const { organizationId, query, topK } = body;
+
+    if (!organizationId || !query) {
+      return NextResponse.json(
+        { success: false, message: "Organization ID and query are required" },
+        { status: 400 }
+      );
+    }
+
+    // Check if user is an administrator from user metadata
+    const { data: userData } = await supabase.auth.getUser();
+    const isAdmin = userData?.user?.user_metadata?.role_id === 'admin';
+
+    // If not admin, verify user has access to this organization
+    if (!isAdmin) {
+      const { data: memberData, error: memberError } = await supabase
+        .from("user_organizations")
+        .select("role_id")
+        .eq("user_id", session.user.id)
+        .eq("organization_id", organizationId)
+        .single();
+
+      if (memberError || !memberData) {
+        return NextResponse.json(
+          { success: false, message: "You don't have access to this organization" },
+          { status: 403 }
+        );
+      }
+    }
+
+    // Search all of the organization's processed documents
+    const searchResponse = await fetch(`${API_URL}/search-documents`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json"
+      },
+      body: JSON.stringify({
+        organization_id: organizationId,
+        query,
+        top_k: topK
+      })
+    });
+
+    if (!searchResponse.ok) {
+      const errorData = await searchResponse.json();
+      return NextResponse.json(
+        { success: false, message: `Failed to search documents: ${errorData.error}` },
+        { status: 500 }
+      );
+    }
+
+    const responseData = await searchResponse.json();
+
+    // Map the batches of the results back to their documents
+    const batchIds = Array.from(new Set(responseData.results.map((result: any) => result.batch_id)));
+    const { data: documents, error: docError } = batchIds.length
+      ? await supabase
+          .from("documents")
+          .select("id, name, metadata")
+          .eq("organization_id", organizationId)
+          .in("metadata->>batch_id", batchIds)
+      : { data: [], error: null };
+
+    if (docError) {
+      throw new Error(`Failed to look up documents: ${docError.message}`);
+    }
+
+    const documentsByBatch = new Map(
+      (documents || []).map((document: any) => [document.metadata?.batch_id, document])
+    );
+
+    return NextResponse.json({
+      success: true,
+      data: {
+        ...responseData,
+        // Results of batches whose document was deleted are left out
+        results: responseData.results
+          .filter((result: any) => documentsByBatch.has(result.batch_id))
+          .map((result: any) => {
+            const document: any = documentsByBatch.get(result.batch_id);
+            return { ...result, documentId: document.id, documentName: document.name };
+          })
+      }
+    });
+  } catch (error) {
+    console.error("Document search error:", error);
+    return NextResponse.json(
+      {
+        success: false,
+        message: error instanceof Error ? error.message : "An unknown error occurred"
+      },
+      { status: 500 }
+    );
+  }
+}
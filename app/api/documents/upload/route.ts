@@ -54,7 +54,6 @@ export async function POST(request: NextRequest) {
       );
     }
 
-    const documentIds: string[] = [];
     const uploadPromises = files.map(async (file) => {
       const documentId = uuidv4();
       const fileExtension = file.name.split(".").pop();
@@ -96,34 +95,52 @@ export async function POST(request: NextRequest) {
         throw new Error(`Failed to create document record: ${dbError.message}`);
       }
 
-      // Download the file for processing
-      const fileResponse = await fetch(urlData.publicUrl);
-      const fileBlob = await fileResponse.blob();
-      
-      // Create a FormData object to send the file to the document processor
-      const processingFormData = new FormData();
-      processingFormData.append('files', fileBlob, file.name);
-      
-      // Send to our document processing microservice
-      const processingResponse = await fetch(`${API_URL}/process-documents`, {
-        method: "POST",
-        body: processingFormData
-      });
-
-      if (!processingResponse.ok) {
-        const errorData = await processingResponse.json();
-        throw new Error(`Failed to queue document for processing: ${errorData.message}`);
+      return { documentId, url: urlData.publicUrl };
+    });
+
+    // Wait for all uploads to complete
+    const uploaded = await Promise.all(uploadPromises);
+
+    // Queue all files with our document processing microservice in one call;
+    // it fetches them from storage itself, and creates one batch per document
+    // whose progress is available from /batch-status and which is added to the
+    // organization's search index once parsed
+    const processingResponse = await fetch(`${API_URL}/process-references`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        references: uploaded.map((document) => document.url),
+        organization_id: organizationId,
+        async: true,
+        bulk: true
+      })
+    });
+
+    if (!processingResponse.ok) {
+      const errorData = await processingResponse.json();
+      throw new Error(`Failed to queue documents for processing: ${errorData.error}`);
+    }
+
+    // Store the batch IDs in our database; batches come back in upload order
+    const processingData = await processingResponse.json();
+    const documentIds: string[] = [];
+    await Promise.all(uploaded.map(async ({ documentId }, index) => {
+      const batch = processingData.batches[index];
+      if (batch.error) {
+        console.error(`Failed to queue document ${documentId} for processing:`, batch.error);
+        await supabase
+          .from("documents")
+          .update({ status: "failed", metadata: { error: batch.error } })
+          .eq("id", documentId);
+        return;
       }
-      
-      // Store the batch ID in our database
-      const processingData = await processingResponse.json();
+
       const { data: updateData, error: updateError } = await supabase
         .from("documents")
         .update({
           status: "processing",
           metadata: {
-            batch_id: processingData.batch_id,
-            processing_time: processingData.processing_time_seconds
+            batch_id: batch.batch_id
           }
         })
         .eq("id", documentId);
@@ -133,10 +150,7 @@ export async function POST(request: NextRequest) {
       }
 
       documentIds.push(documentId);
-    });
-
-    // Wait for all uploads to complete
-    await Promise.all(uploadPromises);
+    }));
 
     return NextResponse.json({
       success: true,
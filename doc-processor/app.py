@@ -1,15 +1,36 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import os
 import tempfile
 import uuid
 import json
 import sys
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
+from jobs import JobQueue, initial_status
+from result_store import PageWriter, ResultStore, SQLiteBackend
+from parse_cache import ParseCache, DiskTier, cache_key
+from uploads import parse_page_ranges, save_stream, save_upload
+from references import error_status, fetch_references
+from retrieval import ChunkIndex, best_chunks
+from search_index import SearchIndex
+from chunking import DEFAULT_GRANULARITY, GRANULARITIES, file_digest
+from columnar import ChunkView, PageChunks, compact_result, dump_result, is_columnar, to_json
+from rendering import (FORMATS, MAX_DPI, MIN_DPI, RenderCache, page_count, prerender, render_file_page, render_key,
+                       webp_available)
+import metrics
+from metrics import SamplingProfiler
 
 # Add parent directory to path to access the Mock SDK
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Page-by-page parsing and the granularity, pages, file_hashes and worker
+# options are only available with the local mock SDK
+parse_file_pages = None
+LOCAL_MOCK_SDK = False
 try:
     # Try to import the real SDK if available
     from agentic_doc.parse import parse_documents
@@ -21,93 +42,850 @@ except ImportError:
         print("Using mock SDK from next-pdf-app")
     except ImportError:
         # Fallback to local mock implementation
-        from mock_sdk import parse_documents
+        from mock_sdk import parse_documents, parse_file_pages
+        LOCAL_MOCK_SDK = True
         print("Using local mock SDK")
 
+class ChunkJSONProvider(DefaultJSONProvider):
+    """JSON provider that also serializes columnar chunk pages"""
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, (PageChunks, ChunkView)):
+            return to_json(o)
+        return DefaultJSONProvider.default(o)
+    
+    def dumps(self, obj, **kwargs):
+        with metrics.stage_timer("serialize"):
+            return super().dumps(obj, **kwargs)
+
 app = Flask(__name__)
+app.json = ChunkJSONProvider(app)
 CORS(app)  # Enable CORS for all routes
 
 # Configuration
 UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'doc_processor_uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
+# Uploads are streamed to disk, so the ceiling only bounds disk use
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('DOC_PROCESSOR_MAX_UPLOAD_MB', 512)) * 1024 * 1024
+
+def is_truthy(value):
+    """Interpret a query or form parameter as a boolean flag"""
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+def request_param(name, default=''):
+    """Read a parameter from the query string or, for form posts, the form"""
+    if name in request.args:
+        return request.args[name]
+    if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        return request.form.get(name, default)
+    return default
+
+# Documents can also be passed by reference: URLs under these prefixes and files
+# below these shared directories, used in place. URLs default to the Supabase
+# storage objects of the platform, and no URL is fetched without a prefix.
+SUPABASE_URL = os.environ.get('SUPABASE_URL') or os.environ.get('NEXT_PUBLIC_SUPABASE_URL', '')
+app.config['ALLOWED_URL_PREFIXES'] = [
+    prefix.strip()
+    for prefix in os.environ.get(
+        'DOC_PROCESSOR_ALLOWED_URL_PREFIXES',
+        f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/" if SUPABASE_URL else ''
+    ).split(',')
+    if prefix.strip()
+]
+app.config['SHARED_ROOTS'] = [
+    root for root in os.environ.get('DOC_PROCESSOR_SHARED_ROOTS', '').split(os.pathsep) if root
+]
+app.config['MAX_REFERENCES'] = int(os.environ.get('DOC_PROCESSOR_MAX_REFERENCES', 1000))
+
+# Number of worker processes used for background parsing
+app.config['PARSE_WORKERS'] = int(os.environ.get('DOC_PROCESSOR_WORKERS', os.cpu_count() or 1))
+# Each of those processes extracts pages with its own pool, so share the CPUs
+# between them rather than starting PARSE_WORKERS x CPU count processes
+app.config['JOB_PAGE_WORKERS'] = int(os.environ.get(
+    'DOC_PROCESSOR_JOB_PAGE_WORKERS', max(1, (os.cpu_count() or 1) // app.config['PARSE_WORKERS'])
+))
+
+# Result store shared by all workers on this node
+DATA_FOLDER = os.environ.get('DOC_PROCESSOR_DATA_DIR', os.path.join(tempfile.gettempdir(), 'doc_processor_data'))
+os.makedirs(DATA_FOLDER, exist_ok=True)
+app.config['DATA_FOLDER'] = DATA_FOLDER
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('DOC_PROCESSOR_RESULT_CACHE_SIZE', 32))
+app.config['RESULT_TTL_SECONDS'] = float(os.environ.get('DOC_PROCESSOR_RESULT_TTL', 24 * 3600))
+
+def remove_files(batch_id, file_paths):
+    """Delete the temporary files of a batch; referenced files on a shared volume are left alone"""
+    for file_path in file_paths:
+        if os.path.dirname(os.path.realpath(file_path)) != os.path.realpath(UPLOAD_FOLDER):
+            continue
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except Exception as e:
+            print(f"Error removing file {file_path}: {e}")
+
+# Organization-wide search index across batches, split into this many shard files
+app.config['SEARCH_SHARDS'] = int(os.environ.get('DOC_PROCESSOR_SEARCH_SHARDS', 8))
+# Largest top_k accepted by /ask-question and /search-documents
+app.config['MAX_SEARCH_RESULTS'] = int(os.environ.get('DOC_PROCESSOR_MAX_SEARCH_RESULTS', 100))
+search_index = SearchIndex(os.path.join(DATA_FOLDER, 'search'), shards=app.config['SEARCH_SHARDS'])
+# Index updates of this worker are applied in order in the background
+index_executor = ThreadPoolExecutor(max_workers=1)
+
+def index_batch(batch_id, organization_id, result):
+    """Queue a finished batch for adding to its organization's search index"""
+    def run():
+        try:
+            search_index.add_batch(organization_id, batch_id, result)
+            # The batch was cleaned up by another worker while it was being indexed
+            if batch_id not in processed_docs:
+                search_index.remove_batch(batch_id)
+        except Exception as e:
+            print(f"Error indexing batch {batch_id}: {e}")
+    index_executor.submit(run)
+
+def unindex_batch(batch_id):
+    """Remove a batch from the search index once any pending update of it is applied"""
+    try:
+        index_executor.submit(search_index.remove_batch, batch_id).result()
+    except Exception as e:
+        print(f"Error removing batch {batch_id} from the search index: {e}")
+
+def evict_batch(batch_id, file_paths):
+    """Drop an expired batch from the search index and delete its files"""
+    unindex_batch(batch_id)
+    remove_files(batch_id, file_paths)
 
 # Storage for processed documents
-processed_docs = {}
+processed_docs = ResultStore(
+    SQLiteBackend(os.path.join(DATA_FOLDER, 'results.db')),
+    cache_size=app.config['RESULT_CACHE_SIZE'],
+    ttl_seconds=app.config['RESULT_TTL_SECONDS'],
+    on_evict=evict_batch,
+    blob_dir=os.path.join(DATA_FOLDER, 'results')
+)
+
+def cache_results(result, file_hashes, parse_options, page_counts):
+    """Add freshly parsed files, given by their content hashes, to the parse cache with their page counts"""
+    for path, pages in result.items():
+        if path in file_hashes:
+            parse_cache.put(cache_key(file_hashes[path], parse_options), pages, page_counts.get(path))
+
+def merge_results(file_paths, *results):
+    """Combine per-file results, keeping the order of the uploaded files"""
+    merged = {}
+    for path in file_paths:
+        for result in results:
+            if path in result:
+                merged[path] = result[path]
+                break
+    return merged
+
+def store_batch(batch_id, job, status):
+    """
+    Store the result of a finished background job; pages its workers
+    committed while parsing are read back from the result store page by page
+    """
+    context = job["context"]
+    file_hashes = context.get("file_hashes", {})
+    # Counted while parsing, or taken from the parse cache for cached files
+    page_counts = {**context.get("page_counts", {}), **job["page_counts"]}
+    record = {
+        "result": merge_results(job["files"], compact_result(job["result"])),
+        "files": job["files"],
+        "file_hashes": file_hashes,
+        "page_counts": page_counts,
+        "organization_id": context.get("organization_id"),
+        "processed_at": job["finished_at"]
+    }
+    stored = processed_docs.put_committed(batch_id, record, job["committed"], status=status)
+    
+    # The batch was cleaned up while it was still parsing, so its files may be incomplete
+    if not stored:
+        remove_files(batch_id, job["files"])
+        return
+    # Only files that were parsed to the end are in the result
+    cached = set(context.get("cached", ()))
+    result = record["result"]
+    cache_results({path: pages for path, pages in result.items() if path not in cached},
+                  file_hashes, context.get("parse_options"), page_counts)
+    if context.get("organization_id"):
+        index_batch(batch_id, context["organization_id"], result)
+    if context.get("prerender_pages"):
+        prerender_files(job["files"], file_hashes, context["prerender_pages"])
+
+# Parse results of previously seen files, keyed by content hash
+app.config['PARSE_CACHE_SIZE'] = int(os.environ.get('DOC_PROCESSOR_PARSE_CACHE_SIZE', 256))
+app.config['PARSE_CACHE_DISK'] = is_truthy(os.environ.get('DOC_PROCESSOR_PARSE_CACHE_DISK', 'false'))
+parse_cache = ParseCache(
+    max_entries=app.config['PARSE_CACHE_SIZE'],
+    disk_tier=DiskTier(os.path.join(DATA_FOLDER, 'parse_cache.db')) if app.config['PARSE_CACHE_DISK'] else None
+)
+
+# Rendered page images, bounded by their total size
+app.config['RENDER_CACHE_BYTES'] = int(os.environ.get('DOC_PROCESSOR_RENDER_CACHE_MB', 256)) * 1024 * 1024
+app.config['RENDER_DPI'] = int(os.environ.get('DOC_PROCESSOR_RENDER_DPI', 96))
+# Number of leading pages of each file rendered as soon as it is parsed
+app.config['PRERENDER_PAGES'] = int(os.environ.get('DOC_PROCESSOR_PRERENDER_PAGES', 0))
+render_cache = RenderCache(app.config['RENDER_CACHE_BYTES'])
+# Pre-rendering runs in the background so it never delays a response
+prerender_executor = ThreadPoolExecutor(max_workers=1)
+
+def prerender_files(file_paths, file_hashes, pages):
+    """Queue the first pages of parsed files for rendering into the render cache"""
+    def run():
+        for path in file_paths:
+            try:
+                prerender(render_cache, path, file_hashes.get(path) or file_digest(path), pages,
+                          dpi=app.config['RENDER_DPI'])
+            except Exception as e:
+                print(f"Error pre-rendering {path}: {e}")
+    prerender_executor.submit(run)
+
+# Background parsing for job mode requests
+job_queue = JobQueue(
+    parse_documents,
+    max_workers=app.config['PARSE_WORKERS'],
+    on_update=processed_docs.set_status,
+    on_complete=store_batch,
+    page_parse_fn=parse_file_pages,
+    page_writer=PageWriter(processed_docs.backend.path)
+)
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    """Report uploads over MAX_CONTENT_LENGTH as JSON like every other error"""
+    return jsonify({"error": f"Upload exceeds the {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)}MB limit"}), 413
+
+# Requests sent with "X-Profile: true" are sampled by a profiler when this is enabled
+app.config['PROFILING'] = is_truthy(os.environ.get('DOC_PROCESSOR_PROFILING', 'false'))
+app.config['PROFILE_INTERVAL'] = float(os.environ.get('DOC_PROCESSOR_PROFILE_INTERVAL_MS', 5)) / 1000
+# Only the most recent profiles of the node are kept
+app.config['PROFILE_KEEP'] = int(os.environ.get('DOC_PROCESSOR_PROFILE_KEEP', 100))
+PROFILE_FOLDER = os.path.join(DATA_FOLDER, 'profiles')
+
+def prune_profiles():
+    """Delete all but the newest PROFILE_KEEP profiles"""
+    profiles = []
+    try:
+        for entry in os.scandir(PROFILE_FOLDER):
+            if entry.name.endswith('.folded'):
+                profiles.append((entry.stat().st_mtime, entry.path))
+    except OSError:
+        # Pruned by another worker at the same time
+        pass
+    profiles.sort(reverse=True)
+    for _, path in profiles[app.config['PROFILE_KEEP']:]:
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+
+def worker_gauges():
+    """Gauges of this worker's memory, summed over the node's workers by /metrics"""
+    return [
+        ('doc_processor_result_cache_batches', 'Batches cached in the workers\' memory', processed_docs.cached_batches),
+        ('doc_processor_parse_cache_entries', 'Parse results cached in the workers\' memory', len(parse_cache)),
+        ('doc_processor_render_cache_bytes', 'Size of the page images cached in the workers', render_cache.size_bytes),
+        ('doc_processor_render_cache_entries', 'Page images cached in the workers', len(render_cache))
+    ]
+
+# Every web worker writes its metrics under the data directory, so a scrape
+# answered by any of them covers the whole node
+app.config['METRICS_FLUSH_SECONDS'] = float(os.environ.get('DOC_PROCESSOR_METRICS_FLUSH_SECONDS', 5))
+shared_metrics = metrics.SharedMetrics(os.path.join(DATA_FOLDER, 'metrics'),
+                                       interval=app.config['METRICS_FLUSH_SECONDS'], worker_gauges=worker_gauges)
+
+@app.before_request
+def start_request_metrics():
+    shared_metrics.start()
+    g.request_start = time.perf_counter()
+    if app.config['PROFILING'] and is_truthy(request.headers.get('X-Profile', '')):
+        g.profiler = SamplingProfiler(threading.get_ident(), app.config['PROFILE_INTERVAL']).start()
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.registry.observe('doc_processor_request_seconds', time.perf_counter() - g.request_start,
+                             endpoint=endpoint, method=request.method)
+    
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        profile_id = str(uuid.uuid4())
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        with open(os.path.join(PROFILE_FOLDER, f"{profile_id}.folded"), 'w') as f:
+            f.write(profiler.folded())
+        prune_profiles()
+        response.headers['X-Profile-Id'] = profile_id
+        response.headers['X-Profile-Samples'] = str(profiler.samples)
+    return response
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "service": "document-processor"})
 
-@app.route('/process-documents', methods=['POST'])
-def process_documents():
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
     """
-    Process uploaded documents using the SDK
+    Prometheus metrics of all worker processes on the node, including the
+    stage timings recorded by their parsing pool workers
+    """
+    node_registry, gauges = shared_metrics.collect()
+    upload_bytes, upload_files = metrics.directory_usage(app.config['UPLOAD_FOLDER'])
+    data_bytes, _ = metrics.directory_usage(DATA_FOLDER)
+    gauges = [
+        ('doc_processor_result_store_batches', 'Batches in the shared result store', len(processed_docs)),
+        ('doc_processor_upload_dir_bytes', 'Disk space used by uploaded files', upload_bytes),
+        ('doc_processor_upload_dir_files', 'Uploaded files on disk', upload_files),
+        ('doc_processor_data_dir_bytes', 'Disk space used by the result store and caches', data_bytes)
+    ] + gauges
+    return Response(node_registry.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
     """
-    if 'files' not in request.files:
-        return jsonify({"error": "No files provided"}), 400
+    Sampled stacks of a profiled request in the folded flame graph format
+    """
+    try:
+        profile_id = str(uuid.UUID(profile_id))
+    except ValueError:
+        return jsonify({"error": "Profile not found"}), 404
+    path = os.path.join(PROFILE_FOLDER, f"{profile_id}.folded")
+    if not os.path.exists(path):
+        return jsonify({"error": "Profile not found"}), 404
+    with open(path) as f:
+        return Response(f.read(), mimetype='text/plain')
+
+def read_parse_options(get_param):
+    """
+    Read the chunk granularity and page selection of a processing request
+
+    Returns:
+        (parse options, None), or (None, error response) if a parameter is invalid
+    """
+    # How spans are merged into chunks: span, line, block or paragraph
+    granularity = get_param('granularity', DEFAULT_GRANULARITY)
+    if granularity not in GRANULARITIES:
+        return None, (jsonify({"error": f"granularity must be one of: {', '.join(GRANULARITIES)}"}), 400)
+    parse_options = {"granularity": granularity}
     
-    files = request.files.getlist('files')
-    if not files or all(file.filename == '' for file in files):
-        return jsonify({"error": "No files selected"}), 400
+    try:
+        pages = parse_page_ranges(get_param('pages'))
+    except ValueError as e:
+        return None, (jsonify({"error": f"Invalid pages parameter: {e}"}), 400)
+    if pages is not None:
+        parse_options["pages"] = pages
+    return parse_options, None
+
+def read_prerender_pages(get_param):
+    """
+    Read how many leading pages of each file to render once parsed
+
+    Returns:
+        (page count, None), or (None, error response) if the parameter is invalid
+    """
+    try:
+        pages = int(get_param('prerender', app.config['PRERENDER_PAGES']) or 0)
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": "prerender must be an integer"}), 400)
+    if pages < 0:
+        return None, (jsonify({"error": "prerender must not be negative"}), 400)
+    return pages, None
+
+def sdk_options(parse_options, **extra):
+    """Keyword arguments for parse_documents; the real SDK takes none of the local mock's options"""
+    return dict(parse_options, **extra) if LOCAL_MOCK_SDK else {}
+
+def start_batch(saved_files, file_hashes, parse_options, run_async, prerender_pages=0, organization_id=None):
+    """
+    Parse saved files as a new batch, reusing cached results, either right
+    away or in the background, then add it to its organization's search index
+    and optionally pre-render its first pages
+
+    Returns:
+        Response body and status code
+    """
+    # Reuse the results and page counts of files whose content was parsed before
+    cached, page_counts = {}, {}
+    for path in saved_files:
+        entry = parse_cache.get(cache_key(file_hashes[path], parse_options))
+        if entry is not None:
+            cached[path], count = entry
+            if count is not None:
+                page_counts[path] = count
+    cache_hit = len(cached) == len(saved_files)
     
-    # Save uploaded files to temp directory
-    saved_files = []
-    for file in files:
-        if file and file.filename:
-            filename = secure_filename(file.filename)
-            temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{filename}")
-            file.save(temp_path)
-            saved_files.append(temp_path)
+    # Generate a unique ID for this batch of documents
+    batch_id = str(uuid.uuid4())
     
-    if not saved_files:
-        return jsonify({"error": "No valid files uploaded"}), 400
+    if not cache_hit and run_async:
+        try:
+            processed_docs.create(batch_id, saved_files, initial_status(batch_id, saved_files, done=cached))
+            status = job_queue.submit(batch_id, saved_files, cached=cached, context={
+                "file_hashes": {path: file_hashes[path] for path in saved_files},
+                "cached": list(cached),
+                "page_counts": page_counts,
+                "parse_options": parse_options,
+                "prerender_pages": prerender_pages,
+                "organization_id": organization_id
+            }, **sdk_options(parse_options, file_hashes=file_hashes, page_workers=app.config['JOB_PAGE_WORKERS']))
+        except Exception as e:
+            return {"error": str(e)}, 500
+        
+        return {
+            "batch_id": batch_id,
+            "document_count": len(saved_files),
+            "status": status["status"],
+            "status_url": f"/batch-status/{batch_id}",
+            "cache_hit": False,
+            "cached_documents": len(cached)
+        }, 202
     
     try:
-        # Process documents using SDK
+        # Process documents using SDK, skipping files served from the cache
         start_time = time.time()
-        result = parse_documents(saved_files)
+        misses = [path for path in saved_files if path not in cached]
+        options = sdk_options(parse_options, file_hashes=file_hashes, page_counts=page_counts)
+        parsed = compact_result(parse_documents(misses, **options)) if misses else {}
+        result = merge_results(saved_files, cached, parsed)
         processing_time = time.time() - start_time
         
-        # Generate a unique ID for this batch of documents
-        batch_id = str(uuid.uuid4())
-        processed_docs[batch_id] = {
+        status = initial_status(batch_id, saved_files, done=saved_files)
+        processed_docs.create(batch_id, saved_files, status)
+        processed_docs.put(batch_id, {
             "result": result,
+            "index": ChunkIndex.build(result),
             "files": saved_files,
-            "processed_at": time.time()
-        }
+            "file_hashes": {path: file_hashes[path] for path in saved_files},
+            "page_counts": page_counts,
+            "organization_id": organization_id,
+            "processed_at": status["finished_at"]
+        })
+        cache_results(parsed, file_hashes, parse_options, page_counts)
+        if organization_id:
+            index_batch(batch_id, organization_id, result)
+        if prerender_pages:
+            prerender_files(saved_files, file_hashes, prerender_pages)
         
         # Format the response
         formatted_result = {
             "batch_id": batch_id,
             "document_count": len(saved_files),
             "processing_time_seconds": processing_time,
-            "status": "success"
+            "status": "success",
+            "cache_hit": cache_hit,
+            "cached_documents": len(cached)
         }
         
-        return jsonify(formatted_result)
+        return formatted_result, 200
     
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+
+@app.route('/process-documents', methods=['POST'])
+def process_documents():
+    """
+    Process uploaded documents using the SDK
+
+    Files are sent as multipart "files" fields, or as a single raw PDF body
+    (application/pdf or application/octet-stream) named by the X-Filename
+    header or the filename parameter; either way they are streamed to disk.
+
+    With ?async=true the files are queued for background parsing and the
+    endpoint returns 202 with a batch_id that can be polled via /batch-status.
+    Pages are then readable from /get-document-data as soon as they are parsed.
+    With pages=0-4,9 only those (0-based) pages are parsed, and with
+    prerender=N the first N pages of each file are rendered into the render
+    cache once parsed. Batches processed with an organization_id are added to
+    that organization's index for /search-documents.
+    """
+    raw_upload = request.mimetype in ('application/pdf', 'application/octet-stream')
+    if not raw_upload:
+        if 'files' not in request.files:
+            return jsonify({"error": "No files provided"}), 400
+        
+        files = request.files.getlist('files')
+        if not files or all(file.filename == '' for file in files):
+            return jsonify({"error": "No files selected"}), 400
+    
+    parse_options, error = read_parse_options(request_param)
+    if error:
+        return error
+    prerender_pages, error = read_prerender_pages(request_param)
+    if error:
+        return error
+    
+    # Save uploaded files to temp directory, hashing their content as it arrives
+    saved_files = []
+    file_hashes = {}
+    max_bytes = app.config['MAX_CONTENT_LENGTH']
+    try:
+        if raw_upload:
+            filename = secure_filename(request.headers.get('X-Filename', request.args.get('filename', 'document.pdf')))
+            temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{filename or 'document.pdf'}")
+            file_hashes[temp_path] = save_stream(request.stream, temp_path, max_bytes)[0]
+            saved_files.append(temp_path)
+        else:
+            for file in files:
+                if file and file.filename:
+                    filename = secure_filename(file.filename)
+                    temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{filename}")
+                    file_hashes[temp_path] = save_upload(file, temp_path, max_bytes)
+                    saved_files.append(temp_path)
+    except RequestEntityTooLarge as e:
+        remove_files(None, saved_files)
+        return upload_too_large(e)
+    
+    if not saved_files:
+        return jsonify({"error": "No valid files uploaded"}), 400
+    
+    body, status_code = start_batch(saved_files, file_hashes, parse_options, is_truthy(request_param('async')),
+                                    prerender_pages, organization_id=request_param('organization_id') or None)
+    return jsonify(body), status_code
+
+@app.route('/process-references', methods=['POST'])
+def process_references():
+    """
+    Process documents given by reference instead of uploading them
+    
+    JSON body:
+        references: Storage URLs, downloaded concurrently through a pooled
+            session with retries, or paths below DOC_PROCESSOR_SHARED_ROOTS,
+            parsed in place and never deleted
+        async, granularity, pages, prerender, organization_id: As for /process-documents
+        bulk: Create one batch per document instead of a single batch, and
+            report a batch or an error for each reference
+    """
+    data = request.get_json(silent=True)
+    if not data or not data.get("references"):
+        return jsonify({"error": "No references provided"}), 400
+    
+    references = data["references"]
+    if not isinstance(references, list) or not all(isinstance(ref, str) for ref in references):
+        return jsonify({"error": "references must be a list of URLs or paths"}), 400
+    if len(references) > app.config['MAX_REFERENCES']:
+        return jsonify({"error": f"At most {app.config['MAX_REFERENCES']} references can be processed at once"}), 400
+    
+    def param(name, default=''):
+        return data.get(name, request.args.get(name, default))
+    
+    parse_options, error = read_parse_options(param)
+    if error:
+        return error
+    prerender_pages, error = read_prerender_pages(param)
+    if error:
+        return error
+    run_async = is_truthy(param('async'))
+    organization_id = str(param('organization_id') or '') or None
+    
+    documents = fetch_references(
+        references,
+        app.config['UPLOAD_FOLDER'],
+        max_bytes=app.config['MAX_CONTENT_LENGTH'],
+        allowed_prefixes=app.config['ALLOWED_URL_PREFIXES'],
+        shared_roots=app.config['SHARED_ROOTS']
+    )
+    
+    if is_truthy(param('bulk')):
+        batches = []
+        for document in documents:
+            if "error" in document:
+                batches.append({
+                    "reference": document["reference"],
+                    "error": str(document["error"]),
+                    "status_code": error_status(document["error"])
+                })
+                continue
+            body, status_code = start_batch([document["path"]], {document["path"]: document["hash"]},
+                                            parse_options, run_async, prerender_pages, organization_id)
+            batches.append(dict(body, reference=document["reference"], status_code=status_code))
+        
+        return jsonify({
+            "batches": batches,
+            "document_count": len(documents),
+            "failed": sum(1 for batch in batches if "error" in batch)
+        })
+    
+    failed = [document for document in documents if "error" in document]
+    if failed:
+        remove_files(None, [document["path"] for document in documents if document.get("owned")])
+        return jsonify({
+            "error": f"Could not fetch {failed[0]['reference']}: {failed[0]['error']}",
+            "failed_references": [document["reference"] for document in failed]
+        }), error_status(failed[0]["error"])
+    
+    saved_files = [document["path"] for document in documents]
+    file_hashes = {document["path"]: document["hash"] for document in documents}
+    body, status_code = start_batch(saved_files, file_hashes, parse_options, run_async, prerender_pages,
+                                    organization_id)
+    return jsonify(body), status_code
+
+def find_batch_or_status(batch_id, allow_partial=False):
+    """
+    Look up a finished batch, or with allow_partial the pages committed so
+    far by a batch that is still parsing.
+    
+    Returns:
+        (batch, None) when the batch is ready, otherwise (None, error response)
+    """
+    batch = processed_docs.get(batch_id)
+    if batch is not None:
+        return batch, None
+    
+    status = job_queue.status(batch_id) or processed_docs.get_status(batch_id)
+    if status is None:
+        return None, (jsonify({"error": "Batch ID not found"}), 404)
+    
+    # Serve the pages committed so far while the batch is still parsing
+    if allow_partial and status["status"] in ("queued", "running"):
+        partial = processed_docs.get_partial(batch_id)
+        if partial is not None:
+            partial["status"] = status
+            return partial, None
+    return None, (jsonify(status), 202)
+
+def find_file(batch, file):
+    """Path of a batch's file given by name or index, or None"""
+    for file_index, file_path in enumerate(batch["files"]):
+        if file in (os.path.basename(file_path), str(file_index)):
+            return file_path
+    return None
+
+def iter_pages(batch, file=None, page_start=None, page_end=None):
+    """
+    Yield (file_path, page, chunks) for the pages of a batch, optionally
+    restricted to one file (by name or index) and an inclusive page range.
+    """
+    file_paths = batch["files"] if file is None else [path for path in [find_file(batch, file)] if path]
+    for file_path in file_paths:
+        pages = batch["result"].get(file_path, {})
+        for page, chunks in sorted(pages.items()):
+            if page_start is not None and page < page_start:
+                continue
+            if page_end is not None and page > page_end:
+                continue
+            yield file_path, page, chunks
+
+def project_chunks(chunks, fields):
+    """Keep only the requested chunk fields; by default everything but span_boxes"""
+    if fields is None:
+        return [{key: value for key, value in chunk.items() if key != "span_boxes"} for chunk in chunks]
+    return [{key: chunk[key] for key in fields if key in chunk} for chunk in chunks]
+
+def parse_data_query(args):
+    """
+    Read the file, page range and field selection of a document data request.
+    
+    Returns:
+        Dict of iter_pages/project_chunks arguments
+    
+    Raises:
+        ValueError: If the page range is not made of integers
+    """
+    fields = [field for field in args.get('fields', '').split(',') if field] or None
+    if is_truthy(args.get('span_boxes', '')):
+        fields = (fields or ["text", "bbox", "chunk_id"]) + ["span_boxes"]
+    page_start = args.get('page_start')
+    page_end = args.get('page_end')
+    return {
+        "file": args.get('file'),
+        "page_start": int(page_start) if page_start is not None else None,
+        "page_end": int(page_end) if page_end is not None else None,
+        "fields": fields
+    }
 
 @app.route('/get-document-data/<batch_id>', methods=['GET'])
 def get_document_data(batch_id):
     """
     Retrieve processed document data by batch ID
+    
+    Query parameters:
+        file: Only return this file (name as listed in "files", or index)
+        page_start, page_end: Only return pages in this inclusive range
+        fields: Comma-separated chunk fields to return (e.g. "bbox,chunk_id")
+        span_boxes: Also return the member span boxes of merged chunks
+        format: "ndjson" streams one JSON line per page instead of one document;
+            "binary" returns the selected pages in the binary columnar format
     """
-    if batch_id not in processed_docs:
-        return jsonify({"error": "Batch ID not found"}), 404
+    batch, error = find_batch_or_status(batch_id, allow_partial=True)
+    if error:
+        return error
+    complete = batch.get("complete", True)
+    
+    try:
+        query = parse_data_query(request.args)
+    except ValueError:
+        return jsonify({"error": "page_start and page_end must be integers"}), 400
+    fields = query.pop("fields")
+    files = [os.path.basename(f) for f in batch["files"]]
+    
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            yield json.dumps({
+                "type": "batch",
+                "batch_id": batch_id,
+                "files": files,
+                "processed_at": batch["processed_at"],
+                "complete": complete
+            }) + "\n"
+            for file_path, page, chunks in iter_pages(batch, **query):
+                yield json.dumps({
+                    "type": "page",
+                    "file": os.path.basename(file_path),
+                    "page": page,
+                    "chunks": project_chunks(chunks, fields)
+                }) + "\n"
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    if request.args.get('format') == 'binary':
+        selected = {}
+        for file_path, page, chunks in iter_pages(batch, **query):
+            selected.setdefault(os.path.basename(file_path), {})[page] = chunks
+        if not is_columnar(selected):
+            return jsonify({"error": "This batch is not available in the binary format"}), 409
+        return Response(dump_result(selected), mimetype='application/octet-stream')
+    
+    result = {}
+    for file_path, page, chunks in iter_pages(batch, **query):
+        result.setdefault(file_path, {})[page] = project_chunks(chunks, fields)
     
     # Return the processed document data
     return jsonify({
         "batch_id": batch_id,
-        "result": processed_docs[batch_id]["result"],
-        "files": [os.path.basename(f) for f in processed_docs[batch_id]["files"]],
-        "processed_at": processed_docs[batch_id]["processed_at"]
+        "result": result,
+        "files": files,
+        "processed_at": batch["processed_at"],
+        "complete": complete
     })
 
+@app.route('/document-manifest/<batch_id>', methods=['GET'])
+def document_manifest(batch_id):
+    """
+    Summarize a batch: page and chunk counts per file, without any chunk data
+    
+    page_count is the number of pages in the file and text_page_count the
+    number of parsed pages that have chunks; pages without text have none.
+    """
+    batch, error = find_batch_or_status(batch_id, allow_partial=True)
+    if error:
+        return error
+    
+    # Recorded by the parse; files of batches still parsing (or parsed by an SDK
+    # that does not report page counts) are counted now
+    page_counts = batch.get("page_counts") or {}
+    files = []
+    for file_path in batch["files"]:
+        pages = batch["result"].get(file_path, {})
+        page_chunks = {page: len(chunks) for page, chunks in sorted(pages.items())}
+        files.append({
+            "file": os.path.basename(file_path),
+            "page_count": page_counts[file_path] if file_path in page_counts else page_count(file_path),
+            "text_page_count": len(page_chunks),
+            "chunk_count": sum(page_chunks.values()),
+            "page_chunk_counts": page_chunks
+        })
+    
+    return jsonify({
+        "batch_id": batch_id,
+        "files": files,
+        "processed_at": batch["processed_at"],
+        "complete": batch.get("complete", True)
+    })
+
+@app.route('/render-page/<batch_id>/<file>/<int:page>', methods=['GET'])
+def render_page_image(batch_id, file, page):
+    """
+    Render a page of a processed document as an image
+    
+    The file is given by name or index, and pages are 0-based. Renders are
+    cached by file content, page, resolution, highlighted boxes and format.
+    
+    Query parameters:
+        dpi: Resolution (default DOC_PROCESSOR_RENDER_DPI)
+        highlight: Comma-separated IDs of chunks on the page to highlight
+        format: "png" (default) or "webp" (requires Pillow)
+    """
+    batch, error = find_batch_or_status(batch_id, allow_partial=True)
+    if error:
+        return error
+    
+    file_path = find_file(batch, file)
+    if file_path is None:
+        return jsonify({"error": "File not found in batch"}), 404
+    
+    try:
+        dpi = int(request.args.get('dpi', app.config['RENDER_DPI']))
+    except ValueError:
+        return jsonify({"error": "dpi must be an integer"}), 400
+    if not MIN_DPI <= dpi <= MAX_DPI:
+        return jsonify({"error": f"dpi must be between {MIN_DPI} and {MAX_DPI}"}), 400
+    
+    fmt = request.args.get('format', 'png')
+    if fmt not in FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(FORMATS)}"}), 400
+    if fmt == 'webp' and not webp_available():
+        return jsonify({"error": "WebP output is not available on this server"}), 400
+    
+    highlights = sorted(set(chunk_id for chunk_id in request.args.get('highlight', '').split(',') if chunk_id))
+    boxes = []
+    if highlights:
+        chunk_boxes = {chunk["chunk_id"]: chunk["bbox"] for chunk in batch["result"].get(file_path, {}).get(page, [])}
+        unknown = [chunk_id for chunk_id in highlights if chunk_id not in chunk_boxes]
+        if unknown:
+            return jsonify({"error": f"Chunks not found on page {page}: {', '.join(unknown)}"}), 400
+        boxes = [chunk_boxes[chunk_id] for chunk_id in highlights]
+    
+    file_hash = batch.get("file_hashes", {}).get(file_path) or file_digest(file_path)
+    key = render_key(file_hash, page, dpi, boxes, fmt)
+    image = render_cache.get(key)
+    cache_status = 'hit'
+    if image is None:
+        cache_status = 'miss'
+        try:
+            image = render_file_page(file_path, page, dpi, boxes, fmt)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 404
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        render_cache.put(key, image)
+    
+    response = Response(image, mimetype=FORMATS[fmt])
+    response.headers['X-Render-Cache'] = cache_status
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+@app.route('/batch-status/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    """
+    Report the parsing status of a batch and of each of its files
+    """
+    # Jobs running in this worker report live progress, others report their last update
+    status = job_queue.status(batch_id) or processed_docs.get_status(batch_id)
+    if status is None:
+        return jsonify({"error": "Batch ID not found"}), 404
+    
+    return jsonify(status)
+
+def read_top_k(data, default):
+    """
+    Read the number of chunks to return from a JSON request body
+
+    Returns:
+        (top_k, None), or (None, error response) if it is not an integer
+        between 1 and MAX_SEARCH_RESULTS
+    """
+    try:
+        top_k = int(data.get("top_k", default))
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": "top_k must be an integer"}), 400)
+    if not 1 <= top_k <= app.config['MAX_SEARCH_RESULTS']:
+        return None, (jsonify({"error": f"top_k must be between 1 and {app.config['MAX_SEARCH_RESULTS']}"}), 400)
+    return top_k, None
+
 @app.route('/ask-question', methods=['POST'])
 def ask_question():
     """
@@ -121,24 +899,37 @@ def ask_question():
     if "batch_id" not in data or "question" not in data:
         return jsonify({"error": "Missing required fields: batch_id and question"}), 400
     
-    batch_id = data["question"]
+    batch_id = data["batch_id"]
     question = data["question"]
+    top_k, error = read_top_k(data, 3)
+    if error:
+        return error
     
     # Check if the batch exists
-    if batch_id not in processed_docs:
+    batch = processed_docs.get(batch_id)
+    if batch is None:
         return jsonify({"error": "Batch ID not found"}), 404
     
     try:
-        # Get document evidence
-        evidence = processed_docs[batch_id]["result"]
+        # Get document evidence from the batch's retrieval index
+        index = batch.get("index") or ChunkIndex.build(batch["result"])
+        evidence = best_chunks(index, batch["result"], question, top_k)
         
-        # For now, return a mock response
+        # For now, return a mock answer around the retrieved evidence
         # TODO: Implement actual OpenAI integration here
         response = {
             "answer": f"This is a mock answer to the question: {question}",
             "reasoning": "This is placeholder reasoning. Real integration would use OpenAI.",
             "evidence": [
-                {"text": "Sample evidence text", "score": 0.95}
+                {
+                    "text": chunk["text"],
+                    "score": chunk["score"],
+                    "file": os.path.basename(chunk["file_path"]),
+                    "page": chunk["page"],
+                    "bbox": chunk["bbox"],
+                    "chunk_id": chunk["chunk_id"]
+                }
+                for chunk in evidence
             ]
         }
         
@@ -147,24 +938,70 @@ def ask_question():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/search-documents', methods=['POST'])
+def search_documents():
+    """
+    Search the documents of an organization across all of its batches
+    
+    Expects JSON with organization_id and query, and optionally top_k
+    (default 10) and batch_ids to restrict the search to some batches.
+    Only batches processed with an organization_id are searchable.
+    """
+    data = request.json
+    if not data:
+        return jsonify({"error": "No data provided"}), 400
+    
+    if "organization_id" not in data or "query" not in data:
+        return jsonify({"error": "Missing required fields: organization_id and query"}), 400
+    
+    top_k, error = read_top_k(data, 10)
+    if error:
+        return error
+    
+    batch_ids = data.get("batch_ids")
+    if batch_ids is not None and (not isinstance(batch_ids, list) or not all(isinstance(b, str) for b in batch_ids)):
+        return jsonify({"error": "batch_ids must be a list of batch IDs"}), 400
+    
+    try:
+        with metrics.stage_timer("search"):
+            found = search_index.search(str(data["organization_id"]), str(data["query"]), top_k, batch_ids)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    return jsonify({
+        "organization_id": data["organization_id"],
+        "query": data["query"],
+        "searched_chunks": found["chunks"],
+        "results": [
+            {
+                "text": chunk["text"],
+                "score": chunk["score"],
+                "batch_id": chunk["batch_id"],
+                "file": os.path.basename(chunk["file_path"]),
+                "page": chunk["page"],
+                "bbox": chunk["bbox"],
+                "chunk_id": chunk["chunk_id"]
+            }
+            for chunk in found["results"]
+        ]
+    })
+
 @app.route('/cleanup/<batch_id>', methods=['DELETE'])
 def cleanup_batch(batch_id):
     """
     Clean up temporary files for a specific batch
     """
-    if batch_id not in processed_docs:
+    # Stop any background parsing still pending for this batch
+    job_queue.forget(batch_id)
+    
+    # Remove from the result store and the search index
+    files = processed_docs.delete(batch_id)
+    unindex_batch(batch_id)
+    if files is None:
         return jsonify({"error": "Batch ID not found"}), 404
     
     # Delete the temporary files
-    for file_path in processed_docs[batch_id]["files"]:
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            print(f"Error removing file {file_path}: {e}")
-    
-    # Remove from the processed docs dictionary
-    del processed_docs[batch_id]
+    remove_files(batch_id, files)
     
     return jsonify({"status": "success", "message": "Batch cleaned up successfully"})
 
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the document processor
+Run with ``python -m benchmarks.run`` from the doc-processor directory
+"""
@@ -0,0 +1,154 @@
+"""
+Synthetic PDF corpus for the benchmarks
+Documents are generated with PyMuPDF from a seeded word list, so the same
+profile always produces the same files
+"""
+
+import os
+import random
+from typing import Any, Dict, List
+
+import fitz  # PyMuPDF
+
+PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size("a4")
+MARGIN = 50
+
+WORDS = (
+    "patient procedure surgical anesthesia incision suture catheter dosage "
+    "hemoglobin platelet allergy consent discharge follow-up imaging biopsy "
+    "lesion tissue vascular cardiac renal hepatic pulmonary oral intravenous "
+    "postoperative preoperative assessment history medication observation "
+    "pressure temperature pulse oxygen saturation laboratory result normal "
+    "elevated reduced stable recovery complication infection wound dressing"
+).split()
+
+# Fonts alternated within a line so that one line holds several spans
+FONTS = ("helv", "tiro", "cour")
+
+LAYOUTS = ("single", "columns", "table", "mixed")
+
+# Documents generated for each profile: pages, spans per page and layout
+PROFILES = {
+    "quick": [
+        {"name": "short-single", "pages": 2, "spans_per_page": 40, "layout": "single"},
+        {"name": "report-columns", "pages": 10, "spans_per_page": 120, "layout": "columns"},
+        {"name": "labs-table", "pages": 8, "spans_per_page": 200, "layout": "table"},
+        {"name": "chart-mixed", "pages": 20, "spans_per_page": 80, "layout": "mixed"},
+    ],
+    "full": [
+        {"name": "short-single", "pages": 2, "spans_per_page": 40, "layout": "single"},
+        {"name": "report-columns", "pages": 30, "spans_per_page": 150, "layout": "columns"},
+        {"name": "labs-table", "pages": 40, "spans_per_page": 400, "layout": "table"},
+        {"name": "chart-mixed", "pages": 60, "spans_per_page": 100, "layout": "mixed"},
+        {"name": "record-large", "pages": 300, "spans_per_page": 120, "layout": "single"},
+    ],
+}
+
+
+def _phrase(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _write_lines(page, rng: random.Random, spans: int, left: float, right: float,
+                 top: float, bottom: float, fontsize: float, spans_per_line: int) -> int:
+    """Fill a column with lines of spans in alternating fonts, returning the spans written"""
+    line_height = fontsize * 1.4
+    y = top + fontsize
+    written = 0
+    while written < spans and y <= bottom:
+        x = left
+        for position in range(spans_per_line):
+            if written >= spans:
+                break
+            font = FONTS[position % len(FONTS)]
+            text = _phrase(rng, rng.randint(1, 3))
+            width = fitz.get_text_length(text + " ", fontname=font, fontsize=fontsize)
+            if x + width > right and x > left:
+                break
+            page.insert_text((x, y), text, fontname=font, fontsize=fontsize)
+            x += width
+            written += 1
+        y += line_height
+        # Leave a paragraph gap every few lines
+        if rng.random() < 0.15:
+            y += line_height
+    return written
+
+
+def _fill_page(page, rng: random.Random, spans: int, layout: str) -> None:
+    right_edge = PAGE_WIDTH - MARGIN
+    bottom_edge = PAGE_HEIGHT - MARGIN
+
+    if layout == "single":
+        _write_lines(page, rng, spans, MARGIN, right_edge, MARGIN, bottom_edge, 9, 3)
+    elif layout == "columns":
+        middle = PAGE_WIDTH / 2
+        written = _write_lines(page, rng, spans // 2, MARGIN, middle - 10, MARGIN, bottom_edge, 8, 2)
+        _write_lines(page, rng, spans - written, middle + 10, right_edge, MARGIN, bottom_edge, 8, 2)
+    elif layout == "table":
+        columns = 5
+        rows = max(1, -(-spans // columns))
+        cell_width = (right_edge - MARGIN) / columns
+        row_height = min(20.0, (bottom_edge - MARGIN) / rows)
+        fontsize = max(4.0, min(8.0, row_height * 0.7))
+        for cell in range(spans):
+            row, column = divmod(cell, columns)
+            x = MARGIN + column * cell_width
+            y = MARGIN + (row + 1) * row_height
+            text = f"{rng.choice(WORDS)} {rng.randint(1, 999)}"
+            page.insert_text((x, y), text, fontname="helv", fontsize=fontsize)
+            page.draw_rect(fitz.Rect(x - 2, y - row_height + 2, x + cell_width - 2, y + 2), width=0.3)
+    elif layout == "mixed":
+        # A heading, a dense body and a small footer in a different font size
+        page.insert_text((MARGIN, MARGIN + 18), _phrase(rng, 4).title(), fontname="hebo", fontsize=18)
+        body = max(0, spans - 2)
+        _write_lines(page, rng, body, MARGIN, right_edge, MARGIN + 40, bottom_edge - 40, 10, 3)
+        page.insert_text((MARGIN, bottom_edge), _phrase(rng, 6), fontname="tiro", fontsize=6)
+    else:
+        raise ValueError(f"Unknown layout: {layout}")
+
+
+def generate_pdf(path: str, pages: int, spans_per_page: int, layout: str = "single", seed: int = 0) -> str:
+    """
+    Write a synthetic PDF.
+
+    Args:
+        path: Where to write the PDF
+        pages: Number of pages
+        spans_per_page: Target number of text spans on each page
+        layout: One of LAYOUTS
+        seed: Seed for the generated text
+
+    Returns:
+        The path of the PDF
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout: {layout}")
+    rng = random.Random(f"{seed}-{pages}-{spans_per_page}-{layout}")
+    doc = fitz.open()
+    try:
+        for _ in range(pages):
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            _fill_page(page, rng, spans_per_page, layout)
+        doc.save(path, garbage=3, deflate=True)
+    finally:
+        doc.close()
+    return path
+
+
+def generate_corpus(out_dir: str, profile: str = "quick", seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Generate the documents of a profile.
+
+    Returns:
+        The document specs of the profile, each with the path of its PDF and its size in bytes
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown corpus profile: {profile}")
+    os.makedirs(out_dir, exist_ok=True)
+    documents = []
+    for spec in PROFILES[profile]:
+        path = generate_pdf(os.path.join(out_dir, f"{spec['name']}.pdf"), spec["pages"],
+                            spec["spans_per_page"], spec["layout"], seed)
+        documents.append(dict(spec, path=path, size_bytes=os.path.getsize(path)))
+    return documents
@@ -0,0 +1,453 @@
+"""
+Benchmark harness for the document processor
+Times each stage of the pipeline on a synthetic corpus, load-tests the HTTP
+endpoints through the Flask test client and a local gunicorn, writes the
+results as JSON and compares them with a stored baseline
+
+Usage (from the doc-processor directory):
+    python -m benchmarks.run [--profile quick|full] [--output results.json]
+    python -m benchmarks.run --update-baseline
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from importlib.util import find_spec
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results.json")
+
+# Metrics ending in one of these are better when higher; all others are timings
+HIGHER_IS_BETTER = ("_per_s", "_rps")
+
+# Timing changes smaller than this are reported as noise, whatever the ratio
+NOISE_FLOOR_MS = 1.0
+
+QUESTIONS = [
+    "What was the patient's postoperative blood pressure?",
+    "Which medication dosage was given intravenously?",
+    "Were there any complications or infection at the wound?",
+    "What did the biopsy of the lesion show?",
+    "Is the hemoglobin and platelet laboratory result normal?",
+]
+
+
+def configure_environment(args: argparse.Namespace, data_dir: str) -> None:
+    """Set the service configuration; must run before app or mock_sdk is imported"""
+    os.environ["DOC_PROCESSOR_SIMULATED_DELAY"] = str(args.simulated_delay)
+    os.environ["DOC_PROCESSOR_DATA_DIR"] = data_dir
+    if not args.parse_cache:
+        # Every upload is parsed again instead of being served from the cache
+        os.environ["DOC_PROCESSOR_PARSE_CACHE_SIZE"] = "0"
+        os.environ["DOC_PROCESSOR_PARSE_CACHE_DISK"] = "false"
+    if SERVICE_DIR not in sys.path:
+        sys.path.insert(0, SERVICE_DIR)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize_latencies(latencies: List[float], wall_seconds: float, errors: int) -> Dict[str, Any]:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": len(values) / wall_seconds if wall_seconds else 0.0,
+        "mean_ms": sum(values) / len(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p95_ms": percentile(values, 0.95) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+    }
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    """Run fn repeat times and return the median duration in seconds and the last result"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return durations[len(durations) // 2], result
+
+
+def bench_stages(documents: List[Dict[str, Any]], repeat: int, granularity: str) -> Dict[str, Any]:
+    """Time extraction, parsing, serialization and retrieval of each document separately"""
+    import mock_sdk
+    from app import app as flask_app
+    from columnar import dump_result, load_result
+    from retrieval import ChunkIndex, best_chunks
+
+    per_document = []
+    totals = {}
+    for doc in documents:
+        path = doc["path"]
+        extract_s, spans = timed(lambda: mock_sdk.extract_text_with_coordinates(path), repeat)
+        parse_s, result = timed(lambda: mock_sdk.parse_documents([path], granularity=granularity), repeat)
+        json_s, json_data = timed(lambda: flask_app.json.dumps(result), repeat)
+        binary_s, binary_data = timed(lambda: dump_result(result), repeat)
+        load_s, _ = timed(lambda: load_result(binary_data), repeat)
+        index_s, index = timed(lambda: ChunkIndex.build(result), repeat)
+        search_s, _ = timed(lambda: [best_chunks(index, result, question, 3) for question in QUESTIONS], repeat)
+
+        stages = {
+            "extract": extract_s,
+            "parse": parse_s,
+            "serialize_json": json_s,
+            "serialize_binary": binary_s,
+            "load_binary": load_s,
+            "index": index_s,
+            "search": search_s / len(QUESTIONS),
+        }
+        for stage, seconds in stages.items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+        per_document.append({
+            "name": doc["name"],
+            "pages": doc["pages"],
+            "spans": len(spans),
+            "chunks": sum(len(chunks) for pages in result.values() for chunks in pages.values()),
+            "json_bytes": len(json_data),
+            "binary_bytes": len(binary_data),
+            "seconds": stages,
+        })
+
+    pages = sum(doc["pages"] for doc in per_document)
+    spans = sum(doc["spans"] for doc in per_document)
+    return {
+        "documents": per_document,
+        "totals": {
+            stage: {"seconds": seconds} for stage, seconds in totals.items()
+        },
+        "throughput": {
+            "extract_pages_per_s": pages / totals["extract"] if totals["extract"] else 0.0,
+            "extract_spans_per_s": spans / totals["extract"] if totals["extract"] else 0.0,
+            "parse_pages_per_s": pages / totals["parse"] if totals["parse"] else 0.0,
+            "parse_spans_per_s": spans / totals["parse"] if totals["parse"] else 0.0,
+        },
+    }
+
+
+class TestClientTransport:
+    """Sends requests through the Flask test client, one client per thread"""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, data=body, headers=headers or {})
+        return response.status_code, response.get_data()
+
+
+class HTTPTransport:
+    """Sends requests to a running server over HTTP"""
+
+    def __init__(self, base_url: str, timeout: float = 120):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        req = urllib.request.Request(self.base_url + path, data=body, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def upload(transport, document: Dict[str, Any], pdf: bytes) -> Tuple[int, bytes]:
+    """Process one document synchronously as a raw PDF body"""
+    return transport.request("POST", "/process-documents", pdf, {
+        "Content-Type": "application/pdf",
+        "X-Filename": os.path.basename(document["path"])
+    })
+
+
+def run_scenario(send: Callable[[int], Tuple[int, bytes]], clients: int, requests: int) -> Dict[str, Any]:
+    """Issue requests from concurrent clients and summarize their latencies"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(number: int) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            status, _ = send(number)
+        except Exception:
+            status = 599
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(one, range(requests)))
+    return summarize_latencies(latencies, time.perf_counter() - start, errors)
+
+
+def bench_load(transport, documents: List[Dict[str, Any]], clients: int, requests: int) -> Dict[str, Any]:
+    """Load-test processing, data retrieval and question answering through a transport"""
+    small = min(documents, key=lambda doc: doc["pages"] * doc["spans_per_page"])
+    # Questions and data requests go to the largest document that still keeps requests short
+    target = max((doc for doc in documents if doc["pages"] <= 20), key=lambda doc: doc["pages"])
+    with open(small["path"], "rb") as f:
+        small_pdf = f.read()
+    with open(target["path"], "rb") as f:
+        target_pdf = f.read()
+
+    status, body = upload(transport, target, target_pdf)
+    if status != 200:
+        raise RuntimeError(f"Could not process {target['name']}: {status} {body[:200]!r}")
+    batch_id = json.loads(body)["batch_id"]
+
+    processed = []
+
+    def process(_: int) -> Tuple[int, bytes]:
+        status, body = upload(transport, small, small_pdf)
+        if status == 200:
+            processed.append(json.loads(body)["batch_id"])
+        return status, body
+
+    def ask(number: int) -> Tuple[int, bytes]:
+        payload = json.dumps({"batch_id": batch_id, "question": QUESTIONS[number % len(QUESTIONS)]})
+        return transport.request("POST", "/ask-question", payload.encode("utf-8"),
+                                 {"Content-Type": "application/json"})
+
+    def data(_: int) -> Tuple[int, bytes]:
+        return transport.request("GET", f"/get-document-data/{batch_id}")
+
+    try:
+        return {
+            "process": run_scenario(process, clients, max(1, requests // 4)),
+            "ask": run_scenario(ask, clients, requests),
+            "data": run_scenario(data, clients, requests),
+        }
+    finally:
+        for processed_id in processed + [batch_id]:
+            transport.request("DELETE", f"/cleanup/{processed_id}")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers: int, log_path: str, timeout: float = 60) -> Tuple[subprocess.Popen, str]:
+    """Start gunicorn on a free local port and wait until it answers /health"""
+    port = free_port()
+    log = open(log_path, "wb")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--workers", str(workers), "--bind", f"127.0.0.1:{port}",
+         "--timeout", "300", "app:app"],
+        cwd=SERVICE_DIR, env=dict(os.environ), stdout=log, stderr=subprocess.STDOUT
+    )
+    log.close()
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}, see {log_path}")
+        try:
+            with urllib.request.urlopen(base_url + "/health", timeout=1) as response:
+                if response.status == 200:
+                    return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not start within {timeout}s, see {log_path}")
+
+
+def bench_gunicorn(documents: List[Dict[str, Any]], args: argparse.Namespace, work_dir: str) -> Dict[str, Any]:
+    if find_spec("gunicorn") is None:
+        return {"skipped": "gunicorn is not installed"}
+    process, base_url = start_gunicorn(args.gunicorn_workers, os.path.join(work_dir, "gunicorn.log"))
+    try:
+        result = bench_load(HTTPTransport(base_url), documents, args.clients, args.requests)
+        result["workers"] = args.gunicorn_workers
+        return result
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def flatten_metrics(results: Dict[str, Any]) -> Dict[str, float]:
+    """Flat name -> value view of the results that the baseline comparison works on"""
+    metrics = {}
+    for stage, totals in results["stages"]["totals"].items():
+        metrics[f"stage.{stage}.ms"] = totals["seconds"] * 1000
+    for name, value in results["stages"]["throughput"].items():
+        metrics[f"stage.{name}"] = value
+    for transport, scenarios in results["load"].items():
+        for scenario, summary in scenarios.items():
+            if not isinstance(summary, dict):
+                continue
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+                metrics[f"load.{transport}.{scenario}.{key}"] = summary[key]
+    return metrics
+
+
+def compare(metrics: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Compare metrics with a baseline.
+
+    Returns:
+        The metrics that got worse by more than the tolerance (a fraction of the baseline value)
+    """
+    regressions = []
+    for name, base in sorted(baseline.items()):
+        value = metrics.get(name)
+        if value is None or not base:
+            continue
+        change = (value - base) / base
+        if name.endswith(HIGHER_IS_BETTER):
+            worse = change < -tolerance
+        else:
+            worse = change > tolerance and value - base >= NOISE_FLOOR_MS
+        if worse:
+            regressions.append({"metric": name, "baseline": base, "value": value, "change": change})
+    return regressions
+
+
+def print_summary(results: Dict[str, Any]) -> None:
+    print(f"{'document':<16}{'pages':>6}{'spans':>8}" + "".join(f"{stage:>18}" for stage in results["stages"]["totals"]))
+    for doc in results["stages"]["documents"]:
+        print(f"{doc['name']:<16}{doc['pages']:>6}{doc['spans']:>8}"
+              + "".join(f"{seconds * 1000:>16.2f}ms" for seconds in doc["seconds"].values()))
+    for name, value in results["stages"]["throughput"].items():
+        print(f"{name}: {value:,.0f}")
+    for transport, scenarios in results["load"].items():
+        if "skipped" in scenarios:
+            print(f"{transport}: skipped ({scenarios['skipped']})")
+            continue
+        for scenario, summary in scenarios.items():
+            if isinstance(summary, dict):
+                print(f"{transport} {scenario:<8} {summary['throughput_rps']:8.1f} req/s  "
+                      f"p50 {summary['p50_ms']:8.2f}ms  p95 {summary['p95_ms']:8.2f}ms  "
+                      f"p99 {summary['p99_ms']:8.2f}ms  errors {summary['errors']}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--profile", default="quick", help="Corpus profile (see benchmarks/corpus.py)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the median is reported")
+    parser.add_argument("--granularity", default="line", help="Chunk granularity used for parsing")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients in the load tests")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per load-test scenario")
+    parser.add_argument("--gunicorn-workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--skip-gunicorn", action="store_true", help="Only load-test through the test client")
+    parser.add_argument("--simulated-delay", type=float, default=0.0,
+                        help="Per-file delay of the mock SDK in seconds (the service default is 0.5)")
+    parser.add_argument("--parse-cache", action="store_true", help="Keep the parse cache enabled")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Allowed relative slowdown before a metric counts as a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="Store these results as the baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    work_dir = tempfile.mkdtemp(prefix="doc_processor_bench_")
+    configure_environment(args, os.path.join(work_dir, "data"))
+
+    import fitz  # PyMuPDF
+    from benchmarks.corpus import generate_corpus
+    from app import app as flask_app
+
+    documents = generate_corpus(os.path.join(work_dir, "corpus"), args.profile, args.seed)
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pymupdf": fitz.VersionBind,
+            "profile": args.profile,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "granularity": args.granularity,
+            "clients": args.clients,
+            "requests": args.requests,
+            "simulated_delay": args.simulated_delay,
+            "parse_cache": args.parse_cache,
+        },
+        "corpus": [
+            {key: value for key, value in doc.items() if key != "path"} for doc in documents
+        ],
+        "stages": bench_stages(documents, args.repeat, args.granularity),
+        "load": {
+            "test_client": bench_load(TestClientTransport(flask_app), documents, args.clients, args.requests)
+        },
+    }
+    if not args.skip_gunicorn:
+        results["load"]["gunicorn"] = bench_gunicorn(documents, args, work_dir)
+    results["metrics"] = flatten_metrics(results)
+
+    print_summary(results)
+
+    exit_code = 0
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": results["meta"], "metrics": results["metrics"]}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("profile") != args.profile:
+            print(f"Baseline was recorded with the {baseline['meta'].get('profile')} profile; not comparing")
+        else:
+            regressions = compare(results["metrics"], baseline["metrics"], args.tolerance)
+            results["regressions"] = regressions
+            for regression in regressions:
+                print(f"REGRESSION {regression['metric']}: {regression['baseline']:.2f} -> "
+                      f"{regression['value']:.2f} ({regression['change']:+.0%})")
+            if regressions:
+                exit_code = 1
+            else:
+                print(f"No regressions beyond {args.tolerance:.0%} of the baseline")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+        f.write("\n")
+    print(f"Results written to {args.output}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Layout-aware chunking
+Merges the text spans of a page into line, block or paragraph chunks with
+deterministic, compact chunk IDs
+"""
+
+import os
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# Supported chunk granularities, from finest to coarsest
+GRANULARITIES = ("span", "line", "block", "paragraph")
+
+# Granularity used when a request does not ask for one
+DEFAULT_GRANULARITY = os.environ.get("DOC_PROCESSOR_CHUNK_GRANULARITY", "line")
+
+# Blocks are joined into one paragraph when the vertical gap between them is
+# at most this fraction of the paragraph's average line height
+PARAGRAPH_GAP_RATIO = 0.8
+
+# Number of hex digits of the file hash used in chunk IDs
+CHUNK_ID_HASH_LENGTH = 16
+
+
+def file_digest(file_path: str) -> str:
+    """Hex SHA-256 digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(file_hash: str, page: int, index: int) -> str:
+    """Deterministic chunk ID built from the file hash, page number and chunk index"""
+    return f"{file_hash[:CHUNK_ID_HASH_LENGTH]}-{page}-{index}"
+
+
+def box_to_dict(box) -> Dict[str, Any]:
+    return {
+        "left": box.left,
+        "top": box.top,
+        "right": box.right,
+        "bottom": box.bottom,
+        "page": box.page
+    }
+
+
+def union_box(boxes: List[Any]) -> Dict[str, Any]:
+    """Smallest box containing all the given boxes"""
+    return {
+        "left": min(box.left for box in boxes),
+        "top": min(box.top for box in boxes),
+        "right": max(box.right for box in boxes),
+        "bottom": max(box.bottom for box in boxes),
+        "page": boxes[0].page
+    }
+
+
+def _group_lines(spans: List[Any]) -> List[List[Any]]:
+    """Group consecutive spans that belong to the same PDF line"""
+    groups = []
+    for span in spans:
+        if groups and (groups[-1][-1].block, groups[-1][-1].line) == (span.block, span.line):
+            groups[-1].append(span)
+        else:
+            groups.append([span])
+    return groups
+
+
+def _group_blocks(spans: List[Any]) -> List[List[List[Any]]]:
+    """Group the lines of a page by PDF block"""
+    blocks = []
+    for line in _group_lines(spans):
+        if blocks and blocks[-1][-1][0].block == line[0].block:
+            blocks[-1].append(line)
+        else:
+            blocks.append([line])
+    return blocks
+
+
+def _group_paragraphs(spans: List[Any]) -> List[List[List[Any]]]:
+    """
+    Join consecutive blocks that are stacked closely on top of each other and
+    overlap horizontally, which is how PyMuPDF splits many paragraphs.
+    """
+    paragraphs = []
+    for block in _group_blocks(spans):
+        if paragraphs:
+            previous = paragraphs[-1]
+            prev_box = union_box([span.box for line in previous for span in line])
+            box = union_box([span.box for line in block for span in line])
+            line_height = (prev_box["bottom"] - prev_box["top"]) / len(previous)
+            gap = box["top"] - prev_box["bottom"]
+            overlaps = box["left"] < prev_box["right"] and prev_box["left"] < box["right"]
+            if overlaps and 0 <= gap <= line_height * PARAGRAPH_GAP_RATIO:
+                previous.extend(block)
+                continue
+        paragraphs.append(list(block))
+    return paragraphs
+
+
+def build_chunks(spans: List[Any], file_hash: str, page: int,
+                 granularity: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Turn the spans of one page into chunks.
+
+    Args:
+        spans: Spans of the page in reading order, with text, box, block and line attributes
+        file_hash: Content hash of the file, used for chunk IDs
+        page: Page number
+        granularity: One of GRANULARITIES; defaults to DEFAULT_GRANULARITY
+
+    Returns:
+        List of chunk dicts with text, union bbox and chunk_id. Merged chunks
+        also carry the boxes of their member spans under span_boxes.
+    """
+    granularity = granularity or DEFAULT_GRANULARITY
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown chunk granularity: {granularity}")
+
+    if granularity == "span":
+        return [
+            {"text": span.text, "bbox": box_to_dict(span.box), "chunk_id": chunk_id(file_hash, page, index)}
+            for index, span in enumerate(spans)
+        ]
+
+    if granularity == "line":
+        groups = [[line] for line in _group_lines(spans)]
+    elif granularity == "block":
+        groups = _group_blocks(spans)
+    else:
+        groups = _group_paragraphs(spans)
+
+    chunks = []
+    for index, lines in enumerate(groups):
+        members = [span for line in lines for span in line]
+        chunks.append({
+            "text": "\n".join(" ".join(span.text for span in line) for line in lines),
+            "bbox": union_box([span.box for span in members]),
+            "chunk_id": chunk_id(file_hash, page, index),
+            "span_boxes": [box_to_dict(span.box) for span in members]
+        })
+    return chunks
@@ -0,0 +1,333 @@
+"""
+Columnar storage and binary format for parsed chunks
+A page's chunks are held as flat arrays (float32 boxes, offset-indexed UTF-8
+text, integer chunk indices) instead of one dict per chunk, while dict-like
+views keep existing callers working
+"""
+
+import io
+import sys
+import json
+import struct
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, BinaryIO, Dict, Iterable, List, Tuple
+
+# The binary format is little-endian and stores the arrays as-is
+if sys.byteorder != "little":
+    raise ImportError("columnar chunk storage requires a little-endian platform")
+
+PAGE_MAGIC = b"DPPG"
+BATCH_MAGIC = b"DPRS"
+FORMAT_VERSION = 1
+
+# magic, version, flags, page, chunk count, span count, id prefix length, text length
+PAGE_HEADER = struct.Struct("<4sHHiIIII")
+# magic, version, reserved, table of contents length
+BATCH_HEADER = struct.Struct("<4sHHI")
+
+FLAG_SPAN_BOXES = 1
+
+CHUNK_FIELDS = ("text", "bbox", "chunk_id")
+SPAN_FIELDS = CHUNK_FIELDS + ("span_boxes",)
+
+
+def _padding(length: int) -> int:
+    """Bytes needed to align length to 4 bytes"""
+    return -length % 4
+
+
+class ChunkView(Mapping):
+    """Read-only dict-like view of one chunk in a PageChunks"""
+
+    __slots__ = ("_page", "_index")
+
+    def __init__(self, page: "PageChunks", index: int):
+        self._page = page
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        return self._page._field(self._index, key)
+
+    def __iter__(self):
+        return iter(self._page.fields)
+
+    def __len__(self) -> int:
+        return len(self._page.fields)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class PageChunks(Sequence):
+    """
+    The chunks of one page in columnar form.
+
+    Chunk IDs must follow the ``<prefix>-<page>-<index>`` scheme, so only the
+    prefix and the integer indices are stored. The arrays may be array.array
+    objects or memoryviews into a loaded buffer.
+    """
+
+    __slots__ = ("page", "id_prefix", "boxes", "indices", "text_offsets", "text_data",
+                 "span_offsets", "span_boxes")
+
+    def __init__(self, page: int, id_prefix: str, boxes, indices, text_offsets, text_data,
+                 span_offsets=None, span_boxes=None):
+        self.page = page
+        self.id_prefix = id_prefix
+        self.boxes = boxes
+        self.indices = indices
+        self.text_offsets = text_offsets
+        self.text_data = text_data
+        self.span_offsets = span_offsets
+        self.span_boxes = span_boxes
+
+    @property
+    def fields(self):
+        return SPAN_FIELDS if self.span_offsets is not None else CHUNK_FIELDS
+
+    @classmethod
+    def from_chunks(cls, chunks: List[Dict[str, Any]], page: int) -> "PageChunks":
+        """
+        Build a columnar page from chunk dicts.
+
+        Raises:
+            ValueError: If the chunks have other fields or chunk IDs not following the scheme
+        """
+        boxes, indices, span_boxes = array("f"), array("I"), array("f")
+        text_offsets, span_offsets = array("I", [0]), array("I", [0])
+        text_data = bytearray()
+        id_prefix = None
+        has_spans = bool(chunks) and "span_boxes" in chunks[0]
+
+        for chunk in chunks:
+            if set(chunk) != set(SPAN_FIELDS if has_spans else CHUNK_FIELDS):
+                raise ValueError(f"Unsupported chunk fields: {sorted(chunk)}")
+            prefix, chunk_page, index = chunk["chunk_id"].rsplit("-", 2)
+            if int(chunk_page) != page or (id_prefix is not None and prefix != id_prefix):
+                raise ValueError(f"Unsupported chunk ID: {chunk['chunk_id']}")
+            id_prefix = prefix
+
+            bbox = chunk["bbox"]
+            if bbox.get("page", page) != page:
+                raise ValueError(f"Chunk {chunk['chunk_id']} has a box on another page")
+            boxes.extend((bbox["left"], bbox["top"], bbox["right"], bbox["bottom"]))
+            indices.append(int(index))
+            text_data += chunk["text"].encode("utf-8")
+            text_offsets.append(len(text_data))
+
+            if has_spans:
+                for box in chunk["span_boxes"]:
+                    span_boxes.extend((box["left"], box["top"], box["right"], box["bottom"]))
+                span_offsets.append(len(span_boxes) // 4)
+
+        return cls(page, id_prefix or "", boxes, indices, text_offsets, bytes(text_data),
+                   span_offsets if has_spans else None, span_boxes if has_spans else None)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ChunkView(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        return ChunkView(self, index)
+
+    def _box(self, boxes, index: int) -> Dict[str, Any]:
+        offset = index * 4
+        return {
+            "left": boxes[offset],
+            "top": boxes[offset + 1],
+            "right": boxes[offset + 2],
+            "bottom": boxes[offset + 3],
+            "page": self.page
+        }
+
+    def _field(self, index: int, key: str) -> Any:
+        if key == "text":
+            return str(self.text_data[self.text_offsets[index]:self.text_offsets[index + 1]], "utf-8")
+        if key == "bbox":
+            return self._box(self.boxes, index)
+        if key == "chunk_id":
+            return f"{self.id_prefix}-{self.page}-{self.indices[index]}"
+        if key == "span_boxes" and self.span_offsets is not None:
+            return [
+                self._box(self.span_boxes, span)
+                for span in range(self.span_offsets[index], self.span_offsets[index + 1])
+            ]
+        raise KeyError(key)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Plain list of chunk dicts"""
+        return [dict(view) for view in self]
+
+    def to_bytes(self) -> bytes:
+        """Serialize the page in the binary page format"""
+        prefix = self.id_prefix.encode("utf-8")
+        has_spans = self.span_offsets is not None
+        parts = [
+            PAGE_HEADER.pack(PAGE_MAGIC, FORMAT_VERSION, FLAG_SPAN_BOXES if has_spans else 0, self.page,
+                             len(self), len(self.span_boxes) // 4 if has_spans else 0, len(prefix),
+                             len(self.text_data)),
+            prefix + b"\0" * _padding(len(prefix)),
+            bytes(self.boxes),
+            bytes(self.indices),
+            bytes(self.text_offsets)
+        ]
+        if has_spans:
+            parts += [bytes(self.span_offsets), bytes(self.span_boxes)]
+        parts += [bytes(self.text_data), b"\0" * _padding(len(self.text_data))]
+        return b"".join(parts)
+
+    @classmethod
+    def from_buffer(cls, buffer) -> "PageChunks":
+        """
+        Load a page from the binary page format without copying its arrays.
+
+        Args:
+            buffer: bytes, mmap or memoryview holding one serialized page
+        """
+        view = memoryview(buffer)
+        magic, version, flags, page, count, span_count, prefix_length, text_length = \
+            PAGE_HEADER.unpack_from(view)
+        if magic != PAGE_MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Not a chunk page in a supported format")
+
+        offset = PAGE_HEADER.size
+
+        def take(length: int, fmt: str):
+            nonlocal offset
+            section = view[offset:offset + length * 4].cast(fmt)
+            offset += length * 4
+            return section
+
+        prefix = str(view[offset:offset + prefix_length], "utf-8")
+        offset += prefix_length + _padding(prefix_length)
+        boxes = take(count * 4, "f")
+        indices = take(count, "I")
+        text_offsets = take(count + 1, "I")
+        span_offsets = span_boxes = None
+        if flags & FLAG_SPAN_BOXES:
+            span_offsets = take(count + 1, "I")
+            span_boxes = take(span_count * 4, "f")
+        text_data = view[offset:offset + text_length]
+        return cls(page, prefix, boxes, indices, text_offsets, text_data, span_offsets, span_boxes)
+
+    def __reduce__(self):
+        # Pickle through the binary format, e.g. when returned from a worker process
+        return PageChunks.from_buffer, (self.to_bytes(),)
+
+
+def compact_pages(pages: Dict[Any, Any]) -> Dict[Any, Any]:
+    """Convert the chunk lists of a file's pages to PageChunks where they fit the format"""
+    compacted = {}
+    for page, chunks in pages.items():
+        try:
+            compacted[page] = chunks if isinstance(chunks, PageChunks) else PageChunks.from_chunks(chunks, page)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            compacted[page] = chunks
+    return compacted
+
+
+def compact_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert every file of a parse_documents result with compact_pages"""
+    return {
+        file_path: compact_pages(pages) if isinstance(pages, dict) else pages
+        for file_path, pages in result.items()
+    }
+
+
+def is_columnar(result: Dict[str, Dict[Any, Any]]) -> bool:
+    """Whether every page of a result is held in columnar form"""
+    return all(
+        isinstance(pages, dict) and all(isinstance(chunks, PageChunks) for chunks in pages.values())
+        for pages in result.values()
+    )
+
+
+def dump_result(result: Dict[str, Dict[int, PageChunks]]) -> bytes:
+    """
+    Serialize a columnar parse result in the binary batch format: a header,
+    a JSON table of contents, then the pages. Page offsets in the table are
+    relative to the end of the table, and everything is aligned to 4 bytes.
+    """
+    blobs = {
+        file_path: {page: chunks.to_bytes() for page, chunks in pages.items()}
+        for file_path, pages in result.items()
+    }
+    buffer = io.BytesIO()
+    write_result(
+        buffer,
+        [(file_path, [(page, len(blob)) for page, blob in pages.items()]) for file_path, pages in blobs.items()],
+        (blob for pages in blobs.values() for blob in pages.values())
+    )
+    return buffer.getvalue()
+
+
+def write_result(f: BinaryIO, files: List[Tuple[str, List[Tuple[int, int]]]], blobs: Iterable[bytes]) -> None:
+    """
+    Write a result in the binary batch format one page at a time, so pages
+    can be streamed from storage without holding the whole result.
+
+    Args:
+        f: Binary file to write to
+        files: (file path, [(page, size of the serialized page)]) of every file
+        blobs: The serialized pages, in the same order
+
+    Raises:
+        ValueError: If the pages do not match the given sizes
+    """
+    toc, sizes = [], []
+    offset = 0
+    for file_path, pages in files:
+        entries = []
+        for page, size in pages:
+            entries.append([page, offset, size])
+            sizes.append(size)
+            offset += size
+        toc.append([file_path, entries])
+
+    toc_data = json.dumps(toc).encode("utf-8")
+    toc_data += b" " * _padding(len(toc_data))
+    f.write(BATCH_HEADER.pack(BATCH_MAGIC, FORMAT_VERSION, 0, len(toc_data)))
+    f.write(toc_data)
+    written = 0
+    for blob in blobs:
+        if written == len(sizes) or len(blob) != sizes[written]:
+            raise ValueError("Pages do not match the table of contents")
+        f.write(blob)
+        written += 1
+    if written != len(sizes):
+        raise ValueError("Pages do not match the table of contents")
+
+
+def load_result(buffer) -> Dict[str, Dict[int, PageChunks]]:
+    """
+    Load a result in the binary batch format. Pages reference the buffer
+    directly, so an mmap of the file is never copied into memory as a whole.
+    """
+    view = memoryview(buffer)
+    magic, version, _, toc_length = BATCH_HEADER.unpack_from(view)
+    if magic != BATCH_MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a parse result in a supported format")
+    base = BATCH_HEADER.size + toc_length
+    toc = json.loads(str(view[BATCH_HEADER.size:base], "utf-8"))
+    return {
+        file_path: {
+            page: PageChunks.from_buffer(view[base + offset:base + offset + length])
+            for page, offset, length in entries
+        }
+        for file_path, entries in toc
+    }
+
+
+def to_json(o: Any) -> Any:
+    """json.dumps default hook for columnar chunks"""
+    if isinstance(o, PageChunks):
+        return o.to_list()
+    if isinstance(o, ChunkView):
+        return dict(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
@@ -0,0 +1,272 @@
+"""
+Background job queue for document parsing
+Parses uploaded files in a bounded process pool so requests can return immediately
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+
+# Job and file states reported by /batch-status
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class BatchRemoved(Exception):
+    """Raised in a worker when its batch was cleaned up or expired while a file was being parsed"""
+
+
+def initial_status(batch_id: str, file_paths: List[str], done: Iterable[str] = ()) -> Dict[str, Any]:
+    """Status of a batch whose files have all been queued, except those already done"""
+    done = set(done)
+    files = [
+        {"file": os.path.basename(path), "status": DONE if path in done else QUEUED, "error": None}
+        for path in file_paths
+    ]
+    finished = all(f["status"] == DONE for f in files)
+    return {
+        "batch_id": batch_id,
+        "status": JobQueue._batch_state([f["status"] for f in files]),
+        "files_total": len(files),
+        "files_done": sum(1 for f in files if f["status"] == DONE),
+        "files": files,
+        "created_at": time.time(),
+        "finished_at": time.time() if finished else None
+    }
+
+
+def _parse_file(parse_fn: Callable, file_path: str,
+                options: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, int], Dict[str, Any]]:
+    """
+    Parse a single file inside a pool worker, returning the result, no page
+    counts (the SDK does not report them) and the worker's metrics
+    """
+    return parse_fn([file_path], **options), {}, metrics.drain()
+
+
+def _parse_file_pages(page_parse_fn: Callable, page_writer: Callable, batch_id: str, file_path: str,
+                      options: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, int], Dict[str, Any]]:
+    """
+    Parse a single file inside a pool worker, committing each page as soon as
+    it is done. Only the numbers of the committed pages are returned, with the
+    file's page count and the worker's metrics, so the pages themselves are
+    never sent back.
+
+    Raises:
+        BatchRemoved: If the batch disappeared from the store, so the file's
+            pages would be incomplete
+    """
+    pages, page_counts = [], {}
+    for page, chunks in page_parse_fn(file_path, page_counts=page_counts, **options):
+        if not page_writer(batch_id, file_path, page, chunks):
+            raise BatchRemoved(f"Batch {batch_id} was removed while parsing {os.path.basename(file_path)}")
+        pages.append(page)
+    return ({file_path: pages} if pages else {}), page_counts, metrics.drain()
+
+
+class JobQueue:
+    """
+    Bounded process pool that parses batches of files in the background.
+
+    Every file is submitted as its own task so that progress can be reported
+    per file. Every finished file reports the batch status through
+    ``on_update(batch_id, status)``; when all files of a batch have finished,
+    the merged result is handed to ``on_complete(batch_id, job, status)``.
+
+    When ``page_parse_fn`` (yielding (page, chunks) for one file and filling
+    its ``page_counts`` argument with the file's page count) and
+    ``page_writer`` are given, files are parsed page by page and every page is
+    passed to ``page_writer(batch_id, file_path, page, chunks)`` from the
+    worker as soon as it is done. The job then only keeps the numbers of the
+    committed pages of each file, in ``committed``, and the page counts in
+    ``page_counts``.
+    """
+
+    def __init__(self, parse_fn: Callable, max_workers: Optional[int] = None,
+                 on_update: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 on_complete: Optional[Callable[[str, Dict[str, Any], Dict[str, Any]], None]] = None,
+                 page_parse_fn: Optional[Callable] = None, page_writer: Optional[Callable] = None):
+        self.parse_fn = parse_fn
+        self.page_parse_fn = page_parse_fn
+        self.page_writer = page_writer
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.on_update = on_update
+        self.on_complete = on_complete
+        self._executor = None
+        self._executor_pid = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    @property
+    def _commits_pages(self) -> bool:
+        return bool(self.page_parse_fn and self.page_writer)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Each gunicorn worker gets its own pool; a pool inherited through fork is unusable
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def submit(self, batch_id: str, file_paths: List[str], cached: Optional[Dict[str, Any]] = None,
+               context: Optional[Dict[str, Any]] = None, **options) -> Dict[str, Any]:
+        """
+        Queue a batch of files for parsing.
+
+        Args:
+            batch_id: ID the batch will be reported under
+            file_paths: Paths of the saved files to parse
+            cached: Already known results by file path; these files are not parsed again
+            context: Caller data kept on the job and handed back to on_complete
+            **options: Extra keyword arguments passed to the parse function
+
+        Returns:
+            Status snapshot of the newly queued job
+        """
+        cached = cached or {}
+        job = {
+            "batch_id": batch_id,
+            "files": file_paths,
+            "created_at": time.time(),
+            "finished_at": None,
+            "result": dict(cached),
+            "committed": {},
+            "page_counts": {},
+            "context": context or {},
+            "file_status": {
+                path: {"status": DONE if path in cached else QUEUED, "error": None}
+                for path in file_paths
+            },
+            "futures": {}
+        }
+        with self._lock:
+            self._jobs[batch_id] = job
+
+        executor = self._get_executor()
+        for path in file_paths:
+            if path in cached:
+                continue
+            if self._commits_pages:
+                future = executor.submit(_parse_file_pages, self.page_parse_fn, self.page_writer, batch_id, path, options)
+            else:
+                future = executor.submit(_parse_file, self.parse_fn, path, options)
+            with self._lock:
+                job["futures"][path] = future
+            future.add_done_callback(partial(self._file_done, batch_id, path))
+
+        return self.status(batch_id)
+
+    def _file_done(self, batch_id: str, file_path: str, future) -> None:
+        """Record the outcome of one file and finish the job once all files are done"""
+        with self._lock:
+            job = self._jobs.get(batch_id)
+            if job is None:
+                return
+
+            file_status = job["file_status"][file_path]
+            try:
+                result, page_counts, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                job["committed" if self._commits_pages else "result"].update(result)
+                job["page_counts"].update(page_counts)
+                file_status["status"] = DONE
+            except Exception as e:
+                file_status["status"] = FAILED
+                file_status["error"] = str(e)
+
+            finished = all(
+                status["status"] in (DONE, FAILED) for status in job["file_status"].values()
+            )
+            if finished:
+                job["finished_at"] = time.time()
+                job["futures"] = {}
+
+        status = self.status(batch_id)
+        callback = self.on_complete if finished else self.on_update
+        if callback is None or status is None:
+            return
+        try:
+            if finished:
+                callback(batch_id, job, status)
+            else:
+                callback(batch_id, status)
+        except Exception as e:
+            print(f"Error updating batch {batch_id}: {e}")
+        if finished:
+            self.forget(batch_id)
+
+    def status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Report the state of a batch and of each of its files.
+
+        Returns:
+            Status dict, or None if the batch is unknown to this queue
+        """
+        with self._lock:
+            job = self._jobs.get(batch_id)
+            if job is None:
+                return None
+
+            files = []
+            for path in job["files"]:
+                state = job["file_status"][path]["status"]
+                future = job["futures"].get(path)
+                if state == QUEUED and future is not None and future.running():
+                    state = RUNNING
+                files.append({
+                    "file": os.path.basename(path),
+                    "status": state,
+                    "error": job["file_status"][path]["error"]
+                })
+
+            return {
+                "batch_id": batch_id,
+                "status": self._batch_state([f["status"] for f in files]),
+                "files_total": len(files),
+                "files_done": sum(1 for f in files if f["status"] in (DONE, FAILED)),
+                "files": files,
+                "created_at": job["created_at"],
+                "finished_at": job["finished_at"]
+            }
+
+    @staticmethod
+    def _batch_state(states: List[str]) -> str:
+        if all(state == QUEUED for state in states):
+            return QUEUED
+        if any(state in (QUEUED, RUNNING) for state in states):
+            return RUNNING
+        if all(state == FAILED for state in states):
+            return FAILED
+        return DONE
+
+    def forget(self, batch_id: str) -> Optional[List[str]]:
+        """
+        Drop a batch from the queue's bookkeeping, cancelling any files not yet started.
+
+        Returns:
+            The batch's file paths, or None if the batch is unknown to this queue
+        """
+        with self._lock:
+            job = self._jobs.pop(batch_id, None)
+        if job is None:
+            return None
+        for future in job["futures"].values():
+            future.cancel()
+        return job["files"]
+
+    def shutdown(self) -> None:
+        """Stop the worker pool"""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
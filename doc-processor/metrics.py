@@ -0,0 +1,411 @@
+"""
+Low-overhead instrumentation for the document processor
+Stage timings and counters are kept in a per-process registry and exported in
+the Prometheus text format. Pool worker processes drain their registry into
+the return value of each task so the parent process can merge it, and web
+workers share theirs through files so any of them can report the whole node
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import fcntl
+import atexit
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds of the timing histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stages whose time counts towards page and span throughput
+EXTRACTION_STAGES = ("open", "get_text", "chunk")
+
+HELP = {
+    "doc_processor_stage_seconds": "Time spent per upload save, fitz.open call, page get_text, page chunking, "
+                                   "file parse, JSON response serialization, page render "
+                                   "and organization search",
+    "doc_processor_request_seconds": "Time spent handling HTTP requests",
+    "doc_processor_files_total": "Files parsed",
+    "doc_processor_pages_total": "Pages parsed",
+    "doc_processor_spans_total": "Text spans extracted",
+    "doc_processor_upload_bytes_total": "Bytes of uploads written to disk",
+}
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{label}="{_escape(value)}"' for label, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    """
+    Thread-safe store of histograms and counters for one process.
+
+    Histograms keep one count per bucket (not cumulative) plus the sum and the
+    count of observations, so snapshots from other processes merge by addition.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Add an observation to a histogram"""
+        key = _key(name, labels)
+        index = next((i for i, bound in enumerate(BUCKETS) if value <= bound), len(BUCKETS))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Increase a counter"""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self) -> Dict[str, Dict[Key, Any]]:
+        """Picklable copy of the registry"""
+        with self._lock:
+            return {
+                "histograms": {key: list(values) for key, values in self._histograms.items()},
+                "counters": dict(self._counters)
+            }
+
+    def drain(self) -> Dict[str, Dict[Key, Any]]:
+        """Return a snapshot and reset the registry, so each observation is handed on once"""
+        with self._lock:
+            snapshot = {"histograms": self._histograms, "counters": self._counters}
+            self._histograms = {}
+            self._counters = {}
+        return snapshot
+
+    def merge(self, snapshot: Optional[Dict[str, Dict[Key, Any]]]) -> None:
+        """Add a snapshot taken in another process"""
+        if not snapshot:
+            return
+        with self._lock:
+            for key, values in snapshot["histograms"].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    self._histograms[key] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        histogram[i] += value
+            for key, value in snapshot["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def stage_seconds(self, stages) -> float:
+        """Total time recorded for the given stages"""
+        with self._lock:
+            return sum(
+                values[-2] for (name, labels), values in self._histograms.items()
+                if name == "doc_processor_stage_seconds" and dict(labels).get("stage") in stages
+            )
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def render(self, gauges: Optional[List[Tuple[str, str, float]]] = None) -> str:
+        """
+        Render the registry in the Prometheus text exposition format.
+
+        Args:
+            gauges: Extra (name, help, value) gauges measured at scrape time
+        """
+        snapshot = self.snapshot()
+        extraction_seconds = self.stage_seconds(EXTRACTION_STAGES)
+        gauges = list(gauges or [])
+        for unit in ("pages", "spans"):
+            total = self.counter(f"doc_processor_{unit}_total")
+            gauges.append((
+                f"doc_processor_{unit}_per_second",
+                f"{unit.capitalize()} per second of extraction time ({', '.join(EXTRACTION_STAGES)})",
+                total / extraction_seconds if extraction_seconds else 0.0
+            ))
+
+        lines = []
+        seen = set()
+
+        def header(name: str, kind: str, help_text: str) -> None:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), values in sorted(snapshot["histograms"].items()):
+            header(name, "histogram", HELP.get(name, name))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+
+        for (name, labels), value in sorted(snapshot["counters"].items()):
+            header(name, "counter", HELP.get(name, name))
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for name, help_text, value in gauges:
+            header(name, "gauge", help_text)
+            lines.append(f"{name} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Registry of the current process
+registry = Registry()
+
+
+def _encode(snapshot: Dict[str, Dict[Key, Any]]) -> Dict[str, list]:
+    """JSON-serializable form of a snapshot"""
+    return {
+        kind: [[name, [list(label) for label in labels], values] for (name, labels), values in entries.items()]
+        for kind, entries in snapshot.items()
+    }
+
+
+def _decode(data: Dict[str, list]) -> Dict[str, Dict[Key, Any]]:
+    return {
+        kind: {(name, tuple(tuple(label) for label in labels)): values for name, labels, values in data.get(kind, [])}
+        for kind in ("histograms", "counters")
+    }
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedMetrics:
+    """
+    Node-wide view of the registries of every web worker, in the manner of
+    prometheus_client's multiprocess mode.
+
+    Each process writes its registry, and the gauges returned by
+    ``worker_gauges``, to its own file in ``path`` every ``interval`` seconds
+    and whenever it answers a scrape. A scrape merges the files of all
+    processes, so whichever worker answers it reports the totals of the node.
+    The registries of exited processes are folded into an archive file, so
+    counters never go backwards; their gauges are dropped. Processes are
+    told apart by PID, so the directory must only be shared within one node.
+    """
+
+    ARCHIVE = "archive.json"
+
+    def __init__(self, path: str, source: Registry = registry, interval: float = 5.0,
+                 worker_gauges: Optional[Callable[[], List[Tuple[str, str, float]]]] = None):
+        self.path = path
+        self.source = source
+        self.interval = interval
+        self.worker_gauges = worker_gauges
+        os.makedirs(path, exist_ok=True)
+        self._pid = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _own_file(self) -> str:
+        # A forked worker gets a file of its own, named so a reused PID never overwrites another's
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._file = os.path.join(self.path, f"{self._pid}-{uuid.uuid4().hex}.json")
+                if self.interval > 0:
+                    threading.Thread(target=self._run, name="metrics-flush", daemon=True).start()
+                atexit.register(self.flush)
+            return self._file
+
+    def start(self) -> None:
+        """Start writing this process's metrics in the background; cheap to call on every request"""
+        if self._pid != os.getpid():
+            self._own_file()
+
+    def _run(self) -> None:
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing metrics: {e}")
+
+    def flush(self) -> None:
+        """Write this process's registry and gauges to its file"""
+        path = self._own_file()
+        data = _encode(self.source.snapshot())
+        data["gauges"] = [list(gauge) for gauge in self.worker_gauges()] if self.worker_gauges else []
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self) -> Tuple[Registry, List[Tuple[str, str, float]]]:
+        """
+        Merge the metrics of every process on the node.
+
+        Returns:
+            Registry holding the merged histograms and counters, and the
+            worker gauges summed over the live processes
+        """
+        self.flush()
+        merged = Registry()
+        gauges = {}
+        with open(os.path.join(self.path, ".lock"), "w") as lock:
+            # Archiving and reading must not interleave, or a process would be counted twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(self.path, self.ARCHIVE)
+            archive = Registry()
+            try:
+                with open(archive_path) as f:
+                    archive.merge(_decode(json.load(f)))
+            except FileNotFoundError:
+                pass
+
+            archived = []
+            for name in os.listdir(self.path):
+                if not name.endswith(".json") or name == self.ARCHIVE:
+                    continue
+                try:
+                    with open(os.path.join(self.path, name)) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    # Being replaced by its process
+                    continue
+                if _process_alive(int(name.split("-", 1)[0])):
+                    merged.merge(_decode(data))
+                    for gauge_name, help_text, value in data.get("gauges", []):
+                        gauges[gauge_name] = (help_text, gauges.get(gauge_name, (help_text, 0))[1] + value)
+                else:
+                    archive.merge(_decode(data))
+                    archived.append(name)
+
+            if archived:
+                with open(f"{archive_path}.tmp", "w") as f:
+                    json.dump(_encode(archive.snapshot()), f)
+                os.replace(f"{archive_path}.tmp", archive_path)
+                for name in archived:
+                    os.remove(os.path.join(self.path, name))
+        merged.merge(archive.snapshot())
+        return merged, [(name, help_text, value) for name, (help_text, value) in gauges.items()]
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record the duration of one stage"""
+    registry.observe("doc_processor_stage_seconds", seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Time the enclosed block as one observation of a stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def count(name: str, value: float = 1) -> None:
+    """Increase the doc_processor_<name>_total counter"""
+    registry.inc(f"doc_processor_{name}_total", value)
+
+
+def drain() -> Dict[str, Dict[Key, Any]]:
+    """Hand the metrics recorded in this process back to the parent"""
+    return registry.drain()
+
+
+def merge(snapshot: Optional[Dict[str, Dict[Key, Any]]]) -> None:
+    """Merge metrics drained in a worker process"""
+    registry.merge(snapshot)
+
+
+def directory_usage(path: str) -> Tuple[int, int]:
+    """Total size in bytes and number of files below a directory"""
+    size = files = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+                files += 1
+            except OSError:
+                # Removed while walking
+                continue
+    return size, files
+
+
+class SamplingProfiler:
+    """
+    Sampling profiler for one thread.
+
+    A background thread records the stack of the target thread every
+    ``interval`` seconds through sys._current_frames, so the profiled code
+    runs unmodified. Stacks are reported in the folded format used by
+    flame graph tools.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005, max_depth: int = 64):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        """Sampled stacks, root first, one "stack count" line each, most frequent first"""
+        return "".join(f"{stack} {samples}\n" for stack, samples in self._stacks.most_common())
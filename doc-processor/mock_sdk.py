@@ -9,10 +9,35 @@ import uuid
 import json
 import time
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional, Tuple
-import random
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from retrieval import ChunkIndex, best_chunks
+from chunking import build_chunks, file_digest
+from columnar import PageChunks
+import metrics
 
-@dataclass
+# Number of processes used to extract the pages of a single document
+PAGE_WORKERS = int(os.environ.get("DOC_PROCESSOR_PAGE_WORKERS", os.cpu_count() or 1))
+
+# Documents with fewer pages than this are extracted sequentially
+PARALLEL_MIN_PAGES = int(os.environ.get("DOC_PROCESSOR_PARALLEL_MIN_PAGES", 50))
+
+# Largest number of pages handed to one extraction process at a time
+PAGE_RUN_SIZE = int(os.environ.get("DOC_PROCESSOR_PAGE_RUN_SIZE", 16))
+
+# Number of files of a batch parsed at the same time
+FILE_WORKERS = int(os.environ.get("DOC_PROCESSOR_FILE_WORKERS", 4))
+
+# Seconds each file sleeps to simulate the latency of the real SDK; set to 0 to
+# measure the actual parsing cost
+SIMULATED_DELAY = float(os.environ.get("DOC_PROCESSOR_SIMULATED_DELAY", 0.5))
+
+_page_pool = None
+_page_pool_key = None
+
+@dataclass(slots=True)
 class Box:
     """Representation of a bounding box in a document"""
     left: float
@@ -30,7 +55,15 @@ class Box:
             "page": self.page
         }
 
-@dataclass
+@dataclass(slots=True)
+class Span:
+    """A run of text on a page with its position in the page layout"""
+    text: str
+    box: Box
+    block: int
+    line: int
+
+@dataclass(slots=True)
 class Grounding:
     """Information about where a chunk comes from"""
     file_path: str
@@ -42,7 +75,7 @@ class Grounding:
             "box": self.box.to_dict() if self.box else None
         }
 
-@dataclass
+@dataclass(slots=True)
 class Chunk:
     """A piece of text from a document with its location"""
     text: str
@@ -56,7 +89,7 @@ class Chunk:
             "chunk_id": self.chunk_id
         }
 
-@dataclass
+@dataclass(slots=True)
 class ParsedDocument:
     """A document that has been parsed into chunks"""
     chunks: List[Chunk]
@@ -68,124 +101,262 @@ class ParsedDocument:
             "file_path": self.file_path
         }
 
-def extract_text_with_coordinates(pdf_path: str) -> List[Tuple[str, Box]]:
+def _extract_page(page, page_num: int) -> List[Span]:
+    """Extract the text spans of one page with normalized bounding boxes"""
+    result = []
+    page_width, page_height = page.rect.width, page.rect.height
+    with metrics.stage_timer("get_text"):
+        blocks = page.get_text("dict")["blocks"]
+    
+    for block_num, block in enumerate(blocks):
+        if "lines" in block:
+            for line_num, line in enumerate(block["lines"]):
+                for span in line["spans"]:
+                    text = span["text"].strip()
+                    if text:
+                        bbox = span["bbox"]
+                        # Normalize coordinates to 0-1 range
+                        box = Box(
+                            left=bbox[0] / page_width,
+                            top=bbox[1] / page_height,
+                            right=bbox[2] / page_width,
+                            bottom=bbox[3] / page_height,
+                            page=page_num
+                        )
+                        result.append(Span(text, box, block_num, line_num))
+    
+    return result
+
+def _open(pdf_path: str) -> fitz.Document:
+    with metrics.stage_timer("open"):
+        return fitz.open(pdf_path)
+
+def _extract_pages(pdf_path: str, page_numbers: List[int]) -> Tuple[List[Tuple[int, List[Span]]], Dict[str, Any]]:
+    """
+    Extract the text spans of the given pages of a PDF.
+    Opens its own document handle so it can run in a worker process, and
+    returns the metrics recorded on the way along with the pages.
+    """
+    with _open(pdf_path) as doc:
+        pages = [(page_num, _extract_page(doc[page_num], page_num)) for page_num in page_numbers]
+    return pages, metrics.drain()
+
+def _collect_pages(future) -> List[Tuple[int, List[Span]]]:
+    """Pages of a finished extraction run, merging the metrics of its worker"""
+    pages, worker_metrics = future.result()
+    metrics.merge(worker_metrics)
+    return pages
+
+def _get_page_pool(workers: int) -> ProcessPoolExecutor:
+    """Return the shared process pool used for page-parallel extraction"""
+    global _page_pool, _page_pool_key
+    key = (os.getpid(), workers)
+    if _page_pool is None or _page_pool_key != key:
+        _page_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        _page_pool_key = key
+        # Inside a job worker process the interpreter's exit hooks never run, so
+        # stop the pool before the worker waits for its child processes, and
+        # before the finalizers that close the pool's queues (priority 10)
+        multiprocessing.util.Finalize(_page_pool, _page_pool.shutdown, exitpriority=100)
+    return _page_pool
+
+def iter_page_spans(pdf_path: str, pages: Optional[List[int]] = None, workers: Optional[int] = None,
+                    min_pages_for_parallel: Optional[int] = None,
+                    page_counts: Optional[Dict[str, int]] = None) -> Iterator[Tuple[int, List[Span]]]:
+    """
+    Yield (page number, spans) for the pages of a PDF in page order, as soon
+    as each page has been extracted.
+    
+    Args:
+        pdf_path: Path to the PDF
+        pages: Page numbers to extract (0-based); all pages if omitted
+        workers: Number of extraction processes
+        min_pages_for_parallel: Page count at which page-parallel extraction starts
+        page_counts: Filled with the total page count of the PDF, keyed by its path
+    
+    Documents with at least min_pages_for_parallel selected pages are split
+    into contiguous runs of pages that are extracted by a pool of worker
+    processes, with a bounded number of runs in flight, and yielded back in
+    page order, giving the same output as a sequential run.
+    """
+    workers = PAGE_WORKERS if workers is None else workers
+    min_pages = PARALLEL_MIN_PAGES if min_pages_for_parallel is None else min_pages_for_parallel
+    
+    with _open(pdf_path) as doc:
+        page_count = doc.page_count
+        if page_counts is not None:
+            page_counts[pdf_path] = page_count
+        page_numbers = [page for page in pages if page < page_count] if pages is not None else range(page_count)
+        
+        if workers <= 1 or len(page_numbers) < max(min_pages, 2):
+            for page_num in page_numbers:
+                yield page_num, _extract_page(doc[page_num], page_num)
+            return
+    
+    # Split pages into runs small enough to hand back results early
+    run_size = max(1, min(PAGE_RUN_SIZE, len(page_numbers) // workers))
+    runs = [page_numbers[i:i + run_size] for i in range(0, len(page_numbers), run_size)]
+    pool = _get_page_pool(workers)
+    pending = deque()
+    for run in runs:
+        pending.append(pool.submit(_extract_pages, pdf_path, list(run)))
+        # Keep a couple of runs per worker queued so memory stays bounded
+        if len(pending) >= workers * 2:
+            yield from _collect_pages(pending.popleft())
+    while pending:
+        yield from _collect_pages(pending.popleft())
+
+def extract_spans(pdf_path: str, workers: Optional[int] = None,
+                  min_pages_for_parallel: Optional[int] = None) -> List[Span]:
+    """
+    Extract text spans from PDF with bounding box coordinates and their
+    block and line numbers, in reading order.
+    """
+    return [
+        span
+        for _, page_spans in iter_page_spans(pdf_path, workers=workers, min_pages_for_parallel=min_pages_for_parallel)
+        for span in page_spans
+    ]
+
+def extract_text_with_coordinates(pdf_path: str, workers: Optional[int] = None,
+                                  min_pages_for_parallel: Optional[int] = None) -> List[Tuple[str, Box]]:
     """
     Extract text from PDF with bounding box coordinates.
     Returns list of (text, box) tuples.
     """
-    result = []
-    doc = fitz.open(pdf_path)
+    return [(span.text, span.box) for span in extract_spans(pdf_path, workers, min_pages_for_parallel)]
+
+def parse_file_pages(file_path: str, **kwargs) -> Iterator[Tuple[int, PageChunks]]:
+    """
+    Parse a single PDF page by page, yielding (page number, chunks) as soon
+    as each page is done. Pages without text are skipped.
     
-    for page_num, page in enumerate(doc):
-        blocks = page.get_text("dict")["blocks"]
-        
-        for block in blocks:
-            if "lines" in block:
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        text = span["text"].strip()
-                        if text:
-                            bbox = span["bbox"]
-                            # Normalize coordinates to 0-1 range
-                            page_width, page_height = page.rect.width, page.rect.height
-                            box = Box(
-                                left=bbox[0] / page_width,
-                                top=bbox[1] / page_height,
-                                right=bbox[2] / page_width,
-                                bottom=bbox[3] / page_height,
-                                page=page_num
-                            )
-                            result.append((text, box))
-    
-    doc.close()
-    return result
+    Args:
+        file_path: Path to the PDF
+        **kwargs: Same options as parse_documents
+    """
+    if not os.path.exists(file_path):
+        return
+    
+    # Check if file is a PDF
+    if not file_path.lower().endswith('.pdf'):
+        return
+    
+    # Add some delay to simulate processing time
+    if SIMULATED_DELAY > 0:
+        time.sleep(SIMULATED_DELAY)
+    
+    # Merge spans into chunks with IDs derived from the file content
+    file_hash = (kwargs.get("file_hashes") or {}).get(file_path) or file_digest(file_path)
+    page_spans = iter_page_spans(
+        file_path,
+        pages=kwargs.get("pages"),
+        workers=kwargs.get("page_workers"),
+        min_pages_for_parallel=kwargs.get("min_pages_for_parallel"),
+        page_counts=kwargs.get("page_counts")
+    )
+    start = time.perf_counter()
+    for page_num, spans in page_spans:
+        metrics.count("pages")
+        metrics.count("spans", len(spans))
+        if spans:
+            with metrics.stage_timer("chunk"):
+                chunks = build_chunks(spans, file_hash, page_num, kwargs.get("granularity"))
+                page_chunks = PageChunks.from_chunks(chunks, page_num)
+            yield page_num, page_chunks
+    metrics.observe_stage("parse", time.perf_counter() - start)
+    metrics.count("files")
+
+def _parse_file(file_path: str, **kwargs) -> Optional[Dict[int, PageChunks]]:
+    """Parse a single PDF into columnar chunks grouped by page"""
+    return dict(parse_file_pages(file_path, **kwargs)) or None
 
-def parse_documents(file_paths: List[str], **kwargs) -> Dict[str, Dict[int, List[Dict[str, Any]]]]:
+def _parse_file_in_worker(file_path: str, kwargs: Dict[str, Any]) -> Tuple[Optional[Dict[int, PageChunks]],
+                                                                         Dict[str, int], Dict[str, Any]]:
+    """Parse a single PDF in a pool worker, returning its page count and the worker's metrics along with the pages"""
+    page_counts = {}
+    pages = _parse_file(file_path, **kwargs, page_counts=page_counts)
+    return pages, page_counts, metrics.drain()
+
+def _collect_file(future, page_counts: Optional[Dict[str, int]]) -> Optional[Dict[int, PageChunks]]:
+    """Pages of a file parsed in a pool worker, merging the worker's metrics and page count"""
+    pages, worker_page_counts, worker_metrics = future.result()
+    metrics.merge(worker_metrics)
+    if page_counts is not None:
+        page_counts.update(worker_page_counts)
+    return pages
+
+def parse_documents(file_paths: List[str], **kwargs) -> Dict[str, Dict[int, PageChunks]]:
     """
     Mock implementation of the parse_documents function from the agentic_doc SDK.
     
     Args:
         file_paths: List of paths to PDF files
         **kwargs: Additional arguments to pass to the SDK
+            file_workers: Number of files parsed concurrently
+            page_workers: Number of processes extracting the pages of one file
+            min_pages_for_parallel: Page count at which page-parallel extraction starts
+            granularity: Chunk granularity, one of "span", "line", "block" or "paragraph"
+            pages: Page numbers (0-based) to parse; all pages if omitted
+            file_hashes: Known content hashes by file path, used for chunk IDs
+            page_counts: Dict filled with the total page count of each file,
+                including pages without text, keyed by file path
         
     Returns:
-        Dict mapping file paths to pages and chunks
+        Dict mapping file paths to pages and chunks; each page's chunks are a
+        PageChunks sequence of dict-like chunk views
     """
     result = {}
     
-    for file_path in file_paths:
-        if not os.path.exists(file_path):
-            continue
-        
-        # Check if file is a PDF
-        if not file_path.lower().endswith('.pdf'):
-            continue
-        
-        # Add some delay to simulate processing time
-        time.sleep(0.5)
-        
-        # Extract text with coordinates
-        text_data = extract_text_with_coordinates(file_path)
-        
-        # Group by page
-        pages_data = {}
-        for text, box in text_data:
-            page_num = box.page
-            
-            if page_num not in pages_data:
-                pages_data[page_num] = []
-            
-            # Create chunk
-            chunk = {
-                "text": text,
-                "bbox": box.to_dict(),
-                "chunk_id": str(uuid.uuid4()),
-                # Add random score for simulation
-                "relevance_score": random.uniform(0.5, 1.0)
-            }
-            
-            pages_data[page_num].append(chunk)
-        
-        # Store in result dict
+    # PyMuPDF must not be shared between threads and holds the GIL, so files
+    # are parsed in parallel by the page pool's processes, each file's pages
+    # sequentially so the pool never waits on itself
+    file_workers = min(kwargs.get("file_workers") or FILE_WORKERS, len(file_paths))
+    if file_workers <= 1:
+        parsed = [_parse_file(file_path, **kwargs) for file_path in file_paths]
+    else:
+        pool = _get_page_pool(kwargs.get("page_workers") or PAGE_WORKERS)
+        page_counts = kwargs.get("page_counts")
+        worker_kwargs = {key: value for key, value in kwargs.items() if key != "page_counts"}
+        worker_kwargs["page_workers"] = 1
+        parsed, pending = [], deque()
+        for file_path in file_paths:
+            pending.append(pool.submit(_parse_file_in_worker, file_path, worker_kwargs))
+            if len(pending) >= file_workers:
+                parsed.append(_collect_file(pending.popleft(), page_counts))
+        while pending:
+            parsed.append(_collect_file(pending.popleft(), page_counts))
+    
+    # Store in result dict, keeping the order of the input files
+    for file_path, pages_data in zip(file_paths, parsed):
         if pages_data:
             result[file_path] = pages_data
     
     return result
 
-def get_answer_and_best_chunks(question: str, evidence: Dict[str, Dict[int, List[Dict[str, Any]]]]) -> Dict[str, Any]:
+def get_answer_and_best_chunks(question: str, evidence: Dict[str, Dict[int, List[Dict[str, Any]]]],
+                               index: Optional[ChunkIndex] = None, top_k: int = 3) -> Dict[str, Any]:
     """
     Mock implementation of question answering function
     
     Args:
         question: The question to answer
         evidence: Document evidence from parse_documents
+        index: Prebuilt ChunkIndex over the evidence; built on the fly if omitted
+        top_k: Number of supporting chunks to return
         
     Returns:
         Dict with answer, reasoning and supporting chunks
     """
-    # Collect all chunks from all documents
-    all_chunks = []
-    for file_path, pages in evidence.items():
-        for page_num, chunks in pages.items():
-            for chunk in chunks:
-                all_chunks.append({
-                    "text": chunk["text"],
-                    "file_path": file_path,
-                    "page": page_num,
-                    "bbox": chunk["bbox"],
-                    "chunk_id": chunk["chunk_id"],
-                    "score": chunk.get("relevance_score", random.uniform(0.5, 1.0))
-                })
-    
-    # Sort by random score to simulate relevance
-    all_chunks.sort(key=lambda x: x["score"], reverse=True)
-    
-    # Take top 3 chunks as "best evidence"
-    best_chunks = all_chunks[:3] if len(all_chunks) >= 3 else all_chunks
+    if index is None:
+        index = ChunkIndex.build(evidence)
+    
+    # Take the best matching chunks as "best evidence"
+    best = best_chunks(index, evidence, question, top_k)
     
     # Create mock answer
     return {
         "answer": f"This is a simulated answer to the question: {question}",
         "reasoning": "This is where the reasoning would go in a real implementation.",
-        "best_chunks": best_chunks
-    }
\ No newline at end of file
+        "best_chunks": best
+    }
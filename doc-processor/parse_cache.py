@@ -0,0 +1,150 @@
+"""
+Content-addressed cache of parse results
+Identical uploads are recognised by the SHA-256 of their content, so they are
+only parsed once
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from columnar import dump_result, is_columnar, load_result, to_json
+from result_store import decode_result
+
+
+def cache_key(file_hash: str, options: Optional[Dict[str, Any]] = None) -> str:
+    """Build the cache key for a file parsed with the given options"""
+    if not options:
+        return file_hash
+    return f"{file_hash}:{json.dumps(options, sort_keys=True, separators=(',', ':'))}"
+
+
+class DiskTier:
+    """
+    SQLite-backed second cache tier that survives restarts and is shared by
+    all workers on the node. The least recently used entries are dropped once
+    it holds more than max_entries results. Columnar pages are stored in the
+    binary chunk format, anything else as JSON, along with the file's page count.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS parse_cache (
+                    key TEXT PRIMARY KEY,
+                    pages BLOB NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    page_count INTEGER
+                )
+                """
+            )
+            # Caches written before page counts were recorded
+            if "page_count" not in {row[1] for row in conn.execute("PRAGMA table_info(parse_cache)")}:
+                try:
+                    conn.execute("ALTER TABLE parse_cache ADD COLUMN page_count INTEGER")
+                except sqlite3.OperationalError:
+                    # Added by another worker at the same time
+                    pass
+            conn.execute("CREATE INDEX IF NOT EXISTS parse_cache_accessed_at ON parse_cache (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[Dict[Any, Any], Optional[int]]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT pages, page_count FROM parse_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE parse_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        if isinstance(row[0], bytes):
+            return load_result(row[0])[""], row[1]
+        return decode_result({"": json.loads(row[0])})[""], row[1]
+
+    def put(self, key: str, pages: Dict[Any, Any], page_count: Optional[int] = None) -> None:
+        if is_columnar({"": pages}):
+            encoded = dump_result({"": pages})
+        else:
+            encoded = json.dumps(pages, default=to_json)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO parse_cache (key, pages, accessed_at, page_count) VALUES (?, ?, ?, ?)",
+                (key, encoded, time.time(), page_count)
+            )
+            conn.execute(
+                "DELETE FROM parse_cache WHERE key IN ("
+                "SELECT key FROM parse_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+
+class ParseCache:
+    """
+    Two-tier cache of per-file parse results keyed by content hash.
+
+    Args:
+        max_entries: Number of parsed files kept in memory by this worker
+        disk_tier: Optional DiskTier consulted on memory misses
+    """
+
+    def __init__(self, max_entries: int = 256, disk_tier: Optional[DiskTier] = None):
+        self.max_entries = max_entries
+        self.disk_tier = disk_tier
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[Dict[Any, Any], Optional[int]]]:
+        """
+        Return the cached pages of a file with its page count (None if it is
+        not known), or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self.disk_tier.get(key) if self.disk_tier else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def __len__(self) -> int:
+        """Number of files held in memory"""
+        with self._lock:
+            return len(self._entries)
+
+    def put(self, key: str, pages: Dict[Any, Any], page_count: Optional[int] = None) -> None:
+        """Cache the parsed pages of a file and its total page count"""
+        self._remember(key, (pages, page_count))
+        if self.disk_tier:
+            self.disk_tier.put(key, pages, page_count)
+
+    def _remember(self, key: str, entry: Tuple[Dict[Any, Any], Optional[int]]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
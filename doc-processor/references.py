@@ -0,0 +1,221 @@
+"""
+Fetching documents given by reference
+Storage URLs are downloaded concurrently through a pooled HTTP session with
+retries, and files on an allowlisted shared volume are read in place
+"""
+
+import os
+import uuid
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+from urllib3.util.retry import Retry
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+from chunking import file_digest
+from uploads import save_stream
+
+# Number of references fetched at the same time, which is also the size of the connection pool
+FETCH_WORKERS = int(os.environ.get("DOC_PROCESSOR_FETCH_WORKERS", 8))
+
+# Attempts per URL after the first one, with exponential backoff between them
+FETCH_RETRIES = int(os.environ.get("DOC_PROCESSOR_FETCH_RETRIES", 3))
+
+# Seconds to wait for a connection or for the next block of a download
+FETCH_TIMEOUT = float(os.environ.get("DOC_PROCESSOR_FETCH_TIMEOUT", 30))
+
+# Statuses worth retrying, e.g. a storage node being restarted
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Redirects followed per URL, each checked against the allowed prefixes
+MAX_REDIRECTS = 5
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Return this process's pooled HTTP session"""
+    global _session, _session_pid
+    with _session_lock:
+        # Connections must not be shared with a forked parent
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(
+                total=FETCH_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset(["GET"])
+            )
+            adapter = HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session_pid = os.getpid()
+        return _session
+
+
+def is_url(reference: str) -> bool:
+    return urlparse(reference).scheme in ("http", "https")
+
+
+def _url_parts(url: str) -> Tuple[str, str, int, str]:
+    """Scheme, host, port and normalized path of a URL, as compared against prefixes"""
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    path = posixpath.normpath(unquote(parsed.path) or "/")
+    # normpath keeps a leading "//" and drops a trailing slash, which marks a directory prefix
+    path = "/" + path.lstrip("/")
+    if parsed.path.endswith("/") and path != "/":
+        path += "/"
+    return scheme, (parsed.hostname or "").lower(), parsed.port or DEFAULT_PORTS.get(scheme, 0), path
+
+
+def url_allowed(url: str, prefix: str) -> bool:
+    """Whether a URL is on the same scheme, host and port as a prefix and below its path"""
+    scheme, host, port, path = _url_parts(url)
+    prefix_scheme, prefix_host, prefix_port, prefix_path = _url_parts(prefix)
+    if (scheme, host, port) != (prefix_scheme, prefix_host, prefix_port):
+        return False
+    if prefix_path.endswith("/"):
+        return path.startswith(prefix_path)
+    return path == prefix_path or path.startswith(prefix_path + "/")
+
+
+def check_url(url: str, allowed_prefixes: Sequence[str]) -> None:
+    """
+    Raises:
+        ValueError: If the URL may not be fetched; nothing may be fetched
+            without allowed prefixes
+    """
+    if not is_url(url):
+        raise ValueError(f"Unsupported URL: {url}")
+    if not allowed_prefixes:
+        raise ValueError("URL references are disabled, no allowed URL prefixes are configured")
+    if not any(url_allowed(url, prefix) for prefix in allowed_prefixes):
+        raise ValueError(f"URL is not under an allowed prefix: {url}")
+
+
+def resolve_shared_path(path: str, shared_roots: Sequence[str]) -> str:
+    """
+    Resolve a path on a shared volume, following symlinks.
+
+    Raises:
+        ValueError: If the path is not an existing file under one of the shared roots
+    """
+    resolved = os.path.realpath(path)
+    roots = [os.path.realpath(root) for root in shared_roots]
+    if not any(os.path.commonpath([resolved, root]) == root for root in roots):
+        raise ValueError(f"Path is not under a shared root: {path}")
+    if not os.path.isfile(resolved):
+        raise ValueError(f"File not found: {path}")
+    return resolved
+
+
+def _get(url: str, allowed_prefixes: Sequence[str]) -> requests.Response:
+    """
+    Start a streamed GET, following redirects only to allowed URLs.
+
+    Raises:
+        ValueError: If a redirect leads outside the allowed prefixes, or there are too many
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        response = get_session().get(url, stream=True, timeout=FETCH_TIMEOUT, allow_redirects=False)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers["Location"])
+        check_url(url, allowed_prefixes)
+    raise ValueError(f"Too many redirects: {url}")
+
+
+def fetch_url(url: str, dest_dir: str, max_bytes: Optional[int] = None,
+              allowed_prefixes: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Download a URL into dest_dir, hashing it on the way. The URL itself
+    must already have been checked with check_url.
+
+    Raises:
+        requests.RequestException: If the download fails after retries
+        urllib3.exceptions.HTTPError: If the connection breaks while the body is read
+        RequestEntityTooLarge: If the document is larger than max_bytes
+        ValueError: If a redirect leads outside the allowed prefixes
+    """
+    name = secure_filename(os.path.basename(unquote(urlparse(url).path))) or "document.pdf"
+    with _get(url, allowed_prefixes) as response:
+        response.raise_for_status()
+        length = response.headers.get("Content-Length")
+        if max_bytes is not None and length and int(length) > max_bytes:
+            raise RequestEntityTooLarge()
+        if response.headers.get("Content-Type", "").startswith("application/pdf") and not name.lower().endswith(".pdf"):
+            name += ".pdf"
+        path = os.path.join(dest_dir, f"{uuid.uuid4()}_{name}")
+        # Undo any transfer compression while streaming to disk
+        response.raw.decode_content = True
+        file_hash, size = save_stream(response.raw, path, max_bytes)
+        # A body cut short without a broken connection, which older urllib3 versions do not detect
+        if length and not response.headers.get("Content-Encoding") and size != int(length):
+            os.remove(path)
+            raise requests.exceptions.ChunkedEncodingError(f"Received {size} of {length} bytes from {url}")
+    return {"path": path, "hash": file_hash, "size": size, "owned": True}
+
+
+def open_shared_path(path: str, shared_roots: Sequence[str]) -> Dict[str, Any]:
+    """Use a file on a shared volume in place; only its hash is computed"""
+    resolved = resolve_shared_path(path, shared_roots)
+    return {"path": resolved, "hash": file_digest(resolved), "size": os.path.getsize(resolved), "owned": False}
+
+
+def fetch_references(references: List[str], dest_dir: str, max_bytes: Optional[int] = None,
+                     allowed_prefixes: Sequence[str] = (), shared_roots: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    """
+    Fetch URLs and resolve shared paths concurrently.
+
+    Args:
+        references: http(s) URLs or paths on a shared volume
+        dest_dir: Where downloads are written
+        max_bytes: Size ceiling for each document
+        allowed_prefixes: URL prefixes that may be fetched, including after
+            redirects; no URL if empty
+        shared_roots: Directories whose files may be used in place
+
+    Returns:
+        One dict per reference, in order, with the reference and either "path",
+        "hash", "size" and "owned" (whether the file is a download to remove
+        later) or "error", the exception that prevented fetching it
+    """
+    def fetch(reference: str) -> Dict[str, Any]:
+        try:
+            if is_url(reference):
+                check_url(reference, allowed_prefixes)
+                document = fetch_url(reference, dest_dir, max_bytes, allowed_prefixes)
+            elif os.path.isabs(reference) and shared_roots:
+                document = open_shared_path(reference, shared_roots)
+            else:
+                raise ValueError(f"Unsupported reference: {reference}")
+        except (ValueError, OSError, RequestEntityTooLarge, requests.RequestException, Urllib3Error) as e:
+            return {"reference": reference, "error": e}
+        return dict(document, reference=reference)
+
+    if len(references) <= 1:
+        return [fetch(reference) for reference in references]
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(references))) as executor:
+        return list(executor.map(fetch, references))
+
+
+def error_status(error: Exception) -> int:
+    """HTTP status reported for a reference that could not be fetched"""
+    if isinstance(error, RequestEntityTooLarge):
+        return 413
+    if isinstance(error, (requests.RequestException, Urllib3Error)):
+        return 502
+    return 400
@@ -0,0 +1,176 @@
+"""
+Server-side page rendering
+Rasterizes PDF pages with PyMuPDF, optionally highlighting chunk boxes, and
+keeps the encoded images in a byte-bounded LRU cache
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+import fitz  # PyMuPDF
+
+try:
+    # WebP encoding is only available with Pillow installed
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import metrics
+
+# Output formats and their content types
+FORMATS = {"png": "image/png", "webp": "image/webp"}
+
+DEFAULT_DPI = int(os.environ.get("DOC_PROCESSOR_RENDER_DPI", 96))
+MIN_DPI = 36
+MAX_DPI = int(os.environ.get("DOC_PROCESSOR_RENDER_MAX_DPI", 300))
+
+# Highlight fill colour (RGB, 0-1) and opacity
+HIGHLIGHT_COLOR = (1.0, 0.85, 0.0)
+HIGHLIGHT_OPACITY = 0.35
+
+WEBP_QUALITY = 80
+
+
+def webp_available() -> bool:
+    return Image is not None
+
+
+def _to_rect(box: Dict[str, Any], page_rect: fitz.Rect) -> fitz.Rect:
+    """Page rectangle of a bounding box normalized to the 0-1 range"""
+    return fitz.Rect(
+        box["left"] * page_rect.width,
+        box["top"] * page_rect.height,
+        box["right"] * page_rect.width,
+        box["bottom"] * page_rect.height
+    )
+
+
+def render_page(doc: fitz.Document, page_num: int, dpi: int = DEFAULT_DPI,
+                boxes: Optional[List[Dict[str, Any]]] = None, fmt: str = "png") -> bytes:
+    """
+    Rasterize one page of an open document.
+
+    Args:
+        doc: Open document; highlights are drawn on it but it is never saved
+        page_num: Page number (0-based)
+        dpi: Resolution
+        boxes: Normalized bounding boxes to highlight
+        fmt: One of FORMATS
+
+    Raises:
+        ValueError: If the page or format is not available
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    if fmt == "webp" and Image is None:
+        raise ValueError("WebP output requires Pillow")
+    if not 0 <= page_num < doc.page_count:
+        raise ValueError(f"Page {page_num} does not exist")
+
+    with metrics.stage_timer("render"):
+        page = doc[page_num]
+        for box in boxes or []:
+            page.draw_rect(_to_rect(box, page.rect), color=HIGHLIGHT_COLOR, fill=HIGHLIGHT_COLOR,
+                           fill_opacity=HIGHLIGHT_OPACITY, width=0.5)
+        pixmap = page.get_pixmap(dpi=dpi, alpha=False)
+        if fmt == "png":
+            return pixmap.tobytes("png")
+        return pixmap.pil_tobytes(format="WEBP", quality=WEBP_QUALITY)
+
+
+def page_count(pdf_path: str) -> Optional[int]:
+    """Number of pages of a PDF, including pages without text, or None if it cannot be opened"""
+    try:
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+    except Exception:
+        return None
+
+
+def render_file_page(pdf_path: str, page_num: int, dpi: int = DEFAULT_DPI,
+                     boxes: Optional[List[Dict[str, Any]]] = None, fmt: str = "png") -> bytes:
+    """Rasterize one page of a PDF file, see render_page"""
+    with fitz.open(pdf_path) as doc:
+        return render_page(doc, page_num, dpi, boxes, fmt)
+
+
+class RenderCache:
+    """
+    LRU cache of rendered pages bounded by the total size of the images.
+
+    Keys are expected to come from render_key, so a render is reused across
+    batches of the same file.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key: Hashable, image: bytes) -> None:
+        # An image larger than the whole cache would only evict everything else
+        if len(image) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= len(previous)
+            self._entries[key] = image
+            self.size_bytes += len(image)
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= len(evicted)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+def render_key(file_hash: str, page: int, dpi: int, boxes: Optional[List[Dict[str, Any]]], fmt: str) -> tuple:
+    """
+    Cache key of a render. Highlights are keyed by their boxes, not by chunk
+    IDs, which name different boxes at different chunk granularities; the
+    order of the boxes does not matter.
+    """
+    highlights = {
+        tuple(round(float(box[side]), 6) for side in ("left", "top", "right", "bottom")) for box in boxes or []
+    }
+    return file_hash, page, dpi, tuple(sorted(highlights)), fmt
+
+
+def prerender(cache: RenderCache, pdf_path: str, file_hash: str, pages: int,
+              dpi: int = DEFAULT_DPI, fmt: str = "png") -> int:
+    """
+    Render the first pages of a file without highlights into the cache.
+
+    Returns:
+        Number of pages rendered
+    """
+    rendered = 0
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(min(pages, doc.page_count)):
+            key = render_key(file_hash, page_num, dpi, (), fmt)
+            if key not in cache:
+                cache.put(key, render_page(doc, page_num, dpi, fmt=fmt))
+                rendered += 1
+    return rendered
+
@@ -0,0 +1,478 @@
+"""
+Result store for processed document batches
+Keeps batches in a node-local SQLite database shared by all workers, with a
+per-worker LRU cache in front of it and TTL-based eviction
+"""
+
+import os
+import json
+import mmap
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from retrieval import ChunkIndex
+from columnar import PageChunks, compact_result, dump_result, is_columnar, load_result, to_json, write_result
+
+
+def decode_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Restore integer page numbers that JSON turned into string keys, and columnar pages"""
+    return compact_result({
+        file_path: {
+            int(page) if isinstance(page, str) and page.isdigit() else page: chunks
+            for page, chunks in pages.items()
+        } if isinstance(pages, dict) else pages
+        for file_path, pages in result.items()
+    })
+
+
+class SQLiteBackend:
+    """
+    On-disk backend shared by every worker process on the node.
+
+    Each batch is one row holding its status, its files and, once parsing has
+    finished, its JSON-encoded record including its retrieval index. While a
+    batch is parsing, its pages are committed one by one to the pages table.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS batches (
+                    batch_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    files TEXT NOT NULL,
+                    record TEXT,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS batches_expires_at ON batches (expires_at)")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pages (
+                    batch_id TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    chunks BLOB NOT NULL,
+                    PRIMARY KEY (batch_id, file_path, page)
+                )
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, batch_id: str, files: List[str], status: Dict[str, Any], expires_at: float) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO batches (batch_id, status, files, record, created_at, expires_at) "
+                "VALUES (?, ?, ?, NULL, ?, ?)",
+                (batch_id, json.dumps(status), json.dumps(files), time.time(), expires_at)
+            )
+
+    def update(self, batch_id: str, expires_at: float, status: Optional[Dict[str, Any]] = None,
+               record: Optional[Dict[str, Any]] = None) -> bool:
+        assignments, params = ["expires_at = ?"], [expires_at]
+        if status is not None:
+            assignments.append("status = ?")
+            params.append(json.dumps(status))
+        if record is not None:
+            assignments.append("record = ?")
+            params.append(json.dumps(record, default=to_json))
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE batches SET {', '.join(assignments)} WHERE batch_id = ?",
+                params + [batch_id]
+            )
+        return cursor.rowcount > 0
+
+    def put_page(self, batch_id: str, file_path: str, page: int, chunks: bytes) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR REPLACE INTO pages (batch_id, file_path, page, chunks) "
+                "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM batches WHERE batch_id = ?)",
+                (batch_id, file_path, page, chunks, batch_id)
+            )
+        return cursor.rowcount > 0
+
+    def get_pages(self, batch_id: str) -> List[tuple]:
+        return self._connect().execute(
+            "SELECT file_path, page, chunks FROM pages WHERE batch_id = ? ORDER BY file_path, page", (batch_id,)
+        ).fetchall()
+
+    def get_page_sizes(self, batch_id: str, file_path: str) -> List[Tuple[int, int]]:
+        return self._connect().execute(
+            "SELECT page, length(chunks) FROM pages WHERE batch_id = ? AND file_path = ? ORDER BY page",
+            (batch_id, file_path)
+        ).fetchall()
+
+    def iter_pages(self, batch_id: str, file_path: str) -> Iterator[Tuple[int, bytes]]:
+        # Rows are fetched one at a time, so only the current page is in memory
+        yield from self._connect().execute(
+            "SELECT page, chunks FROM pages WHERE batch_id = ? AND file_path = ? ORDER BY page",
+            (batch_id, file_path)
+        )
+
+    def delete_pages(self, batch_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM pages WHERE batch_id = ?", (batch_id,))
+
+    def get_record(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT record FROM batches WHERE batch_id = ? AND expires_at > ?", (batch_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def get_files(self, batch_id: str) -> Optional[List[str]]:
+        row = self._connect().execute(
+            "SELECT files FROM batches WHERE batch_id = ? AND expires_at > ?", (batch_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT status FROM batches WHERE batch_id = ? AND expires_at > ?", (batch_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def exists(self, batch_id: str) -> bool:
+        row = self._connect().execute(
+            "SELECT 1 FROM batches WHERE batch_id = ? AND expires_at > ?", (batch_id, time.time())
+        ).fetchone()
+        return row is not None
+
+    def delete(self, batch_id: str) -> Optional[List[str]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT files FROM batches WHERE batch_id = ?", (batch_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM batches WHERE batch_id = ?", (batch_id,))
+            conn.execute("DELETE FROM pages WHERE batch_id = ?", (batch_id,))
+        return json.loads(row[0])
+
+    def pop_expired(self, now: float) -> Dict[str, List[str]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT batch_id, files FROM batches WHERE expires_at <= ?", (now,)
+            ).fetchall()
+            conn.executemany("DELETE FROM batches WHERE batch_id = ?", [(row[0],) for row in rows])
+            conn.executemany("DELETE FROM pages WHERE batch_id = ?", [(row[0],) for row in rows])
+        return {batch_id: json.loads(files) for batch_id, files in rows}
+
+    def count(self) -> int:
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM batches WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+
+
+class ResultStore:
+    """
+    Batch result store with a size-bounded LRU cache in each worker.
+
+    Args:
+        backend: Shared storage backend (e.g. SQLiteBackend)
+        cache_size: Maximum number of decoded batch records kept in this worker
+        ttl_seconds: How long a batch is kept after its last update
+        on_evict: Called with the batch's file paths whenever a batch expires
+        blob_dir: Directory for results in the binary columnar format; these are
+            memory-mapped on load instead of being decoded from JSON
+    """
+
+    # Minimum number of seconds between two sweeps for expired batches
+    EVICTION_INTERVAL = 60
+
+    def __init__(self, backend, cache_size: int = 32, ttl_seconds: float = 24 * 3600,
+                 on_evict: Optional[Callable[[str, List[str]], None]] = None,
+                 blob_dir: Optional[str] = None):
+        self.backend = backend
+        self.blob_dir = blob_dir
+        if blob_dir:
+            os.makedirs(blob_dir, exist_ok=True)
+        self.cache_size = cache_size
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl_seconds
+
+    def _blob_path(self, batch_id: str) -> str:
+        return os.path.join(self.blob_dir, f"{batch_id}.bin")
+
+    def _write_blob(self, batch_id: str, result: Dict[str, Any]) -> None:
+        # Write to a temporary name first so other workers never map a partial file
+        path = self._blob_path(batch_id)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(dump_result(result))
+        os.replace(f"{path}.tmp", path)
+
+    def _write_committed_blob(self, batch_id: str, record: Dict[str, Any], committed: Dict[str, List[int]]) -> None:
+        """
+        Write the binary result of a batch from its committed pages, streamed
+        from the pages table, and the in-memory pages of record["result"]
+
+        Raises:
+            ValueError: If committed pages disappeared while they were read
+        """
+        files, sources = [], []
+        for file_path in record["files"]:
+            if file_path in record["result"]:
+                blobs = {page: chunks.to_bytes() for page, chunks in sorted(record["result"][file_path].items())}
+                files.append((file_path, [(page, len(blob)) for page, blob in blobs.items()]))
+                sources.append(blobs.values())
+            elif file_path in committed:
+                wanted = set(committed[file_path])
+                files.append((file_path, [
+                    (page, size) for page, size in self.backend.get_page_sizes(batch_id, file_path) if page in wanted
+                ]))
+                sources.append(
+                    chunks for page, chunks in self.backend.iter_pages(batch_id, file_path) if page in wanted
+                )
+
+        path = self._blob_path(batch_id)
+        try:
+            with open(f"{path}.tmp", "wb") as f:
+                write_result(f, files, (blob for blobs in sources for blob in blobs))
+        except ValueError:
+            os.remove(f"{path}.tmp")
+            raise
+        os.replace(f"{path}.tmp", path)
+
+    def _load_blob(self, batch_id: str) -> Dict[str, Any]:
+        with open(self._blob_path(batch_id), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return load_result(mapped)
+
+    def _remove_blob(self, batch_id: str) -> None:
+        if not self.blob_dir:
+            return
+        try:
+            os.remove(self._blob_path(batch_id))
+        except FileNotFoundError:
+            pass
+
+    def _cache_put(self, batch_id: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._cache[batch_id] = record
+            self._cache.move_to_end(batch_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, batch_id: str) -> None:
+        with self._lock:
+            self._cache.pop(batch_id, None)
+
+    def create(self, batch_id: str, files: List[str], status: Dict[str, Any]) -> None:
+        """Register a new batch before its result is available"""
+        self.evict_expired()
+        self.backend.create(batch_id, files, status, self._expires_at())
+
+    def set_status(self, batch_id: str, status: Dict[str, Any]) -> bool:
+        """Update the status of an existing batch; returns False if it no longer exists"""
+        return self.backend.update(batch_id, self._expires_at(), status=status)
+
+    def put(self, batch_id: str, record: Dict[str, Any], status: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Store the finished record of an existing batch.
+
+        Returns:
+            False if the batch was cleaned up or expired in the meantime
+        """
+        stored = dict(record)
+        if isinstance(stored.get("index"), ChunkIndex):
+            stored["index"] = stored["index"].to_dict()
+        if self.blob_dir and is_columnar(record["result"]):
+            self._write_blob(batch_id, record["result"])
+            stored["result"] = None
+            stored["result_format"] = "binary"
+        if not self.backend.update(batch_id, self._expires_at(), status=status, record=stored):
+            self._remove_blob(batch_id)
+            return False
+        self.backend.delete_pages(batch_id)
+        self._cache_put(batch_id, record)
+        return True
+
+    def put_committed(self, batch_id: str, record: Dict[str, Any], committed: Dict[str, List[int]],
+                      status: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Store the finished record of a batch whose pages were committed with
+        PageWriter while it was parsing.
+
+        The committed pages are streamed into the binary result, together with
+        the in-memory pages of record["result"] (e.g. files served from the
+        parse cache), and the retrieval index is built from the memory-mapped
+        result one page at a time, so the batch is never held in memory as a
+        whole. record["result"] and record["index"] are replaced by the stored
+        result and its index.
+
+        Args:
+            committed: Pages committed for each file that was parsed to the end
+
+        Returns:
+            False if the batch was cleaned up or expired in the meantime
+        """
+        if not self.blob_dir or not is_columnar(record["result"]):
+            partial = self.get_partial(batch_id)
+            result = dict(record["result"])
+            for file_path, pages in (partial["result"] if partial else {}).items():
+                if file_path in committed and file_path not in result:
+                    result[file_path] = {page: pages[page] for page in committed[file_path] if page in pages}
+            record["result"] = {file_path: result[file_path] for file_path in record["files"] if file_path in result}
+            record["index"] = ChunkIndex.build(record["result"])
+            return self.put(batch_id, record, status)
+
+        try:
+            self._write_committed_blob(batch_id, record, committed)
+        except ValueError:
+            return False
+        record["result"] = self._load_blob(batch_id)
+        # The pages are views into the mapped file, read one page at a time
+        record["index"] = ChunkIndex.build(record["result"])
+        stored = dict(record, result=None, result_format="binary", index=record["index"].to_dict())
+        if not self.backend.update(batch_id, self._expires_at(), status=status, record=stored):
+            self._remove_blob(batch_id)
+            return False
+        self.backend.delete_pages(batch_id)
+        self._cache_put(batch_id, record)
+        return True
+
+    def get_partial(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the pages committed so far by a batch that is still parsing,
+        as a record marked incomplete, or None if no page is available yet.
+        """
+        files = self.backend.get_files(batch_id)
+        rows = self.backend.get_pages(batch_id) if files is not None else []
+        if not rows:
+            return None
+        result = {file_path: {} for file_path in files}
+        for file_path, page, chunks in rows:
+            result.setdefault(file_path, {})[page] = PageChunks.from_buffer(chunks)
+        return {
+            "result": {file_path: pages for file_path, pages in result.items() if pages},
+            "files": files,
+            "processed_at": None,
+            "complete": False
+        }
+
+    def get(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Return the finished record of a batch, or None if it is unknown or still parsing"""
+        with self._lock:
+            record = self._cache.get(batch_id)
+            if record is not None:
+                self._cache.move_to_end(batch_id)
+
+        # Another worker may have cleaned the batch up since it was cached
+        if record is not None:
+            if self.backend.exists(batch_id):
+                return record
+            self._cache_drop(batch_id)
+            return None
+
+        record = self.backend.get_record(batch_id)
+        if record is None:
+            return None
+        if record.pop("result_format", None) == "binary":
+            if not self.blob_dir:
+                return None
+            try:
+                record["result"] = self._load_blob(batch_id)
+            except FileNotFoundError:
+                return None
+        else:
+            record["result"] = decode_result(record["result"])
+        if record.get("index") is not None:
+            record["index"] = ChunkIndex.from_dict(record["index"])
+        self._cache_put(batch_id, record)
+        return record
+
+    def get_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Return the last reported status of a batch"""
+        return self.backend.get_status(batch_id)
+
+    def __contains__(self, batch_id: str) -> bool:
+        return self.backend.exists(batch_id)
+
+    def __len__(self) -> int:
+        return self.backend.count()
+
+    @property
+    def cached_batches(self) -> int:
+        """Number of batches held in this worker's memory cache"""
+        with self._lock:
+            return len(self._cache)
+
+    def delete(self, batch_id: str) -> Optional[List[str]]:
+        """
+        Remove a batch from the store.
+
+        Returns:
+            The batch's file paths, or None if the batch was not found
+        """
+        self._cache_drop(batch_id)
+        self._remove_blob(batch_id)
+        return self.backend.delete(batch_id)
+
+    def evict_expired(self, force: bool = False) -> int:
+        """
+        Remove batches whose TTL has passed and hand their files to on_evict.
+
+        Returns:
+            Number of evicted batches
+        """
+        now = time.time()
+        if not force and now - self._last_eviction < self.EVICTION_INTERVAL:
+            return 0
+        self._last_eviction = now
+
+        expired = self.backend.pop_expired(now)
+        for batch_id, files in expired.items():
+            self._cache_drop(batch_id)
+            self._remove_blob(batch_id)
+            if self.on_evict:
+                try:
+                    self.on_evict(batch_id, files)
+                except Exception as e:
+                    print(f"Error evicting batch {batch_id}: {e}")
+        return len(expired)
+
+
+class PageWriter:
+    """
+    Picklable callable that commits parsed pages to the store from worker
+    processes, so a batch's first pages can be read before it is finished.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._backend = None
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._backend = None
+
+    def __call__(self, batch_id: str, file_path: str, page: int, chunks: PageChunks) -> bool:
+        """Commit one page; returns False if the batch no longer exists"""
+        if self._backend is None:
+            self._backend = SQLiteBackend(self.path)
+        return self._backend.put_page(batch_id, file_path, page, chunks.to_bytes())
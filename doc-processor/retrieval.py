@@ -0,0 +1,124 @@
+"""
+BM25 retrieval over the chunks of a processed batch
+The index is built once when parsing finishes and stored with the batch, so
+answering a question only touches the postings of the query terms
+"""
+
+import re
+import math
+import heapq
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase alphanumeric terms"""
+    return TOKEN_RE.findall(text.lower())
+
+
+class ChunkIndex:
+    """
+    Inverted index with BM25 scoring over the chunks of one batch.
+
+    Chunks are identified by their position in ``refs``, a list of
+    (file_path, page, chunk position) tuples pointing back into the batch result.
+    """
+
+    def __init__(self, refs: List[Tuple[str, Any, int]], lengths: List[int],
+                 postings: Dict[str, Tuple[List[int], List[int]]], k1: float = 1.2, b: float = 0.75):
+        self.refs = refs
+        self.lengths = lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+
+    @classmethod
+    def build(cls, result: Dict[str, Dict[Any, List[Dict[str, Any]]]], **params) -> "ChunkIndex":
+        """Index every chunk of a parse_documents result"""
+        return cls.from_pages(
+            ((file_path, page, chunks) for file_path, pages in result.items() for page, chunks in pages.items()),
+            **params
+        )
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[Tuple[str, Any, Sequence[Dict[str, Any]]]], **params) -> "ChunkIndex":
+        """Index the chunks of (file_path, page, chunks) tuples, taking one page at a time"""
+        refs, lengths = [], []
+        postings = {}
+        for file_path, page, chunks in pages:
+            for position, chunk in enumerate(chunks):
+                doc = len(refs)
+                terms = tokenize(chunk["text"])
+                refs.append((file_path, page, position))
+                lengths.append(len(terms))
+                for term, freq in Counter(terms).items():
+                    docs, freqs = postings.setdefault(term, ([], []))
+                    docs.append(doc)
+                    freqs.append(freq)
+        return cls(refs, lengths, postings, **params)
+
+    def __len__(self) -> int:
+        return len(self.refs)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[Tuple[str, Any, int], float]]:
+        """
+        Find the k chunks that best match a query.
+
+        Returns:
+            List of (chunk ref, score) pairs, best first
+        """
+        if not self.refs:
+            return []
+
+        doc_count = len(self.refs)
+        scores = {}
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, freqs = self.postings[term]
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc, freq in zip(docs, freqs):
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / self.avg_length) if self.avg_length else self.k1
+                scores[doc] = scores.get(doc, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.refs[doc], score) for doc, score in best]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "refs": [list(ref) for ref in self.refs],
+            "lengths": self.lengths,
+            "postings": {term: [docs, freqs] for term, (docs, freqs) in self.postings.items()},
+            "k1": self.k1,
+            "b": self.b
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChunkIndex":
+        return cls(
+            [tuple(ref) for ref in data["refs"]],
+            data["lengths"],
+            {term: (docs, freqs) for term, (docs, freqs) in data["postings"].items()},
+            k1=data["k1"],
+            b=data["b"]
+        )
+
+
+def best_chunks(index: ChunkIndex, result: Dict[str, Dict[Any, List[Dict[str, Any]]]],
+                question: str, k: int = 3) -> List[Dict[str, Any]]:
+    """Return the top-k chunks for a question with their file, page and bounding box"""
+    chunks = []
+    for (file_path, page, position), score in index.search(question, k):
+        chunk = result[file_path][page][position]
+        chunks.append({
+            "text": chunk["text"],
+            "file_path": file_path,
+            "page": page,
+            "bbox": chunk["bbox"],
+            "chunk_id": chunk["chunk_id"],
+            "score": score
+        })
+    return chunks
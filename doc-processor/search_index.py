@@ -0,0 +1,382 @@
+"""
+Organization-wide search across processed batches
+A persistent BM25 inverted index split over SQLite shard files. Batches are
+added as they finish parsing and removed when they are cleaned up or expire.
+A query first gathers the organization's term statistics from every shard so
+scores are comparable, then takes the top chunks of each shard and merges them
+"""
+
+import os
+import math
+import heapq
+import zlib
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from retrieval import tokenize
+
+# Largest number of parameters bound to one statement
+MAX_PARAMS = 500
+
+
+def _batched(items: Sequence[Any], size: int = MAX_PARAMS) -> Iterable[Sequence[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class IndexShard:
+    """
+    One SQLite file of the index, holding whole batches of any organization.
+
+    Chunks of a batch get consecutive IDs, so a batch is a range of chunk IDs.
+    Postings are clustered by (organization, term), with the chunk length
+    copied in, so scoring a term reads one contiguous range and no chunk rows.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS orgs (
+                    org_id INTEGER PRIMARY KEY,
+                    organization_id TEXT NOT NULL UNIQUE,
+                    chunks INTEGER NOT NULL DEFAULT 0,
+                    total_length INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS terms (
+                    term_id INTEGER PRIMARY KEY,
+                    term TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE IF NOT EXISTS term_stats (
+                    org_id INTEGER NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    df INTEGER NOT NULL,
+                    PRIMARY KEY (org_id, term_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS batches (
+                    batch_id TEXT PRIMARY KEY,
+                    org_id INTEGER NOT NULL,
+                    first_chunk INTEGER NOT NULL,
+                    last_chunk INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk INTEGER PRIMARY KEY,
+                    batch_id TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    left REAL, top REAL, right REAL, bottom REAL
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    org_id INTEGER NOT NULL,
+                    term_id INTEGER NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    freq INTEGER NOT NULL,
+                    length INTEGER NOT NULL,
+                    PRIMARY KEY (org_id, term_id, chunk)
+                ) WITHOUT ROWID;
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _term_ids(self, conn: sqlite3.Connection, terms: Sequence[str]) -> Dict[str, int]:
+        ids = {}
+        for group in _batched(terms):
+            ids.update(conn.execute(
+                f"SELECT term, term_id FROM terms WHERE term IN ({','.join('?' * len(group))})", group
+            ).fetchall())
+        return ids
+
+    def has_batch(self, batch_id: str) -> bool:
+        return self._connect().execute("SELECT 1 FROM batches WHERE batch_id = ?", (batch_id,)).fetchone() is not None
+
+    def add_batch(self, organization_id: str, batch_id: str, chunks: List[Dict[str, Any]]) -> None:
+        """
+        Index the chunks of a batch in one transaction.
+
+        Args:
+            chunks: Dicts with file_path, page, chunk_id, text and bbox
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO orgs (organization_id) VALUES (?)", (organization_id,))
+            org_id = conn.execute("SELECT org_id FROM orgs WHERE organization_id = ?", (organization_id,)).fetchone()[0]
+
+            first_chunk = conn.execute("SELECT COALESCE(MAX(chunk), 0) + 1 FROM chunks").fetchone()[0]
+            rows, postings = [], []
+            df = Counter()
+            total_length = 0
+            for offset, chunk in enumerate(chunks):
+                terms = Counter(tokenize(chunk["text"]))
+                length = sum(terms.values())
+                total_length += length
+                df.update(terms.keys())
+                bbox = chunk["bbox"]
+                rows.append((first_chunk + offset, batch_id, chunk["file_path"], chunk["page"], chunk["chunk_id"],
+                             chunk["text"], bbox["left"], bbox["top"], bbox["right"], bbox["bottom"]))
+                postings.extend((term, first_chunk + offset, freq, length) for term, freq in terms.items())
+
+            conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)", [(term,) for term in df])
+            term_ids = self._term_ids(conn, list(df))
+            conn.executemany(
+                "INSERT INTO postings VALUES (?, ?, ?, ?, ?)",
+                [(org_id, term_ids[term], chunk, freq, length) for term, chunk, freq, length in postings]
+            )
+            conn.executemany(
+                "INSERT INTO term_stats (org_id, term_id, df) VALUES (?, ?, ?) "
+                "ON CONFLICT (org_id, term_id) DO UPDATE SET df = df + excluded.df",
+                [(org_id, term_ids[term], count) for term, count in df.items()]
+            )
+            conn.execute(
+                "UPDATE orgs SET chunks = chunks + ?, total_length = total_length + ? WHERE org_id = ?",
+                (len(rows), total_length, org_id)
+            )
+            conn.execute(
+                "INSERT INTO batches (batch_id, org_id, first_chunk, last_chunk) VALUES (?, ?, ?, ?)",
+                (batch_id, org_id, first_chunk, first_chunk + len(rows) - 1)
+            )
+
+    def remove_batch(self, batch_id: str) -> bool:
+        """
+        Remove a batch, undoing its share of the term statistics.
+
+        Returns:
+            Whether the batch was in this shard
+        """
+        conn = self._connect()
+        with conn:
+            row = conn.execute(
+                "SELECT org_id, first_chunk, last_chunk FROM batches WHERE batch_id = ?", (batch_id,)
+            ).fetchone()
+            if row is None:
+                return False
+            org_id, first_chunk, last_chunk = row
+
+            # The batch's terms are recovered from its stored text
+            df = Counter()
+            total_length = 0
+            texts = conn.execute("SELECT text FROM chunks WHERE chunk BETWEEN ? AND ?", (first_chunk, last_chunk))
+            for (text,) in texts:
+                terms = tokenize(text)
+                total_length += len(terms)
+                df.update(set(terms))
+            term_ids = self._term_ids(conn, list(df))
+
+            conn.executemany(
+                "DELETE FROM postings WHERE org_id = ? AND term_id = ? AND chunk BETWEEN ? AND ?",
+                [(org_id, term_id, first_chunk, last_chunk) for term_id in term_ids.values()]
+            )
+            conn.executemany(
+                "UPDATE term_stats SET df = df - ? WHERE org_id = ? AND term_id = ?",
+                [(df[term], org_id, term_id) for term, term_id in term_ids.items()]
+            )
+            conn.execute("DELETE FROM term_stats WHERE org_id = ? AND df <= 0", (org_id,))
+            conn.execute(
+                "UPDATE orgs SET chunks = chunks - ?, total_length = total_length - ? WHERE org_id = ?",
+                (last_chunk - first_chunk + 1, total_length, org_id)
+            )
+            conn.execute("DELETE FROM chunks WHERE chunk BETWEEN ? AND ?", (first_chunk, last_chunk))
+            conn.execute("DELETE FROM batches WHERE batch_id = ?", (batch_id,))
+        return True
+
+    def stats(self, organization_id: str, terms: Sequence[str]) -> Optional[Dict[str, Any]]:
+        """
+        First query phase: the organization's chunk count, total length and
+        the document frequency and shard-local ID of each query term.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT org_id, chunks, total_length FROM orgs WHERE organization_id = ?", (organization_id,)
+        ).fetchone()
+        if row is None or not row[1]:
+            return None
+        org_id, chunks, total_length = row
+        term_ids = self._term_ids(conn, list(terms))
+        df = {}
+        for term, term_id in term_ids.items():
+            stat = conn.execute(
+                "SELECT df FROM term_stats WHERE org_id = ? AND term_id = ?", (org_id, term_id)
+            ).fetchone()
+            if stat:
+                df[term] = (term_id, stat[0])
+        return {"org_id": org_id, "chunks": chunks, "total_length": total_length, "df": df}
+
+    def top_chunks(self, org_id: int, weights: Dict[int, float], avg_length: float, k: int,
+                   batch_ids: Optional[Sequence[str]] = None, k1: float = 1.2, b: float = 0.75) -> List[Dict[str, Any]]:
+        """
+        Second query phase: the k best chunks of this shard scored with
+        BM25 term weights computed over the whole organization.
+
+        Args:
+            weights: IDF of each query term by shard-local term ID
+            batch_ids: Only search these batches
+
+        Returns:
+            Chunk dicts with their batch, file, page, bbox and score, best first
+        """
+        conn = self._connect()
+        if not weights:
+            return []
+
+        conditions, params = [], []
+        if batch_ids is not None:
+            ranges = []
+            for group in _batched(list(batch_ids)):
+                ranges.extend(conn.execute(
+                    f"SELECT first_chunk, last_chunk FROM batches "
+                    f"WHERE org_id = ? AND batch_id IN ({','.join('?' * len(group))})", [org_id, *group]
+                ).fetchall())
+            if not ranges:
+                return []
+            conditions.append("(" + " OR ".join("p.chunk BETWEEN ? AND ?" for _ in ranges) + ")")
+            params.extend(bound for chunk_range in ranges for bound in chunk_range)
+
+        # Scoring runs inside SQLite, which releases the GIL, so shards are scored in parallel
+        norm = "? * (1 - ? + ? * p.length / ?)" if avg_length else "?"
+        norm_params = [k1, b, b, avg_length] if avg_length else [k1]
+        query_terms = " UNION ALL ".join("SELECT ? AS term_id, ? AS idf" for _ in weights)
+        rows = conn.execute(
+            f"""
+            WITH q AS ({query_terms})
+            SELECT p.chunk, SUM(q.idf * p.freq * (? + 1) / (p.freq + {norm})) AS score
+            FROM q JOIN postings p ON p.org_id = ? AND p.term_id = q.term_id
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            GROUP BY p.chunk
+            ORDER BY score DESC
+            LIMIT ?
+            """,
+            [value for item in weights.items() for value in item] + [k1] + norm_params + [org_id] + params + [k]
+        ).fetchall()
+
+        results = []
+        for chunk, score in rows:
+            batch_id, file_path, page, chunk_id, text, left, top, right, bottom = conn.execute(
+                "SELECT batch_id, file_path, page, chunk_id, text, left, top, right, bottom FROM chunks WHERE chunk = ?",
+                (chunk,)
+            ).fetchone()
+            results.append({
+                "text": text,
+                "batch_id": batch_id,
+                "file_path": file_path,
+                "page": page,
+                "bbox": {"left": left, "top": top, "right": right, "bottom": bottom, "page": page},
+                "chunk_id": chunk_id,
+                "score": score
+            })
+        return results
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+class SearchIndex:
+    """
+    Inverted index over the batches of every organization, sharded by batch.
+
+    Each batch lives in one shard chosen from its ID, so shards grow evenly
+    and are queried concurrently. The shard count must stay the same for the
+    lifetime of the index directory.
+    """
+
+    def __init__(self, path: str, shards: int = 8, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.shards = [IndexShard(os.path.join(path, f"shard-{i}.db")) for i in range(shards)]
+        self.k1 = k1
+        self.b = b
+        self._executor = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="search-shard")
+
+    def _shard(self, batch_id: str) -> IndexShard:
+        return self.shards[zlib.crc32(batch_id.encode()) % len(self.shards)]
+
+    def add_batch(self, organization_id: str, batch_id: str,
+                  result: Dict[str, Dict[Any, List[Dict[str, Any]]]]) -> int:
+        """
+        Index every chunk of a batch result, replacing any earlier version.
+
+        Returns:
+            Number of chunks indexed
+        """
+        chunks = [
+            {
+                "file_path": file_path,
+                "page": page,
+                "chunk_id": chunk["chunk_id"],
+                "text": chunk["text"],
+                "bbox": chunk["bbox"]
+            }
+            for file_path, pages in result.items()
+            for page, page_chunks in sorted(pages.items())
+            for chunk in page_chunks
+        ]
+        self.remove_batch(batch_id)
+        self._shard(batch_id).add_batch(organization_id, batch_id, chunks)
+        return len(chunks)
+
+    def remove_batch(self, batch_id: str) -> bool:
+        """Remove a batch from the index; returns whether it was indexed"""
+        return self._shard(batch_id).remove_batch(batch_id)
+
+    def __contains__(self, batch_id: str) -> bool:
+        return self._shard(batch_id).has_batch(batch_id)
+
+    def search(self, organization_id: str, query: str, k: int = 10,
+               batch_ids: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        Find the k chunks of an organization's documents that best match a query.
+
+        Args:
+            batch_ids: Only search these batches; term statistics still cover
+                the whole organization
+
+        Returns:
+            Dict with "results", chunk dicts best first, and "chunks", the
+            number of chunks indexed for the organization
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms or k <= 0:
+            return {"results": [], "chunks": 0}
+
+        # Phase 1: organization-wide chunk count, average length and document frequencies
+        stats = list(self._executor.map(lambda shard: shard.stats(organization_id, terms), self.shards))
+        present = [(shard, stat) for shard, stat in zip(self.shards, stats) if stat]
+        doc_count = sum(stat["chunks"] for _, stat in present)
+        if not doc_count:
+            return {"results": [], "chunks": 0}
+        avg_length = sum(stat["total_length"] for _, stat in present) / doc_count
+        df = Counter()
+        for _, stat in present:
+            for term, (_, count) in stat["df"].items():
+                df[term] += count
+        idf = {term: math.log(1 + (doc_count - count + 0.5) / (count + 0.5)) for term, count in df.items()}
+
+        # Phase 2: the top k of each shard, merged by score
+        def shard_top(item):
+            shard, stat = item
+            weights = {term_id: idf[term] for term, (term_id, _) in stat["df"].items()}
+            return shard.top_chunks(stat["org_id"], weights, avg_length, k, batch_ids, self.k1, self.b)
+
+        ranked = list(self._executor.map(shard_top, present))
+        merged = heapq.merge(*ranked, key=lambda chunk: -chunk["score"])
+        return {"results": list(islice(merged, k)), "chunks": doc_count}
+
+    def count(self) -> int:
+        """Total number of indexed chunks"""
+        return sum(shard.count() for shard in self.shards)
@@ -0,0 +1,39 @@
+"""
+Shared fixtures for the document processor tests
+Run with ``python -m pytest tests`` from the doc-processor directory
+"""
+
+import os
+import sys
+import tempfile
+
+# The service modules live next to this directory and are imported flat
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the app's result store and caches out of the real data directory, and skip the simulated SDK latency
+os.environ.setdefault("DOC_PROCESSOR_DATA_DIR", tempfile.mkdtemp(prefix="doc_processor_tests_"))
+os.environ.setdefault("DOC_PROCESSOR_SIMULATED_DELAY", "0")
+
+import pytest
+
+from benchmarks.corpus import generate_pdf
+
+
+@pytest.fixture
+def make_pdf(tmp_path):
+    """Write a synthetic PDF and return its path"""
+    def make(name: str = "doc.pdf", pages: int = 2, spans_per_page: int = 10, **kwargs) -> str:
+        return generate_pdf(str(tmp_path / name), pages, spans_per_page, **kwargs)
+    return make
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """The Flask app module, imported once with the test environment"""
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,129 @@
+"""Layout-aware chunking and chunk IDs"""
+
+import io
+import shutil
+
+import pytest
+
+from chunking import CHUNK_ID_HASH_LENGTH, GRANULARITIES, build_chunks, chunk_id, file_digest, union_box
+from mock_sdk import Box, Span, iter_page_spans, parse_documents
+
+FILE_HASH = "0123456789abcdef" * 4
+
+BOX_KEYS = ("left", "top", "right", "bottom")
+
+
+def span(text, left, top, right, bottom, block, line=0):
+    return Span(text, Box(left, top, right, bottom, 0), block, line)
+
+
+def page_spans(path, page=0):
+    return dict(iter_page_spans(path, workers=1))[page]
+
+
+@pytest.mark.parametrize("layout", ["single", "columns", "table", "mixed"])
+def test_granularities_cover_every_span(make_pdf, layout):
+    spans = page_spans(make_pdf(f"{layout}.pdf", pages=1, spans_per_page=30, layout=layout))
+    counts = {}
+    for granularity in GRANULARITIES:
+        chunks = build_chunks(spans, FILE_HASH, 0, granularity)
+        counts[granularity] = len(chunks)
+        assert [chunk["chunk_id"] for chunk in chunks] == [chunk_id(FILE_HASH, 0, i) for i in range(len(chunks))]
+        # Every span ends up in exactly one chunk, in reading order
+        assert " ".join(chunk["text"].replace("\n", " ") for chunk in chunks) == " ".join(s.text for s in spans)
+
+        if granularity == "span":
+            assert all("span_boxes" not in chunk for chunk in chunks)
+            continue
+        members = [box for chunk in chunks for box in chunk["span_boxes"]]
+        assert members == [dict(zip(BOX_KEYS + ("page",), (s.box.left, s.box.top, s.box.right, s.box.bottom, 0)))
+                           for s in spans]
+        for chunk in chunks:
+            bbox = chunk["bbox"]
+            assert bbox["left"] == min(box["left"] for box in chunk["span_boxes"])
+            assert bbox["top"] == min(box["top"] for box in chunk["span_boxes"])
+            assert bbox["right"] == max(box["right"] for box in chunk["span_boxes"])
+            assert bbox["bottom"] == max(box["bottom"] for box in chunk["span_boxes"])
+            assert bbox["page"] == 0
+
+    assert counts["span"] == len(spans)
+    assert counts["span"] >= counts["line"] >= counts["block"] >= counts["paragraph"]
+
+
+def test_lines_and_blocks_follow_the_pdf_layout():
+    spans = [
+        span("Blood", 0.1, 0.10, 0.2, 0.12, block=0, line=0),
+        span("pressure", 0.2, 0.10, 0.3, 0.12, block=0, line=0),
+        span("120/80", 0.1, 0.13, 0.2, 0.15, block=0, line=1),
+        span("Pulse", 0.1, 0.30, 0.2, 0.32, block=1, line=0),
+    ]
+    lines = build_chunks(spans, FILE_HASH, 0, "line")
+    assert [chunk["text"] for chunk in lines] == ["Blood pressure", "120/80", "Pulse"]
+    assert lines[0]["bbox"] == {"left": 0.1, "top": 0.10, "right": 0.3, "bottom": 0.12, "page": 0}
+
+    blocks = build_chunks(spans, FILE_HASH, 0, "block")
+    assert [chunk["text"] for chunk in blocks] == ["Blood pressure\n120/80", "Pulse"]
+    assert blocks[0]["bbox"] == union_box([s.box for s in spans[:3]])
+    assert len(blocks[0]["span_boxes"]) == 3
+
+
+def test_paragraphs_join_closely_stacked_blocks():
+    spans = [
+        # Two lines of 0.02 height, then a block right below: one paragraph
+        span("First line", 0.1, 0.10, 0.5, 0.12, block=0, line=0),
+        span("second line", 0.1, 0.12, 0.5, 0.14, block=0, line=1),
+        span("continued", 0.1, 0.15, 0.4, 0.17, block=1),
+        # Gap larger than 0.8 line heights: a new paragraph
+        span("New paragraph", 0.1, 0.20, 0.5, 0.22, block=2),
+        # Close below, but in the other column: no horizontal overlap
+        span("Other column", 0.6, 0.22, 0.9, 0.24, block=3),
+        # Above the previous block (negative gap): not joined
+        span("Sidebar", 0.6, 0.05, 0.9, 0.07, block=4),
+    ]
+    paragraphs = build_chunks(spans, FILE_HASH, 0, "paragraph")
+    assert [chunk["text"] for chunk in paragraphs] == [
+        "First line\nsecond line\ncontinued", "New paragraph", "Other column", "Sidebar"
+    ]
+    assert paragraphs[0]["bbox"] == {"left": 0.1, "top": 0.10, "right": 0.5, "bottom": 0.17, "page": 0}
+    assert len(paragraphs[0]["span_boxes"]) == 3
+
+
+def test_unknown_granularity():
+    with pytest.raises(ValueError):
+        build_chunks([], FILE_HASH, 0, "sentence")
+
+
+def test_chunk_ids_are_stable_across_runs(make_pdf, tmp_path):
+    path = make_pdf(pages=2, spans_per_page=20, seed=7)
+    copy = str(tmp_path / "renamed.pdf")
+    shutil.copy(path, copy)
+
+    first = parse_documents([path], granularity="block")[path]
+    second = parse_documents([path], granularity="block")[path]
+    renamed = parse_documents([copy], granularity="block")[copy]
+    ids = {page: [chunk["chunk_id"] for chunk in chunks] for page, chunks in first.items()}
+    assert ids == {page: [chunk["chunk_id"] for chunk in chunks] for page, chunks in second.items()}
+    assert ids == {page: [chunk["chunk_id"] for chunk in chunks] for page, chunks in renamed.items()}
+
+    prefix = file_digest(path)[:CHUNK_ID_HASH_LENGTH]
+    assert ids[1] == [f"{prefix}-1-{index}" for index in range(len(ids[1]))]
+
+
+def test_span_boxes_are_only_returned_on_request(client, make_pdf):
+    with open(make_pdf(pages=1, spans_per_page=12, seed=8), "rb") as f:
+        content = f.read()
+    response = client.post("/process-documents", query_string={"granularity": "paragraph"},
+                           data={"files": (io.BytesIO(content), "doc.pdf")}, content_type="multipart/form-data")
+    batch_id = response.get_json()["batch_id"]
+
+    chunks = next(iter(client.get(f"/get-document-data/{batch_id}").get_json()["result"].values()))["0"]
+    assert set(chunks[0]) == {"text", "bbox", "chunk_id"}
+
+    data = client.get(f"/get-document-data/{batch_id}?span_boxes=true").get_json()
+    chunks = next(iter(data["result"].values()))["0"]
+    assert set(chunks[0]) == {"text", "bbox", "chunk_id", "span_boxes"}
+    assert sum(len(chunk["span_boxes"]) for chunk in chunks) == 12
+
+    response = client.post("/process-documents", query_string={"granularity": "sentence"},
+                           data={"files": (io.BytesIO(content), "doc.pdf")}, content_type="multipart/form-data")
+    assert response.status_code == 400
@@ -0,0 +1,88 @@
+"""Columnar chunk storage and its binary format"""
+
+import json
+import pickle
+
+import pytest
+
+from columnar import PageChunks, compact_result, dump_result, is_columnar, load_result, to_json
+
+
+def chunk(page, index, text, span_boxes=None):
+    # Coordinates are exact in float32 so they survive the round trip unchanged
+    chunk = {
+        "text": text,
+        "bbox": {"left": 0.125 * index, "top": 0.25, "right": 0.5, "bottom": 0.75, "page": page},
+        "chunk_id": f"3f2a9c-{page}-{index}"
+    }
+    if span_boxes is not None:
+        chunk["span_boxes"] = span_boxes
+    return chunk
+
+
+CHUNKS = [chunk(2, 0, "Blood pressure 120/80"), chunk(2, 1, ""), chunk(2, 3, "Température élevée ✓")]
+
+
+def test_page_round_trip():
+    page = PageChunks.from_chunks(CHUNKS, 2)
+    assert len(page) == 3
+    assert page.to_list() == CHUNKS
+    assert page[2]["text"] == "Température élevée ✓"
+    assert dict(page[-1]) == CHUNKS[-1]
+
+    loaded = PageChunks.from_buffer(page.to_bytes())
+    assert loaded.to_list() == CHUNKS
+    assert pickle.loads(pickle.dumps(page)).to_list() == CHUNKS
+    assert json.loads(json.dumps(page, default=to_json)) == CHUNKS
+
+
+def test_span_boxes_round_trip():
+    spans = [
+        chunk(0, 0, "two spans", [{"left": 0.0, "top": 0.25, "right": 0.5, "bottom": 0.5, "page": 0},
+                                  {"left": 0.5, "top": 0.25, "right": 1.0, "bottom": 0.5, "page": 0}]),
+        chunk(0, 1, "no spans", [])
+    ]
+    page = PageChunks.from_buffer(PageChunks.from_chunks(spans, 0).to_bytes())
+    assert page.to_list() == spans
+
+
+def test_empty_page():
+    page = PageChunks.from_buffer(PageChunks.from_chunks([], 0).to_bytes())
+    assert len(page) == 0
+    assert page.to_list() == []
+
+
+@pytest.mark.parametrize("chunks", [
+    [dict(chunk(0, 0, "x"), extra=1)],
+    [dict(chunk(0, 0, "x"), chunk_id="not-an-id-on-page-0")],
+    [chunk(1, 0, "x")],
+    [chunk(0, 0, "x"), dict(chunk(0, 1, "y"), chunk_id="other-0-1")],
+])
+def test_unsupported_chunks_are_rejected(chunks):
+    with pytest.raises((ValueError, KeyError)):
+        PageChunks.from_chunks(chunks, 0)
+
+
+def test_result_round_trip():
+    result = compact_result({
+        "/a.pdf": {2: CHUNKS, 5: [chunk(5, 0, "last page")]},
+        "/b.pdf": {0: []}
+    })
+    assert is_columnar(result)
+
+    loaded = load_result(dump_result(result))
+    assert list(loaded) == ["/a.pdf", "/b.pdf"]
+    assert list(loaded["/a.pdf"]) == [2, 5]
+    assert {path: {page: chunks.to_list() for page, chunks in pages.items()} for path, pages in loaded.items()} == \
+        {"/a.pdf": {2: CHUNKS, 5: [chunk(5, 0, "last page")]}, "/b.pdf": {0: []}}
+
+    with pytest.raises(ValueError):
+        load_result(b"\0" * 64)
+
+
+def test_pages_outside_the_format_stay_lists():
+    odd = [{"text": "no id", "bbox": {"left": 0, "top": 0, "right": 1, "bottom": 1, "page": 0}}]
+    result = compact_result({"/a.pdf": {0: odd, 1: [chunk(1, 0, "fits")]}})
+    assert result["/a.pdf"][0] is odd
+    assert isinstance(result["/a.pdf"][1], PageChunks)
+    assert not is_columnar(result)
@@ -0,0 +1,161 @@
+"""Document data and manifest endpoints"""
+
+import io
+import json
+import time
+
+import fitz
+import pytest
+
+from columnar import load_result
+
+
+@pytest.fixture
+def upload(client):
+    """Post a PDF to /process-documents and return the response body"""
+    def post(path, name="doc.pdf", **params):
+        with open(path, "rb") as f:
+            content = f.read()
+        response = client.post("/process-documents", query_string=params,
+                               data={"files": (io.BytesIO(content), name)}, content_type="multipart/form-data")
+        return response.get_json()
+    return post
+
+
+def wait_for_batch(client, batch_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(f"/batch-status/{batch_id}").get_json()
+        if status.get("finished_at"):
+            return status
+        time.sleep(0.05)
+    raise TimeoutError(f"Batch {batch_id} did not finish")
+
+
+@pytest.fixture
+def fitz_opens(monkeypatch):
+    """Files opened with fitz.open in this process; new empty documents are not counted"""
+    opened = []
+    original = fitz.open
+
+    def counting_open(*args, **kwargs):
+        if args:
+            opened.append(args[0])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(fitz, "open", counting_open)
+    return opened
+
+
+def test_page_counts_come_from_the_parse(client, upload, make_pdf, fitz_opens):
+    path = make_pdf("counted.pdf", pages=3, seed=101)
+
+    first = upload(path)
+    assert not first["cache_hit"]
+    assert len(fitz_opens) == 1
+
+    second = upload(path)
+    assert second["cache_hit"]
+    assert len(fitz_opens) == 1
+    manifest = client.get(f"/document-manifest/{second['batch_id']}").get_json()
+    assert manifest["files"][0]["page_count"] == 3
+    assert len(fitz_opens) == 1
+
+
+def test_background_jobs_record_page_counts(client, upload, make_pdf, fitz_opens):
+    batch = upload(make_pdf("queued.pdf", pages=3, seed=102), **{"async": "true"})
+    assert wait_for_batch(client, batch["batch_id"])["status"] == "done"
+
+    manifest = client.get(f"/document-manifest/{batch['batch_id']}").get_json()
+    assert manifest["complete"]
+    assert manifest["files"][0]["page_count"] == 3
+    # Parsed in the job's worker processes; the web worker never opens the file
+    assert fitz_opens == []
+
+
+@pytest.fixture
+def batch(client, upload, make_pdf, tmp_path):
+    """Sync batch of two files; the second has a blank page 1 between pages with text"""
+    first = make_pdf("first.pdf", pages=2, spans_per_page=8, seed=103)
+    with fitz.open(make_pdf("source.pdf", pages=3, spans_per_page=8, seed=104)) as doc:
+        doc.new_page(pno=1)
+        second = str(tmp_path / "second.pdf")
+        doc.save(second)
+
+    files = []
+    for path, name in ((first, "first.pdf"), (second, "second.pdf")):
+        with open(path, "rb") as f:
+            files.append((io.BytesIO(f.read()), name))
+    response = client.post("/process-documents", data={"files": files}, content_type="multipart/form-data")
+    assert response.status_code == 200
+    return response.get_json()["batch_id"]
+
+
+def pages_of(data, name):
+    """Pages of the file of a /get-document-data response whose name ends with name"""
+    (pages,) = [pages for path, pages in data["result"].items() if path.endswith(name)]
+    return pages
+
+
+def test_document_data(client, batch):
+    data = client.get(f"/get-document-data/{batch}").get_json()
+    assert [name.rsplit("_", 1)[1] for name in data["files"]] == ["first.pdf", "second.pdf"]
+    assert data["complete"]
+    assert list(pages_of(data, "first.pdf")) == ["0", "1"]
+    assert list(pages_of(data, "second.pdf")) == ["0", "2", "3"]
+    assert set(pages_of(data, "first.pdf")["0"][0]) == {"text", "bbox", "chunk_id"}
+
+
+def test_document_data_selection(client, batch):
+    data = client.get(f"/get-document-data/{batch}?file=1&page_start=2&page_end=2").get_json()
+    assert len(data["result"]) == 1
+    assert list(pages_of(data, "second.pdf")) == ["2"]
+
+    name = data["files"][0]
+    data = client.get(f"/get-document-data/{batch}?file={name}&page_start=1&fields=chunk_id,bbox").get_json()
+    assert len(data["result"]) == 1
+    pages = pages_of(data, "first.pdf")
+    assert list(pages) == ["1"]
+    assert all(set(chunk) == {"chunk_id", "bbox"} for chunk in pages["1"])
+
+    assert client.get(f"/get-document-data/{batch}?file=missing.pdf").get_json()["result"] == {}
+    assert client.get(f"/get-document-data/{batch}?page_start=first").status_code == 400
+    assert client.get("/get-document-data/unknown").status_code == 404
+
+
+def test_document_data_ndjson(client, batch):
+    full = client.get(f"/get-document-data/{batch}?fields=text").get_json()
+    first, second = full["files"]
+    response = client.get(f"/get-document-data/{batch}?format=ndjson&fields=text")
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0]["type"] == "batch" and lines[0]["files"] == full["files"] and lines[0]["complete"]
+    # One line per page, files in upload order and pages in order
+    assert [(line["file"], line["page"]) for line in lines[1:]] == \
+        [(first, 0), (first, 1), (second, 0), (second, 2), (second, 3)]
+    assert lines[-1]["chunks"] == pages_of(full, "second.pdf")["3"]
+
+
+def test_document_data_binary(client, batch):
+    # The binary format holds the complete chunks, including span_boxes
+    full = client.get(f"/get-document-data/{batch}?span_boxes=true").get_json()
+    response = client.get(f"/get-document-data/{batch}?format=binary&file=1&page_end=2")
+    assert response.mimetype == "application/octet-stream"
+    result = load_result(response.get_data())
+    assert list(result) == [full["files"][1]]
+    expected = pages_of(full, "second.pdf")
+    assert {page: chunks.to_list() for page, chunks in result[full["files"][1]].items()} == \
+        {0: expected["0"], 2: expected["2"]}
+
+
+def test_document_manifest(client, batch):
+    manifest = client.get(f"/document-manifest/{batch}").get_json()
+    assert manifest["complete"]
+    first, second = manifest["files"]
+    assert (first["page_count"], first["text_page_count"]) == (2, 2)
+    # The blank page counts towards the file's pages but has no chunks
+    assert (second["page_count"], second["text_page_count"]) == (4, 3)
+    assert list(second["page_chunk_counts"]) == ["0", "2", "3"]
+    assert second["chunk_count"] == sum(second["page_chunk_counts"].values())
+    assert "result" not in manifest
+    assert client.get("/document-manifest/unknown").status_code == 404
@@ -0,0 +1,108 @@
+"""Background job queue status lifecycle"""
+
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, BatchRemoved, JobQueue, _parse_file_pages, initial_status
+
+
+def parse_stub(file_paths, delay=0.0, **options):
+    """Stand-in for parse_documents that fails for paths containing "bad" """
+    time.sleep(delay)
+    if any("bad" in path for path in file_paths):
+        raise ValueError("cannot parse")
+    return {path: {0: [{"text": path}]} for path in file_paths}
+
+
+def pages_stub(file_path, page_counts, **options):
+    page_counts[file_path] = 4
+    for page in range(3):
+        yield page, [{"text": f"{file_path} {page}"}]
+
+
+@pytest.fixture
+def queue():
+    updates, completed = [], {}
+    done = threading.Event()
+
+    def on_complete(batch_id, job, status):
+        completed[batch_id] = (job, status)
+        done.set()
+
+    job_queue = JobQueue(parse_stub, max_workers=2, on_update=lambda batch_id, status: updates.append(status),
+                         on_complete=on_complete)
+    job_queue.updates, job_queue.completed, job_queue.done = updates, completed, done
+    yield job_queue
+    job_queue.shutdown()
+
+
+def test_initial_status_counts_done_files():
+    status = initial_status("b", ["/a.pdf", "/b.pdf"], done=["/a.pdf"])
+    assert status["status"] == RUNNING
+    assert status["files_done"] == 1
+    assert [f["status"] for f in status["files"]] == [DONE, QUEUED]
+    assert status["finished_at"] is None
+    assert initial_status("b", ["/a.pdf"], done=["/a.pdf"])["finished_at"] is not None
+
+
+def test_batch_state():
+    assert JobQueue._batch_state([QUEUED, QUEUED]) == QUEUED
+    assert JobQueue._batch_state([DONE, RUNNING]) == RUNNING
+    assert JobQueue._batch_state([DONE, QUEUED]) == RUNNING
+    assert JobQueue._batch_state([FAILED, FAILED]) == FAILED
+    assert JobQueue._batch_state([DONE, FAILED]) == DONE
+
+
+def test_job_runs_to_completion_with_per_file_outcomes(queue):
+    status = queue.submit("batch", ["/one.pdf", "/bad.pdf"], delay=0.2)
+    assert status["status"] in (QUEUED, RUNNING)
+    assert status["files_total"] == 2
+
+    assert queue.done.wait(60)
+    job, final = queue.completed["batch"]
+    assert final["status"] == DONE
+    assert final["files_done"] == 2
+    assert final["finished_at"] is not None
+    files = {f["file"]: f for f in final["files"]}
+    assert files["one.pdf"]["status"] == DONE
+    assert files["bad.pdf"]["status"] == FAILED
+    assert files["bad.pdf"]["error"] == "cannot parse"
+    assert set(job["result"]) == {"/one.pdf"}
+    # Intermediate progress was reported and the finished job is no longer tracked
+    assert queue.updates and queue.updates[0]["files_done"] == 1
+    assert queue.status("batch") is None
+
+
+def test_cached_files_are_not_parsed_again(queue):
+    cached = {"/cached.pdf": {0: [{"text": "cached"}]}}
+    queue.submit("batch", ["/cached.pdf", "/new.pdf"], cached=cached)
+    assert queue.done.wait(60)
+    job, final = queue.completed["batch"]
+    assert job["result"]["/cached.pdf"] == cached["/cached.pdf"]
+    assert final["files_done"] == 2
+
+
+def test_forget_drops_the_batch(queue):
+    queue.submit("batch", ["/one.pdf"], delay=0.5)
+    assert queue.forget("batch") == ["/one.pdf"]
+    assert queue.status("batch") is None
+    assert queue.forget("batch") is None
+
+
+def test_page_parsing_raises_when_the_batch_is_removed():
+    written = []
+
+    def writer(batch_id, file_path, page, chunks):
+        written.append(page)
+        return page < 1
+
+    with pytest.raises(BatchRemoved):
+        _parse_file_pages(pages_stub, writer, "batch", "/doc.pdf", {})
+    assert written == [0, 1]
+
+    result, page_counts, _ = _parse_file_pages(pages_stub, lambda *args: True, "batch", "/doc.pdf", {})
+    # Only the numbers of the committed pages are sent back
+    assert result == {"/doc.pdf": [0, 1, 2]}
+    assert page_counts == {"/doc.pdf": 4}
@@ -0,0 +1,68 @@
+"""Metrics registry and node-wide aggregation"""
+
+import json
+import os
+import subprocess
+import sys
+
+from metrics import Registry, SharedMetrics
+
+
+def test_registry_merges_snapshots():
+    registry, worker = Registry(), Registry()
+    registry.inc("doc_processor_pages_total", 2)
+    worker.inc("doc_processor_pages_total", 3)
+    worker.observe("doc_processor_stage_seconds", 0.002, stage="get_text")
+    registry.merge(worker.drain())
+    assert registry.counter("doc_processor_pages_total") == 5
+    assert registry.stage_seconds(["get_text"]) == 0.002
+    assert worker.counter("doc_processor_pages_total") == 0
+
+    text = registry.render()
+    assert "doc_processor_pages_total 5" in text
+    assert 'doc_processor_stage_seconds_count{stage="get_text"} 1' in text
+    assert "doc_processor_pages_per_second 2500" in text
+
+
+def test_shared_metrics_cover_every_worker(tmp_path):
+    path = str(tmp_path / "metrics")
+    one, two = Registry(), Registry()
+    one.inc("doc_processor_files_total")
+    two.inc("doc_processor_files_total", 2)
+    two.observe("doc_processor_request_seconds", 0.1, endpoint="/health", method="GET")
+    SharedMetrics(path, one, interval=0, worker_gauges=lambda: [("cache_entries", "Cached", 4)]).flush()
+    node = SharedMetrics(path, two, interval=0, worker_gauges=lambda: [("cache_entries", "Cached", 1)])
+
+    merged, gauges = node.collect()
+    assert merged.counter("doc_processor_files_total") == 3
+    assert "doc_processor_request_seconds_count" in merged.render()
+    assert gauges == [("cache_entries", "Cached", 5)]
+
+    # Scraping again does not count anything twice
+    assert node.collect()[0].counter("doc_processor_files_total") == 3
+
+
+def test_exited_workers_are_archived(tmp_path):
+    path = str(tmp_path / "metrics")
+    exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    dead_pid = int(exited.stdout)
+    os.makedirs(path)
+    with open(os.path.join(path, f"{dead_pid}-old.json"), "w") as f:
+        json.dump({"histograms": [], "counters": [["doc_processor_files_total", [], 7]],
+                   "gauges": [["cache_entries", "Cached", 9]]}, f)
+
+    node = SharedMetrics(path, Registry(), interval=0)
+    merged, gauges = node.collect()
+    assert merged.counter("doc_processor_files_total") == 7
+    assert gauges == []
+    assert not os.path.exists(os.path.join(path, f"{dead_pid}-old.json"))
+    assert os.path.exists(os.path.join(path, SharedMetrics.ARCHIVE))
+    assert node.collect()[0].counter("doc_processor_files_total") == 7
+
+
+def test_metrics_endpoint(client):
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert 'doc_processor_request_seconds_count{endpoint="/health",method="GET"}' in response.get_data(as_text=True)
+    assert "doc_processor_render_cache_entries" in response.get_data(as_text=True)
@@ -0,0 +1,40 @@
+"""Page- and file-parallel parsing must match the sequential path exactly"""
+
+import pytest
+
+import mock_sdk
+from columnar import dump_result
+from mock_sdk import iter_page_spans, parse_documents
+
+
+@pytest.fixture(scope="module")
+def long_pdf(tmp_path_factory):
+    from benchmarks.corpus import generate_pdf
+    return generate_pdf(str(tmp_path_factory.mktemp("parallel") / "long.pdf"), 60, 40, layout="mixed", seed=11)
+
+
+@pytest.mark.parametrize("run_size", [mock_sdk.PAGE_RUN_SIZE, 3])
+def test_page_parallel_spans_match_sequential(long_pdf, monkeypatch, run_size):
+    monkeypatch.setattr(mock_sdk, "PAGE_RUN_SIZE", run_size)
+    sequential = list(iter_page_spans(long_pdf, workers=1))
+    parallel = list(iter_page_spans(long_pdf, workers=4, min_pages_for_parallel=2))
+    assert [page for page, _ in parallel] == list(range(60))
+    assert parallel == sequential
+
+    selected = [0, 5, 6, 7, 30, 59, 75]
+    assert list(iter_page_spans(long_pdf, pages=selected, workers=4, min_pages_for_parallel=2)) == \
+        list(iter_page_spans(long_pdf, pages=selected, workers=1))
+
+
+def test_parallel_parse_is_byte_identical(long_pdf, make_pdf):
+    files = [long_pdf] + [make_pdf(f"doc{i}.pdf", pages=3 + i, spans_per_page=20, seed=20 + i) for i in range(3)]
+    options = {"granularity": "paragraph"}
+
+    sequential = parse_documents(files, file_workers=1, page_workers=1, **options)
+    page_parallel = parse_documents(files, file_workers=1, page_workers=4, min_pages_for_parallel=2, **options)
+    file_parallel = parse_documents(files, file_workers=2, page_workers=2, **options)
+
+    assert list(sequential) == files
+    expected = dump_result(sequential)
+    assert dump_result(page_parallel) == expected
+    assert dump_result(file_parallel) == expected
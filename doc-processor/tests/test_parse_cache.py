@@ -0,0 +1,73 @@
+"""Content-addressed parse cache"""
+
+import sqlite3
+
+from columnar import PageChunks
+from parse_cache import DiskTier, ParseCache, cache_key
+
+
+def pages(text):
+    chunks = [{
+        "text": text,
+        "bbox": {"left": 0.1, "top": 0.1, "right": 0.9, "bottom": 0.2, "page": 0},
+        "chunk_id": "abc-0-0"
+    }]
+    return {0: PageChunks.from_chunks(chunks, 0)}
+
+
+def test_cache_key_depends_on_options_not_their_order():
+    assert cache_key("abc") == "abc"
+    assert cache_key("abc", {}) == "abc"
+    assert cache_key("abc", {"granularity": "line", "pages": [0, 1]}) == \
+        cache_key("abc", {"pages": [0, 1], "granularity": "line"})
+    assert cache_key("abc", {"granularity": "line"}) != cache_key("abc", {"granularity": "block"})
+    assert cache_key("abc", {"granularity": "line"}) != cache_key("abd", {"granularity": "line"})
+
+
+def test_memory_tier_hits_and_lru_eviction():
+    cache = ParseCache(max_entries=2)
+    assert cache.get("a") is None
+    cache.put("a", pages("a"), 3)
+    cache.put("b", pages("b"))
+    cached, page_count = cache.get("a")
+    assert cached[0][0]["text"] == "a"
+    assert page_count == 3
+    cache.put("c", pages("c"))
+    # "b" was least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_disk_tier_is_shared_across_instances(tmp_path):
+    path = str(tmp_path / "cache" / "parse_cache.db")
+    ParseCache(disk_tier=DiskTier(path)).put("key", pages("from disk"), 7)
+
+    cache = ParseCache(disk_tier=DiskTier(path))
+    assert len(cache) == 0
+    cached, page_count = cache.get("key")
+    assert page_count == 7
+    assert cached[0][0]["text"] == "from disk"
+    assert cached[0][0]["chunk_id"] == "abc-0-0"
+    assert len(cache) == 1
+    assert cache.hits == 1
+
+
+def test_disk_tier_keeps_the_newest_entries(tmp_path):
+    tier = DiskTier(str(tmp_path / "parse_cache.db"), max_entries=2)
+    for key in ("a", "b", "c"):
+        tier.put(key, {0: [{"text": key}]})
+    assert tier.get("a") is None
+    assert tier.get("c") == ({0: [{"text": "c"}]}, None)
+
+
+def test_disk_tier_adds_the_page_count_to_old_caches(tmp_path):
+    path = str(tmp_path / "parse_cache.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE parse_cache (key TEXT PRIMARY KEY, pages BLOB NOT NULL, accessed_at REAL NOT NULL)")
+        conn.execute("INSERT INTO parse_cache VALUES ('old', '{\"0\": [{\"text\": \"old\"}]}', 0)")
+    tier = DiskTier(path)
+    assert tier.get("old") == ({0: [{"text": "old"}]}, None)
+    tier.put("new", {0: [{"text": "new"}]}, 2)
+    assert tier.get("new") == ({0: [{"text": "new"}]}, 2)
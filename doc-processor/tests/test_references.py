@@ -0,0 +1,165 @@
+"""Fetching documents by reference, against a local HTTP server"""
+
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from urllib3.exceptions import HTTPError as Urllib3Error
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from references import check_url, error_status, fetch_references, fetch_url, url_allowed
+
+PDF = b"%PDF-1.4\n" + b"0" * 4096 + b"\n%%EOF\n"
+
+
+class StorageHandler(BaseHTTPRequestHandler):
+    """Serves PDF, failing, truncated and redirecting responses depending on the path"""
+
+    hits = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _send_pdf(self, body=PDF, length=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body) if length is None else length))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.hits[self.path] = self.hits.get(self.path, 0) + 1
+        if self.path == "/docs/flaky.pdf" and self.hits[self.path] < 3:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/docs/truncated.pdf":
+            self._send_pdf(PDF[:100], length=len(PDF))
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+        elif self.path == "/docs/missing.pdf":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path.startswith("/docs/redirect"):
+            target = "/docs/doc.pdf" if self.path == "/docs/redirect-in.pdf" else "/private/secret.pdf"
+            self.send_response(302)
+            self.send_header("Location", target)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self._send_pdf()
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StorageHandler)
+    StorageHandler.hits = {}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def prefixes(server):
+    return [f"{server}/docs/"]
+
+
+def test_fetch_url_downloads_and_hashes(server, prefixes, tmp_path):
+    document = fetch_url(f"{server}/docs/doc.pdf", str(tmp_path), allowed_prefixes=prefixes)
+    assert document["owned"]
+    assert document["size"] == len(PDF)
+    with open(document["path"], "rb") as f:
+        assert f.read() == PDF
+
+
+def test_transient_errors_are_retried(server, prefixes, tmp_path):
+    document = fetch_url(f"{server}/docs/flaky.pdf", str(tmp_path), allowed_prefixes=prefixes)
+    assert document["size"] == len(PDF)
+    assert StorageHandler.hits["/docs/flaky.pdf"] == 3
+
+
+def test_documents_over_the_size_limit_are_rejected(server, prefixes, tmp_path):
+    with pytest.raises(RequestEntityTooLarge):
+        fetch_url(f"{server}/docs/doc.pdf", str(tmp_path), max_bytes=100, allowed_prefixes=prefixes)
+    assert os.listdir(tmp_path) == []
+
+
+def test_truncated_downloads_fail_and_leave_no_file(server, prefixes, tmp_path):
+    with pytest.raises((Urllib3Error, requests.RequestException)) as info:
+        fetch_url(f"{server}/docs/truncated.pdf", str(tmp_path), allowed_prefixes=prefixes)
+    assert error_status(info.value) == 502
+    assert os.listdir(tmp_path) == []
+
+
+def test_redirects_are_only_followed_to_allowed_urls(server, prefixes, tmp_path):
+    document = fetch_url(f"{server}/docs/redirect-in.pdf", str(tmp_path), allowed_prefixes=prefixes)
+    assert document["size"] == len(PDF)
+    with pytest.raises(ValueError):
+        fetch_url(f"{server}/docs/redirect-out.pdf", str(tmp_path), allowed_prefixes=prefixes)
+    assert "/private/secret.pdf" not in StorageHandler.hits
+
+
+def test_urls_are_denied_without_prefixes():
+    with pytest.raises(ValueError):
+        check_url("http://169.254.169.254/latest/meta-data/", [])
+
+
+@pytest.mark.parametrize("url, allowed", [
+    ("https://x.supabase.co/storage/v1/object/public/a.pdf", True),
+    ("https://X.SUPABASE.CO:443/storage/v1/object/a.pdf", True),
+    ("https://x.supabase.co.evil.com/storage/v1/object/a.pdf", False),
+    ("https://x.supabase.co@evil.com/storage/v1/object/a.pdf", False),
+    ("https://x.supabase.co:8443/storage/v1/object/a.pdf", False),
+    ("http://x.supabase.co/storage/v1/object/a.pdf", False),
+    ("https://x.supabase.co/storage/v1/object/../../admin", False),
+    ("https://x.supabase.co/storage/v1/object/%2e%2e/%2e%2e/admin", False),
+])
+def test_prefixes_match_scheme_host_port_and_path(url, allowed):
+    assert url_allowed(url, "https://x.supabase.co/storage/v1/object/") == allowed
+
+
+def test_fetch_references_reports_each_reference(server, prefixes, tmp_path):
+    references = [f"{server}/docs/doc.pdf", f"{server}/docs/truncated.pdf", f"{server}/docs/missing.pdf",
+                  "ftp://example.com/a.pdf"]
+    documents = fetch_references(references, str(tmp_path), allowed_prefixes=prefixes)
+    assert [document["reference"] for document in documents] == references
+    assert "path" in documents[0]
+    assert [error_status(document["error"]) for document in documents[1:]] == [502, 502, 400]
+    assert os.listdir(tmp_path) == [os.path.basename(documents[0]["path"])]
+
+
+def test_bulk_processing_reports_a_batch_or_an_error_per_reference(server, prefixes, app_module, client,
+                                                                   make_pdf, monkeypatch):
+    monkeypatch.setitem(app_module.app.config, "ALLOWED_URL_PREFIXES", prefixes)
+    with open(make_pdf(), "rb") as f:
+        monkeypatch.setattr(StorageHandler, "do_GET", _serving(f.read()))
+
+    response = client.post("/process-references", json={
+        "references": [f"{server}/docs/a.pdf", f"{server}/docs/truncated.pdf", "http://127.0.0.1:1/x.pdf"],
+        "bulk": True
+    })
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["failed"] == 2
+    ok, truncated, outside = body["batches"]
+    assert ok["status_code"] == 200 and ok["batch_id"]
+    assert truncated["status_code"] == 502
+    assert outside["status_code"] == 400
+    assert client.delete(f"/cleanup/{ok['batch_id']}").status_code == 200
+
+
+def _serving(pdf):
+    """A do_GET serving a real PDF, except for the truncated path"""
+    original = StorageHandler.do_GET
+
+    def do_GET(self):
+        if self.path == "/docs/truncated.pdf":
+            return original(self)
+        self._send_pdf(pdf)
+    return do_GET
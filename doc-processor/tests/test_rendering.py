@@ -0,0 +1,98 @@
+"""Page rendering and the render cache"""
+
+import io
+
+import fitz
+import pytest
+
+from rendering import RenderCache, page_count, prerender, render_file_page, render_key
+
+BOX_A = {"left": 0.1, "top": 0.2, "right": 0.5, "bottom": 0.25, "page": 0}
+BOX_B = {"left": 0.1, "top": 0.3, "right": 0.9, "bottom": 0.35, "page": 0}
+
+
+def test_render_key_ignores_box_order_and_duplicates():
+    assert render_key("abc", 0, 96, [BOX_A, BOX_B], "png") == render_key("abc", 0, 96, [BOX_B, BOX_A, BOX_A], "png")
+    assert render_key("abc", 0, 96, None, "png") == render_key("abc", 0, 96, [], "png")
+
+
+@pytest.mark.parametrize("other", [
+    ("abd", 0, 96, [BOX_A], "png"),
+    ("abc", 1, 96, [BOX_A], "png"),
+    ("abc", 0, 150, [BOX_A], "png"),
+    ("abc", 0, 96, [BOX_B], "png"),
+    ("abc", 0, 96, [BOX_A, BOX_B], "png"),
+    ("abc", 0, 96, [dict(BOX_A, right=0.6)], "png"),
+    ("abc", 0, 96, [BOX_A], "webp"),
+])
+def test_render_key_distinguishes_renders(other):
+    assert render_key("abc", 0, 96, [BOX_A], "png") != render_key(*other)
+
+
+def test_render_cache_is_bounded_by_bytes():
+    cache = RenderCache(max_bytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    # "b" was least recently used
+    assert "b" not in cache
+    assert len(cache) == 2 and cache.size_bytes == 8
+
+    cache.put("a", b"12")
+    assert cache.size_bytes == 6
+    cache.put("huge", b"x" * 11)
+    assert "huge" not in cache and len(cache) == 2
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_render_file_page(make_pdf):
+    path = make_pdf(pages=2)
+    assert page_count(path) == 2
+    assert page_count(path + ".missing") is None
+
+    plain = render_file_page(path, 1, dpi=36)
+    assert plain.startswith(b"\x89PNG")
+    assert render_file_page(path, 1, dpi=36, boxes=[BOX_A]) != plain
+    assert fitz.Pixmap(render_file_page(path, 0, dpi=72)).width > fitz.Pixmap(plain).width
+
+    with pytest.raises(ValueError):
+        render_file_page(path, 2)
+    with pytest.raises(ValueError):
+        render_file_page(path, 0, fmt="gif")
+
+
+def test_prerender_fills_the_cache_once(make_pdf):
+    path = make_pdf(pages=3)
+    cache = RenderCache(max_bytes=64 * 1024 * 1024)
+    assert prerender(cache, path, "abc", 2, dpi=36) == 2
+    assert render_key("abc", 1, 36, (), "png") in cache
+    assert render_key("abc", 2, 36, (), "png") not in cache
+    assert prerender(cache, path, "abc", 5, dpi=36) == 1
+
+
+def test_highlight_renders_are_keyed_by_box(client, app_module, make_pdf):
+    with open(make_pdf(pages=1, spans_per_page=40, layout="columns"), "rb") as f:
+        content = f.read()
+
+    batches = {}
+    for granularity in ("line", "block"):
+        response = client.post("/process-documents", query_string={"granularity": granularity},
+                               data={"files": (io.BytesIO(content), "doc.pdf")}, content_type="multipart/form-data")
+        batches[granularity] = response.get_json()["batch_id"]
+
+    boxes = {
+        granularity: {
+            chunk["chunk_id"]: tuple(chunk["bbox"][side] for side in ("left", "top", "right", "bottom"))
+            for chunk in next(iter(app_module.processed_docs.get(batch_id)["result"].values()))[0]
+        }
+        for granularity, batch_id in batches.items()
+    }
+    # The same chunk ID names a different box in each granularity
+    chunk_id = next(cid for cid, box in boxes["block"].items() if boxes["line"].get(cid) != box)
+
+    url = "/render-page/{}/0/0?dpi=36&highlight=" + chunk_id
+    assert client.get(url.format(batches["line"])).headers["X-Render-Cache"] == "miss"
+    assert client.get(url.format(batches["block"])).headers["X-Render-Cache"] == "miss"
+    assert client.get(url.format(batches["block"])).headers["X-Render-Cache"] == "hit"
@@ -0,0 +1,143 @@
+"""Shared result store: batch lifecycle, eviction and partial results"""
+
+import os
+import time
+
+import pytest
+
+from columnar import PageChunks
+from result_store import PageWriter, ResultStore, SQLiteBackend
+
+
+def chunk(text, page, index):
+    return {
+        "text": text,
+        "bbox": {"left": 0.1, "top": 0.2, "right": 0.5, "bottom": 0.3, "page": page},
+        "chunk_id": f"abc-{page}-{index}"
+    }
+
+
+def record(files):
+    return {
+        "result": {path: {0: [chunk(f"{path} text", 0, 0)]} for path in files},
+        "files": files,
+        "processed_at": time.time()
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "results.db")
+
+
+@pytest.fixture
+def store(db_path, tmp_path):
+    return ResultStore(SQLiteBackend(db_path), cache_size=2, blob_dir=str(tmp_path / "blobs"))
+
+
+def test_batch_lifecycle(store, db_path):
+    store.create("batch", ["/a.pdf"], {"status": "queued"})
+    assert "batch" in store
+    assert store.get("batch") is None
+    assert store.get_status("batch") == {"status": "queued"}
+
+    assert store.set_status("batch", {"status": "running"})
+    assert store.put("batch", record(["/a.pdf"]), status={"status": "done"})
+    assert store.get_status("batch") == {"status": "done"}
+    assert store.get("batch")["result"]["/a.pdf"][0][0]["text"] == "/a.pdf text"
+
+    # A second worker reads the same batch from the shared database
+    other = ResultStore(SQLiteBackend(db_path))
+    assert other.get("batch")["files"] == ["/a.pdf"]
+    assert len(other) == 1
+
+    assert store.delete("batch") == ["/a.pdf"]
+    assert "batch" not in store
+    assert store.get("batch") is None
+    assert other.get("batch") is None
+    assert store.delete("batch") is None
+
+
+def test_put_after_delete_is_refused(store):
+    store.create("batch", ["/a.pdf"], {"status": "running"})
+    store.delete("batch")
+    assert not store.set_status("batch", {"status": "done"})
+    assert not store.put("batch", record(["/a.pdf"]))
+    assert store.get("batch") is None
+
+
+def test_memory_cache_is_bounded(store):
+    for batch_id in ("one", "two", "three"):
+        store.create(batch_id, ["/a.pdf"], {})
+        store.put(batch_id, record(["/a.pdf"]))
+    assert store.cached_batches == 2
+    assert len(store) == 3
+    assert store.get("one") is not None
+
+
+def test_expired_batches_are_evicted(db_path):
+    evicted = []
+    store = ResultStore(SQLiteBackend(db_path), ttl_seconds=0,
+                        on_evict=lambda batch_id, files: evicted.append((batch_id, files)))
+    store.create("batch", ["/a.pdf"], {})
+    time.sleep(0.01)
+    assert store.evict_expired(force=True) == 1
+    assert evicted == [("batch", ["/a.pdf"])]
+    assert "batch" not in store
+    assert store.evict_expired(force=True) == 0
+
+
+def test_partial_pages_until_the_batch_is_done(store, db_path):
+    store.create("batch", ["/a.pdf", "/b.pdf"], {"status": "running"})
+    assert store.get_partial("batch") is None
+
+    writer = PageWriter(db_path)
+    assert writer("batch", "/a.pdf", 1, PageChunks.from_chunks([chunk("second page", 1, 0)], 1))
+    partial = store.get_partial("batch")
+    assert partial["complete"] is False
+    assert list(partial["result"]) == ["/a.pdf"]
+    assert partial["result"]["/a.pdf"][1][0]["text"] == "second page"
+
+    # Pages are dropped once the finished record is stored
+    store.put("batch", record(["/a.pdf", "/b.pdf"]))
+    assert store.get_partial("batch") is None
+    store.delete("batch")
+    assert not writer("batch", "/a.pdf", 2, PageChunks.from_chunks([chunk("late", 2, 0)], 2))
+
+
+def test_committed_pages_are_stored_from_the_pages_table(store, db_path):
+    files = ["/cached.pdf", "/parsed.pdf", "/failed.pdf"]
+    store.create("batch", files, {"status": "running"})
+    writer = PageWriter(db_path)
+    for page in (2, 0, 1):
+        writer("batch", "/parsed.pdf", page, PageChunks.from_chunks([chunk(f"parsed page {page}", page, 0)], page))
+    # Committed before the file failed, so not part of the result
+    writer("batch", "/failed.pdf", 0, PageChunks.from_chunks([chunk("partial file", 0, 0)], 0))
+
+    record = {
+        "result": {"/cached.pdf": {0: PageChunks.from_chunks([chunk("cached page", 0, 0)], 0)}},
+        "files": files,
+        "processed_at": time.time()
+    }
+    assert store.put_committed("batch", record, {"/parsed.pdf": [0, 1, 2]}, status={"status": "done"})
+    assert list(record["result"]) == ["/cached.pdf", "/parsed.pdf"]
+    assert list(record["result"]["/parsed.pdf"]) == [0, 1, 2]
+    assert record["index"].search("parsed page 1", k=1)[0][0] == ("/parsed.pdf", 1, 0)
+    assert store.get_partial("batch") is None
+
+    # Another worker maps the stored result and loads its index
+    loaded = ResultStore(SQLiteBackend(db_path), blob_dir=store.blob_dir).get("batch")
+    assert loaded["result"]["/parsed.pdf"][2][0]["text"] == "parsed page 2"
+    assert loaded["result"]["/cached.pdf"][0][0]["text"] == "cached page"
+    assert "/failed.pdf" not in loaded["result"]
+    assert loaded["index"].search("cached", k=1)[0][0] == ("/cached.pdf", 0, 0)
+
+
+def test_committed_pages_of_a_removed_batch_are_not_stored(store, db_path):
+    store.create("batch", ["/a.pdf"], {"status": "running"})
+    PageWriter(db_path)("batch", "/a.pdf", 0, PageChunks.from_chunks([chunk("page", 0, 0)], 0))
+    store.delete("batch")
+    record = {"result": {}, "files": ["/a.pdf"], "processed_at": time.time()}
+    assert not store.put_committed("batch", record, {"/a.pdf": [0]})
+    assert store.get("batch") is None
+    assert os.listdir(store.blob_dir) == []
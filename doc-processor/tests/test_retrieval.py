@@ -0,0 +1,62 @@
+"""Per-batch BM25 retrieval"""
+
+import pytest
+
+from retrieval import ChunkIndex, best_chunks, tokenize
+
+RESULT = {
+    "/a.pdf": {
+        0: [
+            {"text": "Patient history: hypertension and diabetes", "bbox": {"page": 0}, "chunk_id": "a-0-0"},
+            {"text": "Medication list: metformin 500 mg twice daily", "bbox": {"page": 0}, "chunk_id": "a-0-1"},
+        ],
+        1: [
+            {"text": "Diabetes follow-up: diabetes well controlled on metformin", "bbox": {"page": 1}, "chunk_id": "a-1-0"},
+        ]
+    },
+    "/b.pdf": {
+        0: [
+            {"text": "Surgical consent signed by the patient", "bbox": {"page": 0}, "chunk_id": "b-0-0"},
+            {"text": "", "bbox": {"page": 0}, "chunk_id": "b-0-1"},
+        ]
+    }
+}
+
+
+def test_tokenize():
+    assert tokenize("Metformin, 500-mg!") == ["metformin", "500", "mg"]
+
+
+def test_ranking():
+    index = ChunkIndex.build(RESULT)
+    assert len(index) == 5
+
+    hits = index.search("diabetes", k=5)
+    # The chunk mentioning the term twice ranks first, chunks without it are left out
+    assert [ref for ref, _ in hits] == [("/a.pdf", 1, 0), ("/a.pdf", 0, 0)]
+    assert hits[0][1] > hits[1][1] > 0
+
+    # A rare term outweighs a common one
+    assert index.search("patient consent", k=1)[0][0] == ("/b.pdf", 0, 0)
+    assert len(index.search("metformin diabetes patient", k=2)) == 2
+    assert index.search("unknown words") == []
+    assert ChunkIndex.build({}).search("diabetes") == []
+
+
+def test_round_trip_keeps_scores():
+    index = ChunkIndex.build(RESULT)
+    restored = ChunkIndex.from_dict(index.to_dict())
+    assert restored.search("metformin daily", k=3) == index.search("metformin daily", k=3)
+
+
+def test_best_chunks():
+    chunks = best_chunks(ChunkIndex.build(RESULT), RESULT, "surgical consent", k=3)
+    assert [chunk["chunk_id"] for chunk in chunks] == ["b-0-0"]
+    assert chunks[0]["file_path"] == "/b.pdf" and chunks[0]["page"] == 0
+
+
+@pytest.mark.parametrize("top_k", ["many", 0, 10 ** 6])
+def test_ask_question_rejects_bad_top_k(client, top_k):
+    response = client.post("/ask-question", json={"batch_id": "missing", "question": "q", "top_k": top_k})
+    assert response.status_code == 400
+    assert "top_k" in response.get_json()["error"]
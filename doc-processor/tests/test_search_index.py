@@ -0,0 +1,90 @@
+"""Sharded organization-wide search index"""
+
+import pytest
+
+from retrieval import ChunkIndex
+from search_index import SearchIndex
+
+TEXTS = [
+    "Patient history: hypertension and diabetes",
+    "Medication list: metformin 500 mg twice daily",
+    "Diabetes follow-up: diabetes well controlled on metformin",
+    "Surgical consent signed by the patient",
+    "Post-operative notes: wound healing, no infection",
+    "Discharge summary: continue metformin, review blood pressure",
+]
+
+
+def batch_result(name, texts):
+    return {
+        f"/{name}.pdf": {
+            page: [{
+                "text": text,
+                "bbox": {"left": 0.1, "top": 0.1 * index, "right": 0.9, "bottom": 0.1 * index + 0.05, "page": page},
+                "chunk_id": f"{name}-{page}-{index}"
+            } for index, text in enumerate(texts[page * 2:page * 2 + 2])]
+            for page in range((len(texts) + 1) // 2)
+        }
+    }
+
+
+@pytest.fixture
+def index(tmp_path):
+    search_index = SearchIndex(str(tmp_path / "search"), shards=4)
+    yield search_index
+    search_index._executor.shutdown()
+
+
+def test_sharded_scores_match_a_single_index(index):
+    batches = {f"batch-{i}": batch_result(f"doc{i}", TEXTS[i:] + TEXTS[:i]) for i in range(5)}
+    for batch_id, result in batches.items():
+        assert index.add_batch("org", batch_id, result) == len(TEXTS)
+    # The batches are spread over several shards
+    assert sum(1 for shard in index.shards if shard.count()) > 1
+
+    merged = ChunkIndex.build({path: pages for result in batches.values() for path, pages in result.items()})
+    for query in ("diabetes metformin", "patient", "blood pressure review", "no infection"):
+        found = index.search("org", query, k=10)
+        expected = merged.search(query, k=10)
+        assert found["chunks"] == len(merged)
+        assert [chunk["score"] for chunk in found["results"]] == pytest.approx([score for _, score in expected])
+
+
+def test_organizations_are_isolated(index):
+    index.add_batch("org-a", "batch-a", batch_result("a", TEXTS[:3]))
+    index.add_batch("org-b", "batch-b", batch_result("b", TEXTS[3:]))
+
+    found = index.search("org-a", "patient", k=10)
+    assert {chunk["batch_id"] for chunk in found["results"]} == {"batch-a"}
+    assert found["chunks"] == 3
+    assert index.search("org-c", "patient")["results"] == []
+    assert index.search("org-a", "")["results"] == []
+
+
+def test_batch_filter(index):
+    for i in range(4):
+        index.add_batch("org", f"batch-{i}", batch_result(f"doc{i}", TEXTS))
+
+    found = index.search("org", "metformin", k=20, batch_ids=["batch-1", "batch-3"])
+    assert {chunk["batch_id"] for chunk in found["results"]} == {"batch-1", "batch-3"}
+    assert len(found["results"]) == 6
+    assert index.search("org", "metformin", batch_ids=["unknown"])["results"] == []
+    assert index.search("org", "metformin", batch_ids=[])["results"] == []
+
+
+def test_removing_a_batch_restores_statistics(index):
+    index.add_batch("org", "batch-1", batch_result("doc1", TEXTS[:2]))
+    before = index.search("org", "diabetes metformin", k=10)
+
+    index.add_batch("org", "batch-2", batch_result("doc2", TEXTS[2:]))
+    assert "batch-2" in index
+    assert index.count() == len(TEXTS)
+
+    assert index.remove_batch("batch-2")
+    assert "batch-2" not in index
+    assert not index.remove_batch("batch-2")
+    assert index.search("org", "diabetes metformin", k=10) == before
+
+    # Re-adding a batch replaces it instead of indexing it twice
+    index.add_batch("org", "batch-1", batch_result("doc1", TEXTS[:2]))
+    assert index.count() == 2
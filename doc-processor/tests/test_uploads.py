@@ -0,0 +1,64 @@
+"""Streamed uploads and page selection"""
+
+import hashlib
+import io
+import os
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from uploads import MAX_PAGE_NUMBER, parse_page_ranges, save_stream
+
+
+@pytest.mark.parametrize("value, pages", [
+    (None, None),
+    ("", None),
+    ("3", [3]),
+    ("0-4,9", [0, 1, 2, 3, 4, 9]),
+    (" 9 , 2-3, 3 ", [2, 3, 9]),
+    (f"{MAX_PAGE_NUMBER}", [MAX_PAGE_NUMBER]),
+])
+def test_parse_page_ranges(value, pages):
+    assert parse_page_ranges(value) == pages
+
+
+@pytest.mark.parametrize("value", ["a", "1-", "-1", "4-2", "1,,2", f"0-{MAX_PAGE_NUMBER + 1}"])
+def test_parse_page_ranges_rejects_bad_selections(value):
+    with pytest.raises(ValueError):
+        parse_page_ranges(value)
+
+
+def test_save_stream_hashes_content(tmp_path):
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    dest = str(tmp_path / "upload.pdf")
+    assert save_stream(io.BytesIO(content), dest) == (hashlib.sha256(content).hexdigest(), len(content))
+    with open(dest, "rb") as f:
+        assert f.read() == content
+
+
+def test_save_stream_removes_oversized_uploads(tmp_path):
+    dest = str(tmp_path / "upload.pdf")
+    with pytest.raises(RequestEntityTooLarge):
+        save_stream(io.BytesIO(b"x" * 2048), dest, max_bytes=1024)
+    assert not os.path.exists(dest)
+
+
+def test_page_selection_does_not_satisfy_a_full_upload(client, make_pdf):
+    with open(make_pdf(pages=3), "rb") as f:
+        content = f.read()
+
+    def upload(**params):
+        return client.post("/process-documents", query_string=params,
+                           data={"files": (io.BytesIO(content), "doc.pdf")},
+                           content_type="multipart/form-data").get_json()
+
+    def text_pages(response):
+        return client.get(f"/document-manifest/{response['batch_id']}").get_json()["files"][0]["text_page_count"]
+
+    partial = upload(pages="1")
+    assert text_pages(partial) == 1
+
+    full = upload()
+    assert not full["cache_hit"]
+    assert text_pages(full) == 3
+    assert upload()["cache_hit"]
@@ -0,0 +1,100 @@
+"""
+Helpers for saving uploaded files
+"""
+
+import os
+import time
+import hashlib
+from typing import List, Optional, Tuple
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import metrics
+
+# Size of the blocks read from an upload while it is written to disk
+CHUNK_SIZE = 1024 * 1024
+
+# Highest page number accepted in a page selection
+MAX_PAGE_NUMBER = 100000
+
+
+def save_stream(stream, dest_path: str, max_bytes: Optional[int] = None) -> Tuple[str, int]:
+    """
+    Copy a stream to disk block by block, hashing its content on the way, so
+    memory use does not depend on the size of the upload.
+
+    Args:
+        stream: Readable binary stream
+        dest_path: Where to write the file
+        max_bytes: Size ceiling; the partial file is removed when it is exceeded
+
+    Returns:
+        Hex SHA-256 digest and size in bytes of the content
+
+    Raises:
+        RequestEntityTooLarge: If the stream is larger than max_bytes
+    """
+    digest = hashlib.sha256()
+    size = 0
+    start = time.perf_counter()
+    try:
+        with open(dest_path, "wb") as dest:
+            while True:
+                block = stream.read(CHUNK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if max_bytes is not None and size > max_bytes:
+                    raise RequestEntityTooLarge()
+                digest.update(block)
+                dest.write(block)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    metrics.observe_stage("save", time.perf_counter() - start)
+    metrics.count("upload_bytes", size)
+    return digest.hexdigest(), size
+
+
+def save_upload(file_storage, dest_path: str, max_bytes: Optional[int] = None) -> str:
+    """
+    Write an uploaded file to disk, hashing its content on the way.
+
+    Args:
+        file_storage: Werkzeug FileStorage from request.files
+        dest_path: Where to write the file
+        max_bytes: Size ceiling for the file
+
+    Returns:
+        Hex SHA-256 digest of the file content
+    """
+    return save_stream(file_storage.stream, dest_path, max_bytes)[0]
+
+
+def parse_page_ranges(value: Optional[str]) -> Optional[List[int]]:
+    """
+    Parse a page selection such as "0-4,9" into a sorted list of page numbers.
+
+    Returns:
+        None when no selection is given
+
+    Raises:
+        ValueError: If the selection is malformed
+    """
+    if not value:
+        return None
+    pages = set()
+    for part in value.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = (int(bound) for bound in part.split("-", 1))
+            if start < 0 or end < start or end > MAX_PAGE_NUMBER:
+                raise ValueError(f"Invalid page range: {part}")
+            pages.update(range(start, end + 1))
+        else:
+            page = int(part)
+            if page < 0 or page > MAX_PAGE_NUMBER:
+                raise ValueError(f"Invalid page number: {part}")
+            pages.add(page)
+    return sorted(pages)